@@ -13,11 +13,24 @@
 # and applies chat templates.
 ######
 
+import copy
+import ctypes
+import functools
+import hashlib
+import inspect
+import io
 import json
 import os
+import re
+import shutil
+import subprocess
+import sys
 from datetime import datetime
 from pathlib import Path
-from threading import Thread
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from threading import Condition, Event, Lock, Thread
+import queue
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union, Set
 import requests # For fetching images from URLs
 
@@ -82,6 +95,9 @@ try:
             LlavaForConditionalGeneration, PaliGemmaForConditionalGeneration, # Add known VLM classes
             Gemma3ForConditionalGeneration # Import Gemma 3 explicitly
         )
+        from transformers.generation.streamers import BaseStreamer
+        from transformers import DynamicCache, StaticCache
+        from transformers import LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
     except:
         pm.install("transformers", upgrade=True)
         from transformers import (
@@ -90,6 +106,13 @@ try:
             LlavaForConditionalGeneration, PaliGemmaForConditionalGeneration, # Add known VLM classes
             Gemma3ForConditionalGeneration # Import Gemma 3 explicitly
         )
+        from transformers.generation.streamers import BaseStreamer
+        from transformers import DynamicCache, StaticCache
+        from transformers import LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+    try:
+        from transformers.cache_utils import DynamicLayer # Caches made of layers (transformers >= 4.54)
+    except ImportError:
+        DynamicLayer = None
     from huggingface_hub import HfApi # Added imports
     # accelerate is implicitly used by device_map='auto'
     if torch.cuda.is_available():
@@ -115,6 +138,13 @@ binding_folder_name = "hugging_face"
 # Define the folder for local HF models relative to lollms_paths
 HF_LOCAL_MODELS_DIR = "transformers"
 REFERENCE_FILE_EXTENSION = ".reference"
+# GGUF types written by convert_to_gguf and their llama_cpp file type constants (F16 comes straight from the converter)
+GGUF_QUANTIZATIONS = {
+    "F16": "LLAMA_FTYPE_MOSTLY_F16",
+    "Q8_0": "LLAMA_FTYPE_MOSTLY_Q8_0",
+    "Q5_K_M": "LLAMA_FTYPE_MOSTLY_Q5_K_M",
+    "Q4_K_M": "LLAMA_FTYPE_MOSTLY_Q4_K_M",
+}
 # Mapping from model_type/architecture name fragments to classes and processor types
 # Keys should be lowercased.
 KNOWN_MODEL_CLASSES = {
@@ -150,6 +180,910 @@ class StopGenerationCriteria(StoppingCriteria):
             return True # Signal to stop generation
         return False # Signal to continue generation
 
+class StopSequencesCriteria(StoppingCriteria):
+    """
+    Stops each sequence as soon as its generated tokens end with a stop string.
+    Stop strings are tokenized once and matched on the token tail. As a stop string may be
+    tokenized differently next to the previous text, the decoded tail is checked too.
+    """
+    def __init__(self, tokenizer, stop_strings: List[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop_strings = [s for s in stop_strings if s]
+        self.stop_ids = []
+        for stop_string in self.stop_strings:
+            ids = tokenizer.encode(stop_string, add_special_tokens=False)
+            if ids:
+                self.stop_ids.append(ids)
+        # Room for tokens straddling the start of the stop string, or for a stop string spelled one character per token
+        self.tail_length = max([2 * len(ids) for ids in self.stop_ids] + [len(s) for s in self.stop_strings] + [1]) + 2
+        self.prompt_length = prompt_length
+
+    def matches(self, tokens: List[int]) -> bool:
+        """ True if the generated tokens end with a stop string. """
+        if not self.stop_strings:
+            return False
+        for ids in self.stop_ids:
+            if len(tokens) >= len(ids) and tokens[-len(ids):] == ids:
+                return True
+        tail_text = self.tokenizer.decode(tokens[-self.tail_length:], skip_special_tokens=False)
+        return any(stop_string in tail_text for stop_string in self.stop_strings)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [self.matches(row[self.prompt_length:].tolist()) for row in input_ids]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class StopStringFilter:
+    """
+    Filters streamed text against stop strings: text that might be the beginning of a stop
+    string is held back until it is known, and the text is cut before the first stop string.
+    """
+    def __init__(self, stop_strings: List[str]):
+        self.stop_strings = [s for s in stop_strings if s]
+        self.pending = ""
+        self.stopped = False
+
+    def push(self, text: str) -> str:
+        """ Returns the part of the text that can be shown. """
+        if self.stopped:
+            return ""
+        self.pending += text
+        positions = [position for position in (self.pending.find(s) for s in self.stop_strings) if position >= 0]
+        if positions:
+            self.stopped = True
+            text, self.pending = self.pending[:min(positions)], ""
+            return text
+        held = 0
+        for stop_string in self.stop_strings:
+            for length in range(min(len(stop_string) - 1, len(self.pending)), held, -1):
+                if self.pending.endswith(stop_string[:length]):
+                    held = length
+                    break
+        text, self.pending = self.pending[:len(self.pending) - held], self.pending[len(self.pending) - held:]
+        return text
+
+    def flush(self) -> str:
+        """ Returns the held back text once the generation is over. """
+        text, self.pending = self.pending, ""
+        return "" if self.stopped else text
+
+def tensor_nbytes(tensor) -> int:
+    """ Returns the memory used by a tensor, looking into the packed data and scales of quantized tensors. """
+    inner = [getattr(tensor, name) for name in ("_data", "_scale", "_shift") if isinstance(getattr(tensor, name, None), torch.Tensor)]
+    if inner:
+        return sum(tensor_nbytes(t) for t in inner)
+    return tensor.numel() * tensor.element_size()
+
+def kv_cache_nbytes(cache) -> int:
+    """ Returns the memory used by the key/value tensors of a transformers cache (quantized parts included). """
+    tensors = []
+    if hasattr(cache, "layers"):
+        for layer in cache.layers:
+            tensors += [getattr(layer, name, None) for name in ("keys", "values", "_quantized_keys", "_quantized_values")]
+    elif hasattr(cache, "key_cache"):
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+        tensors += list(getattr(cache, "_quantized_key_cache", [])) + list(getattr(cache, "_quantized_value_cache", []))
+    return sum(tensor_nbytes(t) for t in tensors if isinstance(t, torch.Tensor))
+
+if DynamicLayer is not None:
+    class SinkWindowLayer(DynamicLayer):
+        """
+        Cache layer of the sink KV policy: keeps the first num_sink_tokens tokens (attention sinks) and the most recent
+        tokens, window_length tokens in all, so its memory stays constant however long the generation runs.
+        New tokens keep their absolute positions, so when tokens are evicted the sink keys are re-rotated forward
+        (rotary_emb is the rotary embedding of the model) to sit right before the oldest kept token. The kept
+        tokens then always span consecutive positions and a query never sees a key further than window_length
+        positions away, as in StreamingLLM.
+        """
+        def __init__(self, num_sink_tokens: int, window_length: int, rotary_emb, **kwargs):
+            super().__init__(**kwargs)
+            self.num_sink_tokens = num_sink_tokens
+            self.window_length = max(window_length, num_sink_tokens + 1)
+            self.rotary_emb = rotary_emb
+            self.cumulative_length = 0
+
+        def update(self, key_states, value_states, *args, **kwargs):
+            # This forward attends to everything cached plus the new tokens, the eviction applies to the next ones
+            keys, values = super().update(key_states, value_states, *args, **kwargs)
+            self.cumulative_length += key_states.shape[-2]
+            excess = self.keys.shape[-2] - self.window_length
+            if excess > 0:
+                sink = self.num_sink_tokens
+                self.keys = torch.cat([self._rotate_forward(self.keys[:, :, :sink], excess), self.keys[:, :, sink + excess:]], dim=-2)
+                self.values = torch.cat([self.values[:, :, :sink], self.values[:, :, sink + excess:]], dim=-2)
+            return keys, values
+
+        def _rotate_forward(self, keys, shift: int):
+            """ Moves rotary embedded keys shift positions forward: R(shift) k = k cos + rotate_half(k) sin. """
+            position_ids = torch.full((1, 1), shift, dtype=torch.long, device=keys.device)
+            cos, sin = self.rotary_emb(keys.float(), position_ids)
+            scaling = getattr(self.rotary_emb, "attention_scaling", 1.0) # Applied once when the keys were embedded
+            cos, sin = (cos / scaling).unsqueeze(1), (sin / scaling).unsqueeze(1)
+            rotary_dim = cos.shape[-1] # Partial rotary models only rotate the first dimensions
+            rotated, passthrough = keys[..., :rotary_dim].float(), keys[..., rotary_dim:]
+            half = rotary_dim // 2
+            rotated = rotated * cos + torch.cat([-rotated[..., half:], rotated[..., :half]], dim=-1) * sin
+            return torch.cat([rotated.to(keys.dtype), passthrough], dim=-1)
+
+        def get_mask_sizes(self, query_length_or_cache_position) -> Tuple[int, int]:
+            # Older transformers pass the cache positions of the query instead of its length
+            query_length = query_length_or_cache_position if isinstance(query_length_or_cache_position, int) else query_length_or_cache_position.shape[0]
+            kept = super().get_seq_length()
+            return kept + query_length, self.cumulative_length - kept
+
+        def get_seq_length(self) -> int:
+            # Tokens seen, so the positions of new tokens keep counting past the evicted ones
+            return self.cumulative_length
+
+        def crop(self, max_length: int) -> None:
+            if self.cumulative_length > super().get_seq_length():
+                raise RuntimeError("The sink KV cache can't be cropped once it evicted tokens")
+            super().crop(max_length)
+            self.cumulative_length = super().get_seq_length()
+
+        def reset(self) -> None:
+            super().reset()
+            self.cumulative_length = 0
+
+    class SinkWindowCache(DynamicCache):
+        """ Dynamic cache whose layers follow the sink KV policy (see SinkWindowLayer). """
+        def __init__(self, num_sink_tokens: int, window_length: int, rotary_emb):
+            super().__init__()
+            self.layer_class_to_replicate = functools.partial(SinkWindowLayer, num_sink_tokens, window_length, rotary_emb)
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    """ Returns the length of the common prefix of two token lists. """
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+class IncrementalDetokenizer:
+    """
+    Turns a stream of token ids into text deltas without decoding the whole output again at every token.
+    Only the last few tokens are decoded (from the previous emitted boundary), and text is held back while
+    it ends with an incomplete multi-byte character; flush() returns that held back text at the end.
+    """
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.tokens: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token_id: int) -> str:
+        self.tokens.append(token_id)
+        prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset], skip_special_tokens=self.skip_special_tokens)
+        new_text = self.tokenizer.decode(self.tokens[self.prefix_offset:], skip_special_tokens=self.skip_special_tokens)
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self) -> str:
+        """ Returns the text still held back, even if it ends with an incomplete character. """
+        prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset], skip_special_tokens=self.skip_special_tokens)
+        new_text = self.tokenizer.decode(self.tokens[self.prefix_offset:], skip_special_tokens=self.skip_special_tokens)
+        self.prefix_offset = self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+def build_logits_processors(gen_kwargs: dict) -> "LogitsProcessorList":
+    """ Builds the logits processors and warpers generate() would use for the sampling parameters of gen_kwargs. """
+    processors = LogitsProcessorList()
+    if gen_kwargs.get("repetition_penalty", 1.0) != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(gen_kwargs["repetition_penalty"]))
+    if gen_kwargs.get("do_sample", False):
+        if gen_kwargs.get("temperature", 1.0) != 1.0:
+            processors.append(TemperatureLogitsWarper(gen_kwargs["temperature"]))
+        if gen_kwargs.get("top_k", 0) > 0:
+            processors.append(TopKLogitsWarper(gen_kwargs["top_k"]))
+        if gen_kwargs.get("top_p", 1.0) < 1.0:
+            processors.append(TopPLogitsWarper(gen_kwargs["top_p"]))
+    return processors
+
+class PrefixKVCacheStore:
+    """
+    LRU store of DynamicCache objects keyed by the tokens they were computed on.
+
+    A follow-up turn of a discussion starts with the tokens of the previous turn, so
+    taking the entry with the longest common prefix and cropping it to that prefix
+    leaves only the new tokens to prefill. Entries are taken out while in use (generate
+    extends them in place) and stored back under their new tokens afterwards.
+    """
+    def __init__(self, capacity_bytes: int):
+        self.capacity_bytes = capacity_bytes
+        self.entries: "OrderedDict[Tuple[int, ...], Tuple[Any, int]]" = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def take(self, input_ids: List[int]) -> Tuple[Optional[Any], int]:
+        """ Removes and returns the cache sharing the longest prefix with input_ids, cropped to that prefix. """
+        with self.lock:
+            best_key, best_length = None, 0
+            for key in self.entries:
+                length = common_prefix_length(key, input_ids)
+                if length > best_length:
+                    best_key, best_length = key, length
+            # At least one token must be left to compute the logits of the next token
+            best_length = min(best_length, len(input_ids) - 1)
+            if best_key is None or best_length <= 0:
+                self.misses += 1
+                return None, 0
+            cache, nbytes = self.entries.pop(best_key)
+            self.size -= nbytes
+        cache.crop(best_length)
+        self.hits += 1
+        self.reused_tokens += best_length
+        return cache, best_length
+
+    def put(self, tokens: List[int], cache) -> None:
+        nbytes = kv_cache_nbytes(cache)
+        if nbytes > self.capacity_bytes or not tokens:
+            return
+        with self.lock:
+            key = tuple(tokens)
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (cache, nbytes)
+            self.size += nbytes
+            while self.size > self.capacity_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.size -= evicted_bytes
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "reused_tokens": self.reused_tokens, "entries": len(self.entries), "bytes": self.size}
+
+def image_digests(images) -> Optional[List[str]]:
+    """ Content hashes of a (possibly nested) list of images tagged by ImageContentCache, None if one is untagged. """
+    if images is None:
+        return None
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    digests = []
+    for image in images:
+        if isinstance(image, (list, tuple)):
+            nested = image_digests(image)
+            if nested is None:
+                return None
+            digests.append("[" + ",".join(nested) + "]")
+        elif isinstance(image, Image.Image) and "lollms_sha256" in image.info:
+            digests.append(image.info["lollms_sha256"])
+        else:
+            return None
+    return digests
+
+class ImageContentCache:
+    """
+    Content addressed cache of the images given to vision models.
+
+    Downloaded bytes are stored once on disk under their sha256, with a small reference
+    file per url, so a url is only fetched the first time it is seen. Decoded RGB images
+    and the pixel values computed by the image processor are kept in memory LRUs keyed
+    by content hash, so asking again about the same screenshot skips decoding and resizing.
+    Images handed out are tagged with their hash in image.info["lollms_sha256"].
+    """
+    def __init__(self, folder: Path, capacity: int = 32):
+        self.folder = folder
+        self.capacity = capacity
+        self.lock = Lock()
+        self.images: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self.features: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self.file_digests: Dict[Tuple[str, int, int], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def blob_path(self, digest: str) -> Path:
+        return self.folder / "blobs" / digest
+
+    def url_ref_path(self, url: str) -> Path:
+        return self.folder / "urls" / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.ref"
+
+    def url_digest(self, url: str) -> Optional[str]:
+        """ Hash of the bytes previously downloaded for url, if they are still on disk. """
+        ref_path = self.url_ref_path(url)
+        if not ref_path.exists():
+            return None
+        digest = ref_path.read_text(encoding="utf-8").strip()
+        return digest if self.blob_path(digest).exists() else None
+
+    def store_url(self, url: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.blob_path(digest)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, blob_path)
+        ref_path = self.url_ref_path(url)
+        ref_path.parent.mkdir(parents=True, exist_ok=True)
+        ref_path.write_text(digest, encoding="utf-8")
+        return digest
+
+    def file_digest(self, path: Path) -> str:
+        """ Hash of a local file, recomputed only when its size or modification time changes. """
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.file_digests.get(key)
+        if digest is None:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            self.file_digests[key] = digest
+        return digest
+
+    def get_image(self, digest: str) -> Optional[Image.Image]:
+        with self.lock:
+            image = self.images.get(digest)
+            if image is None:
+                self.misses += 1
+                return None
+            self.images.move_to_end(digest)
+            self.hits += 1
+        return image.copy() # The caller may close its copy
+
+    def put_image(self, digest: str, image: Image.Image) -> Image.Image:
+        image = image.convert("RGB")
+        image.info["lollms_sha256"] = digest
+        with self.lock:
+            self.images[digest] = image
+            self.images.move_to_end(digest)
+            while len(self.images) > self.capacity:
+                self.images.popitem(last=False)
+        return image.copy()
+
+    def get_features(self, key: Tuple) -> Optional[Any]:
+        with self.lock:
+            features = self.features.get(key)
+            if features is not None:
+                self.features.move_to_end(key)
+        return copy.copy(features) if features is not None else None
+
+    def put_features(self, key: Tuple, features) -> None:
+        with self.lock:
+            self.features[key] = features
+            self.features.move_to_end(key)
+            while len(self.features) > self.capacity:
+                self.features.popitem(last=False)
+
+    def clear_features(self) -> None:
+        with self.lock:
+            self.features.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "images": len(self.images), "processed": len(self.features)}
+
+class CachedImageProcessor:
+    """
+    Stands in for the image processor of a vision processor and reuses the pixel values
+    it computed earlier for the same images (identified by their content hash) and the
+    same processor configuration. Calls with untagged images go straight through.
+    """
+    def __init__(self, image_processor, cache: ImageContentCache):
+        object.__setattr__(self, "image_processor", image_processor)
+        object.__setattr__(self, "cache", cache)
+        try:
+            config = image_processor.to_json_string()
+        except Exception:
+            config = repr(getattr(image_processor, "__dict__", image_processor))
+        object.__setattr__(self, "fingerprint", hashlib.sha256(f"{type(image_processor).__name__}:{config}".encode("utf-8")).hexdigest())
+
+    def __getattr__(self, name):
+        return getattr(self.image_processor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.image_processor, name, value)
+
+    def __call__(self, images=None, *args, **kwargs):
+        digests = image_digests(images)
+        if digests is None:
+            return self.image_processor(images, *args, **kwargs)
+        key = (self.fingerprint, tuple(digests), repr(args), repr(sorted(kwargs.items())))
+        features = self.cache.get_features(key)
+        if features is None:
+            features = self.image_processor(images, *args, **kwargs)
+            self.cache.put_features(key, features)
+            features = copy.copy(features)
+        return features
+
+class TemplateTokenCache:
+    """
+    Token ids of recently templated discussions, so a follow-up turn only tokenizes the text added since.
+
+    The chat template is still rendered over the whole discussion (cheap next to tokenization). When an
+    earlier rendering is a prefix of the new one, its tokens are kept up to its last special token and only
+    the text after it is tokenized. Special tokens split the text into independently tokenized pieces, which
+    the first reuse checks against a full tokenization; tokenizers where it doesn't hold are never cached.
+    Needs a fast tokenizer (character offsets).
+    """
+    def __init__(self, capacity: int = 16):
+        self.capacity = capacity
+        self.entries: "OrderedDict[str, Tuple[List[int], List[int]]]" = OrderedDict()
+        self.lock = Lock()
+        self.verified: Dict[int, bool] = {} # id(tokenizer) -> splitting at special tokens is exact
+        self.reused_tokens = 0
+        self.tokenized_tokens = 0
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.verified.clear()
+
+    def encode(self, tokenizer, text: str) -> Tuple[List[int], List[int]]:
+        """ Token ids and end offsets of text. """
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return list(encoding["input_ids"]), [end for _, end in encoding["offset_mapping"]]
+
+    def tokenize(self, tokenizer, text: str) -> List[int]:
+        if self.capacity <= 0 or not getattr(tokenizer, "is_fast", False) or self.verified.get(id(tokenizer)) is False:
+            return tokenizer(text, add_special_tokens=False)["input_ids"]
+        with self.lock:
+            prefix = max((cached for cached in self.entries if text.startswith(cached)), key=len, default=None)
+            cached_ids, cached_ends = self.entries[prefix] if prefix is not None else ([], [])
+        special_ids = set(tokenizer.all_special_ids)
+        keep = 0
+        for index in range(len(cached_ids) - 1, -1, -1):
+            if cached_ids[index] in special_ids:
+                keep = index + 1
+                break
+        if keep:
+            split = cached_ends[keep - 1]
+            new_ids, new_ends = self.encode(tokenizer, text[split:])
+            ids, ends = cached_ids[:keep] + new_ids, cached_ends[:keep] + [split + end for end in new_ends]
+            if id(tokenizer) not in self.verified:
+                full_ids, full_ends = self.encode(tokenizer, text)
+                self.verified[id(tokenizer)] = full_ids == ids
+                if full_ids != ids:
+                    ASCIIColors.warning("This tokenizer doesn't split at special tokens, the templated token cache is disabled for it.")
+                    return full_ids
+            self.reused_tokens += keep
+            self.tokenized_tokens += len(new_ids)
+        else:
+            ids, ends = self.encode(tokenizer, text)
+            self.tokenized_tokens += len(ids)
+        with self.lock:
+            self.entries[text] = (ids, ends)
+            self.entries.move_to_end(text)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return ids
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), "reused_tokens": self.reused_tokens, "tokenized_tokens": self.tokenized_tokens}
+
+class LocalModelIndex:
+    """
+    On-disk index of the local models folders.
+
+    Entries are keyed by directory path and hold the stamp they were computed for: the directory mtime, plus
+    for model directories the mtimes of config.json and of the weight files (see model_dir_stamp), which can be
+    rewritten in place without touching the directory. A scan only inspects the directories whose stamp changed.
+    """
+    VERSION = 2
+    WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pth", ".gguf", ".ggml", ".h5", ".msgpack")
+
+    def __init__(self, index_file: Path):
+        self.index_file = index_file
+        self.lock = Lock()
+        self.dirty = False
+        self.entries: Dict[str, dict] = {}
+        try:
+            if index_file.exists():
+                data = json.loads(index_file.read_text(encoding="utf-8"))
+                if data.get("version") == self.VERSION:
+                    self.entries = data.get("entries", {})
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't read the local models index {index_file}: {ex}. Rebuilding it.")
+
+    @classmethod
+    def model_dir_stamp(cls, model_path: Path) -> List[int]:
+        """ Returns the mtimes of a directory, of its config.json and of its weight files (in name order). """
+        with os.scandir(model_path) as dir_entries:
+            files = sorted((e.name, e.stat().st_mtime_ns) for e in dir_entries if e.name == "config.json" or e.name.endswith(cls.WEIGHT_SUFFIXES))
+        return [model_path.stat().st_mtime_ns] + [mtime_ns for _, mtime_ns in files]
+
+    def get(self, path: Path, stamp: List[int]) -> Optional[dict]:
+        entry = self.entries.get(str(path))
+        if entry is not None and entry.get("stamp") == stamp:
+            return entry
+        return None
+
+    def set(self, path: Path, stamp: List[int], entry: dict) -> dict:
+        with self.lock:
+            entry["stamp"] = stamp
+            self.entries[str(path)] = entry
+            self.dirty = True
+        return entry
+
+    def mark_dirty(self) -> None:
+        self.dirty = True
+
+    def prune(self, seen_paths: Set[str]) -> None:
+        """ Forgets the directories that were not seen by the last scan. """
+        with self.lock:
+            for path in [p for p in self.entries if p not in seen_paths]:
+                del self.entries[path]
+                self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                self.index_file.parent.mkdir(parents=True, exist_ok=True)
+                temp_file = self.index_file.with_suffix(".tmp")
+                temp_file.write_text(json.dumps({"version": self.VERSION, "entries": self.entries}), encoding="utf-8")
+                temp_file.replace(self.index_file)
+                self.dirty = False
+            except Exception as ex:
+                ASCIIColors.warning(f"Couldn't save the local models index {self.index_file}: {ex}")
+
+class ForwardCounter:
+    """ Counts the forward passes of some models through forward hooks. """
+    def __init__(self, **models):
+        self.counts = {name: 0 for name in models}
+        self.handles = [model.register_forward_hook(self._hook(name)) for name, model in models.items()]
+
+    def _hook(self, name: str):
+        def hook(module, inputs, outputs):
+            self.counts[name] += 1
+        return hook
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+class ResidentModelCache:
+    """
+    Keeps recently used models loaded under a memory budget, keyed by their loading settings.
+    Re-selecting a resident model swaps it in without reading its weights again.
+    """
+    def __init__(self):
+        self.entries: "OrderedDict[tuple, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: tuple, components: Dict[str, Any], nbytes: int) -> None:
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (components, nbytes)
+        self.size += nbytes
+
+    def evict(self, limit_bytes: int, keep: Optional[Any] = None) -> List[str]:
+        """ Drops the least recently used models until the total size fits in limit_bytes. The model `keep` is never dropped. """
+        evicted = []
+        for key in list(self.entries):
+            if self.size <= limit_bytes:
+                break
+            components, nbytes = self.entries[key]
+            if components["model"] is keep:
+                continue
+            del self.entries[key]
+            self.size -= nbytes
+            evicted.append(components["model_name"])
+        return evicted
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+class BatchedRequest:
+    """
+    A text generation request waiting in (or served by) the BatchingScheduler.
+    Generated text chunks are put in `queue`, followed by None once the request is finished.
+    Setting `stopped` ends this sequence without affecting the other sequences of the batch
+    (stop_generation sets it on the requests of the binding that are in flight).
+    """
+    def __init__(self, input_ids: List[int], gen_kwargs: dict, max_new_tokens: int):
+        self.input_ids = input_ids
+        self.gen_kwargs = gen_kwargs
+        self.max_new_tokens = max_new_tokens
+        self.queue = queue.Queue()
+        self.stopped = False
+        self.finished = False
+        self.tokens: List[int] = []
+        self.detokenizer: Optional[IncrementalDetokenizer] = None # Set by the streamer of the batch
+
+    def batch_key(self) -> tuple:
+        """ Requests can share a batch only if they sample the same way. """
+        return tuple(sorted((k, str(v)) for k, v in self.gen_kwargs.items() if k != "max_new_tokens"))
+
+    def finish(self, error: Optional[Exception] = None):
+        if not self.finished:
+            self.finished = True
+            held_text = self.detokenizer.flush() if self.detokenizer is not None else ""
+            if held_text:
+                self.queue.put(held_text)
+            if error is not None:
+                self.queue.put(error)
+            self.queue.put(None)
+
+class SampleChannel:
+    """ Stands in for the queue of a BatchedRequest and tags its chunks with the sample index on a queue shared by all the samples. """
+    def __init__(self, shared_queue: "queue.Queue", index: int):
+        self.shared_queue = shared_queue
+        self.index = index
+
+    def put(self, item) -> None:
+        self.shared_queue.put((self.index, item))
+
+class BatchRoutingStreamer(BaseStreamer):
+    """
+    Streamer of a batched generate call that routes each row to its own request queue.
+    Each row has its own IncrementalDetokenizer, so a step only decodes the last few tokens of every row.
+    """
+    def __init__(self, tokenizer, requests: List[BatchedRequest]):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        for request in requests:
+            request.detokenizer = IncrementalDetokenizer(tokenizer)
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        for request, token in zip(self.requests, value.reshape(len(self.requests), -1)[:, -1].tolist()):
+            if request.finished:
+                continue
+            request.tokens.append(token)
+            text = request.detokenizer.push(token)
+            if text:
+                request.queue.put(text)
+
+    def end(self):
+        for request in self.requests:
+            request.finish()
+
+class BatchStopCriteria(StoppingCriteria):
+    """
+    Per-sequence stopping criteria of a batched generate call.
+    Returns one flag per row so finished rows stop while the others keep generating. Rows only stop
+    through their own request, a stop meant for another caller never ends them.
+    """
+    def __init__(self, requests: List[BatchedRequest], eos_token_ids: Set[int]):
+        self.requests = requests
+        self.eos_token_ids = eos_token_ids
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row, request in enumerate(self.requests):
+            if not request.finished and (
+                request.stopped
+                or len(request.tokens) >= request.max_new_tokens
+                or (request.tokens and request.tokens[-1] in self.eos_token_ids)
+            ):
+                request.finish()
+            done.append(request.finished)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class BatchingScheduler:
+    """
+    Groups text generation requests that arrive within a short window into a single batched generate call.
+    Prompts are left padded; each row streams to its own request and stops on its own.
+    """
+    def __init__(self, binding: "HuggingFaceLocal", window_ms: int, max_batch_size: int):
+        self.binding = binding
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending = queue.Queue()
+        self.postponed: List[BatchedRequest] = []
+        self.thread: Optional[Thread] = None
+        self.lock = Lock()
+
+    def submit(self, request: BatchedRequest):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._run, name="hf_batching_scheduler", daemon=True)
+                self.thread.start()
+        self.pending.put(request)
+
+    def _collect_batch(self) -> List[BatchedRequest]:
+        # Postponed requests are already late, don't make them wait for the window again
+        late = bool(self.postponed)
+        first = self.postponed.pop(0) if late else self.pending.get()
+        batch = [first]
+        key = first.batch_key()
+        deadline = perf_counter() + (0 if late else self.window)
+        for request in list(self.postponed):
+            if len(batch) < self.max_batch_size and request.batch_key() == key:
+                self.postponed.remove(request)
+                batch.append(request)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - perf_counter()
+            try:
+                request = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if request.batch_key() == key:
+                batch.append(request)
+            else:
+                self.postponed.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._generate(batch)
+            except Exception as e:
+                trace_exception(e)
+                for request in batch:
+                    request.finish(e)
+
+    def _generate(self, batch: List[BatchedRequest]):
+        binding = self.binding
+        tokenizer = binding._get_tokenizer_or_processor()
+        gen_kwargs = dict(batch[0].gen_kwargs)
+        pad_token_id = gen_kwargs.get("pad_token_id")
+        if pad_token_id is None:
+            eos = gen_kwargs.get("eos_token_id")
+            pad_token_id = eos[0] if isinstance(eos, list) else eos
+        eos_token_ids = gen_kwargs.get("eos_token_id")
+        eos_token_ids = set(eos_token_ids if isinstance(eos_token_ids, list) else [eos_token_ids] if eos_token_ids is not None else [])
+
+        longest = max(len(request.input_ids) for request in batch)
+        input_ids = torch.full((len(batch), longest), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), longest), dtype=torch.long)
+        for row, request in enumerate(batch):
+            input_ids[row, longest - len(request.input_ids):] = torch.tensor(request.input_ids, dtype=torch.long)
+            attention_mask[row, longest - len(request.input_ids):] = 1
+        device = binding.model.device if hasattr(binding.model, 'device') else binding.device
+
+        gen_kwargs["pad_token_id"] = pad_token_id
+        gen_kwargs["max_new_tokens"] = max(request.max_new_tokens for request in batch)
+        if binding.config.debug:
+            ASCIIColors.info(f"Batched generation: {len(batch)} requests, {longest} prompt tokens")
+        with torch.no_grad():
+            binding.model.generate(
+                input_ids=input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                **gen_kwargs,
+                streamer=BatchRoutingStreamer(tokenizer, batch),
+                stopping_criteria=StoppingCriteriaList([BatchStopCriteria(batch, eos_token_ids)])
+            )
+        for request in batch:
+            request.finish()
+
+class PeakRSSMonitor:
+    """
+    Samples the resident memory (RSS) of the process on a background thread, to report the peak memory of a request.
+    Sizes are in bytes, and stay 0 if psutil is not available.
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.process = None
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> "PeakRSSMonitor":
+        try:
+            import psutil
+            self.process = psutil.Process()
+            self.start_rss = self.peak_rss = self.process.memory_info().rss
+        except Exception:
+            return self
+        self.thread = Thread(target=self.sample, name="hf_peak_rss", daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def stop(self) -> Dict[str, int]:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+        return {"start_rss": self.start_rss, "peak_rss": self.peak_rss}
+
+class AdapterGate:
+    """
+    Lets concurrent generations share the model while they use the same LoRA adapter (None for the base model).
+    A generation asking for another adapter waits for the running ones to finish, then switches the model to it.
+    """
+    def __init__(self):
+        self.condition = Condition()
+        self.active: Optional[str] = None
+        self.users = 0
+
+    def acquire(self, name: Optional[str], switch: Callable[[Optional[str]], None]) -> None:
+        with self.condition:
+            while self.users > 0 and self.active != name:
+                self.condition.wait()
+            if self.active != name or self.users == 0:
+                switch(name) # Nobody is generating, the model can change
+                self.active = name
+            self.users += 1
+
+    def release(self) -> None:
+        with self.condition:
+            self.users -= 1
+            if self.users == 0:
+                self.condition.notify_all()
+
+    def reset(self) -> None:
+        with self.condition:
+            self.active = None
+
+def with_lora_adapter(method):
+    """ Runs a generation method with the LoRA adapter asked by its 'adapter' parameter (or the default adapter) active. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._lora_enabled():
+            return method(self, *args, **kwargs)
+        adapter_name = kwargs.get("adapter", self.binding_config.config.get("default_lora_adapter", "")) or None
+        try:
+            self.adapter_gate.acquire(adapter_name, self._switch_adapter)
+        except Exception as e:
+            self.error(f"Couldn't activate the LoRA adapter {adapter_name}: {e}")
+            trace_exception(e)
+            return f"[Adapter Error: {e}]"
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.adapter_gate.release()
+    return wrapper
+
+def wait_for_model_load(method):
+    """ Makes a generation method wait for the background load when no model is in use yet (first load with async_model_loading). """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._wait_for_model()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+class ModelLoadFuture(Future):
+    """
+    Future returned by asynchronous model loads.
+    Resolves to the binding once the new model is in use (None if a newer load superseded it).
+    The `status` attribute describes the current loading step.
+    """
+    def __init__(self, model_name: str):
+        super().__init__()
+        self.model_name = model_name
+        self.status = "Queued"
+
+    def set_status(self, status: str):
+        self.status = status
+        ASCIIColors.info(f"[{self.model_name}] {status}")
+
+class GGUFConversionJob(Future):
+    """
+    Future returned by convert_to_gguf.
+    Resolves to the list of GGUF files written (or already up to date).
+    The `status` attribute describes the current step and `progress` goes from 0 to 100.
+    """
+    def __init__(self, model_name: str):
+        super().__init__()
+        self.model_name = model_name
+        self.status = "Queued"
+        self.progress = 0.0
+
+    def set_status(self, status: str, progress: Optional[float] = None):
+        self.status = status
+        if progress is not None:
+            self.progress = progress
+        ASCIIColors.info(f"[GGUF {self.model_name}] {self.progress:.0f}% {status}")
+
 class HuggingFaceLocal(LLMBinding):
     """
     Binding class for running local Hugging Face models using the Transformers library.
@@ -174,10 +1108,13 @@ class HuggingFaceLocal(LLMBinding):
         binding_config_template = ConfigTemplate([
             # --- Model Loading ---
             {"name":"device", "type":"str", "value":"auto", "options":["auto", "cpu", "cuda", "mps"], "help":"Device to use for computation (auto detects best available: CUDA > MPS > CPU). 'auto' with accelerate enables CPU/GPU layer splitting if needed."},
-            {"name":"quantization_bits", "type":"str", "value":"None", "options":["None", "4bits", "8bits"], "help":"Load model quantized in 4-bit or 8-bit. Requires CUDA and bitsandbytes. (-1 for no quantization)."},
+            {"name":"quantization_bits", "type":"str", "value":"None", "options":["None", "4bits", "8bits", "int8_dynamic"], "help":"Load model quantized in 4-bit or 8-bit. Requires CUDA and bitsandbytes. (-1 for no quantization).\nint8_dynamic quantizes the linear layers to int8 on CPU (no CUDA needed). The quantized model is cached next to the model so later loads skip the quantization."},
+            {"name":"execution_backend", "type":"str", "value":"torch", "options":["torch", "onnxruntime", "openvino"], "help":"Runtime executing text models. onnxruntime and openvino run on CPU (often 2-3x faster than torch on Xeon CPUs). The model is exported once (through optimum, installed on first use) and the export is cached next to the model. Vision models always use torch. The inline decode, optimized decode, KV policies, prefix cache and draft model only apply to torch."},
+            {"name":"export_int8", "type":"bool", "value":False, "help":"Quantize the weights of the onnxruntime/openvino export to int8."},
             {"name":"use_flash_attention_2", "type":"bool", "value":False, "help":"Enable Flash Attention 2 for faster inference on compatible GPUs (requires specific hardware and torch version)."},
             {"name":"trust_remote_code", "type":"bool", "value":False, "help":"Allow executing custom code from the model's repository. Use with caution from trusted sources only."},
             {"name":"transformers_offline", "type":"bool", "value":True, "help":"Run transformers in offline mode (no internet connection needed after download)."},
+            {"name":"async_model_loading", "type":"bool", "value":False, "help":"Load new models on a background thread and swap them in once ready. The current model keeps answering meanwhile, if there is enough memory for both."},
 
             # --- Context & Generation ---
             {"name":"auto_infer_ctx_size", "type":"bool", "value":True, "help":"Automatically infer context size from the model's configuration file."},
@@ -185,9 +1122,49 @@ class HuggingFaceLocal(LLMBinding):
             {"name":"max_n_predict", "type":"int", "value":1024, "min": 64, "help":"Maximum number of tokens to generate per response. Will be capped by the effective context size."},
             {"name":"seed", "type":"int", "value":-1, "help":"Random seed for generation (-1 for random)."},
             {"name":"apply_chat_template", "type":"bool", "value":True, "help":"Apply the model's chat template if available. Parses discussion format."},
+            {"name":"optimize_decode", "type":"bool", "value":False, "help":"Decode text with a static key/value cache preallocated for the whole context size and a compiled (torch.compile) forward pass. Removes the per token allocation and python overhead, which dominates for small models on CPU. The first generation pays the compilation (reported apart in debug mode); compiled graphs are cached on disk for later runs. Uses the inline decode loop, without prefix cache nor draft model. Text models only."},
+            {"name":"template_token_cache_size", "type":"int", "value":16, "min":0, "help":"Number of templated discussions whose tokens are kept, so that the next turn of a discussion only tokenizes the new messages (the template itself is still applied to the whole discussion). Needs a fast tokenizer. 0 disables it."},
+            {"name":"decode_loop", "type":"str", "value":"threaded", "options":["threaded", "inline"], "help":"threaded runs model.generate in a thread and streams through a queue. inline decodes token by token in the requesting thread, with incremental detokenization and per token timings (shown in debug mode). inline doesn't interrupt other generations in progress, and doesn't use the draft model."},
+
+            # --- Batching ---
+            {"name":"batching_enabled", "type":"bool", "value":False, "help":"Serve concurrent text generation requests with one batched generate call. Requests arriving within the batching window are left padded and decoded together, each one streaming to its own callback. Gives large throughput gains on CPU with several users. Image requests, requests asking for several samples (n > 1) and generations with LoRA adapters set are not batched. Batched requests use a plain dynamic key/value cache (no kv_policy, prefix cache nor draft model)."},
+            {"name":"batch_window_ms", "type":"int", "value":20, "min":0, "help":"How long (in milliseconds) the first request of a batch waits for other requests to join it."},
+            {"name":"max_batch_size", "type":"int", "value":8, "min":1, "help":"Maximum number of requests decoded together."},
+
+            # --- Assisted generation ---
+            {"name":"draft_model_name", "type":"str", "value":"", "help":"Name of a small model from the local transformers models folder, sharing the vocabulary of the main model, used as draft (assistant) model for assisted generation. The main model verifies several drafted tokens per forward pass, which speeds up text generation when the draft model guesses well (e.g. code). Not used with batching, image requests or the sink kv_policy. Leave empty to disable."},
+
+            # --- LoRA adapters ---
+            {"name":"lora_adapters", "type":"str", "value":"", "help":"Comma separated PEFT (LoRA) adapters of the current model, as folder or name=folder (absolute or relative to the transformers models folder). They are loaded on top of the base model on first use and selected per request with the 'adapter' parameter; switching between loaded adapters is near instant. Requests using different adapters run one after the other. Disables batching."},
+            {"name":"default_lora_adapter", "type":"str", "value":"", "help":"Adapter used by requests that don't ask for one. Empty for the base model."},
+            {"name":"lora_budget_mb", "type":"int", "value":1024, "min":1, "help":"Memory budget (in MB) of the loaded adapters. The least recently used adapters are unloaded when it is exceeded."},
+
+            # --- GGUF export ---
+            {"name":"gguf_quantizations", "type":"str", "value":"Q4_K_M", "help":"Comma separated GGUF types written by convert_to_gguf (F16, Q8_0, Q5_K_M, Q4_K_M). The files go to the gguf models folder, where the llama.cpp bindings find them."},
+            {"name":"llama_cpp_source_path", "type":"str", "value":"", "help":"llama.cpp source folder holding convert_hf_to_gguf.py. Empty to clone llama.cpp into the personal data folder on first use."},
+
+            # --- Resident models ---
+            {"name":"resident_models_budget_mb", "type":"int", "value":0, "min":0, "help":"Memory budget (in MB) for keeping previously used models loaded. Switching back to a resident model is near instant. The least recently used models are unloaded when the budget is exceeded. 0 keeps only the current model."},
+
+            # --- Prefix KV cache ---
+            {"name":"prefix_cache_enabled", "type":"bool", "value":False, "help":"Keep the key/value cache of recent text generations and reuse the longest one sharing a token prefix with the next prompt, so a follow-up turn of a discussion only prefills its new tokens. Not used with batching or image requests."},
+            {"name":"prefix_cache_capacity_mb", "type":"int", "value":2048, "min":16, "help":"Maximum memory (in MB) used by the cached key/value tensors across all discussions. The least recently used caches are dropped first."},
+
+            # --- Long prompts ---
+            {"name":"prefill_chunk_size", "type":"int", "value":0, "min":0, "help":"Prefill long prompts into the key/value cache in windows of this many tokens before decoding, instead of one forward pass over the whole prompt. Caps the attention and activation memory peak of long prompts (e.g. document summaries) on CPU, at a small speed cost. The peak memory of each request is shown in debug mode. 0 disables it. Not used with batching, image requests or the onnxruntime/openvino backends."},
+
+            # --- KV cache policy ---
+            {"name":"kv_policy", "type":"str", "value":"dynamic", "options":["dynamic", "sink", "quantized"], "help":"Key/value cache used by text generations. dynamic grows with the conversation. sink keeps a few first tokens (attention sinks) and a window of recent tokens, so the memory stays constant however long the generation runs (older tokens are forgotten). quantized stores the keys/values in 2 or 4 bits (needs optimum-quanto), fitting longer exact contexts in the same memory. The prefix cache is only used with dynamic. Not used with batching."},
+            {"name":"kv_sink_tokens", "type":"int", "value":4, "min":1, "help":"Number of first tokens always kept by the sink policy."},
+            {"name":"kv_window_tokens", "type":"int", "value":2048, "min":64, "help":"Number of tokens kept by the sink policy, sink tokens included."},
+            {"name":"kv_quant_bits", "type":"int", "value":4, "options":[2, 4], "help":"Bits per key/value element of the quantized policy."},
+
+            # --- Image cache ---
+            {"name":"image_cache_size", "type":"int", "value":32, "min":0, "help":"Number of decoded images (and of processed image sets) kept in memory for vision models, so asking again about the same image skips decoding and preprocessing. Downloaded images are always stored once on disk, by content. 0 disables the memory cache."},
 
             # --- Model Discovery ---
             {"name":"favorite_providers", "type":"str", "value":"microsoft,nvidia,mistralai,deepseek-ai,meta-llama,unsloth,ParisNeo,Bartowski", "help":"List of your favorite providers. Empty list for anyone"},
+            {"name":"hub_cache_ttl_hours", "type":"float", "value":24, "min":0, "help":"How long (in hours) the snapshot of the Hugging Face Hub catalog is considered fresh. An expired snapshot is still shown while a refresh runs in the background. In offline mode, the snapshot is never refreshed."},
             {"name":"hub_fetch_limit", "type":"int", "value":5000, "min": 10, "max": 5000000, "help":"Maximum number of models to fetch from Hugging Face Hub for the 'available models' list."},
             {"name":"model_sorting", "type":"str", "value":"trending_score", "options": ["trending_score","created_at", "last_modified", "downloads", "likes "],"help":"Sorting criteria for models fetched from Hugging Face Hub."}, # Corrected help text
         ])
@@ -195,15 +1172,40 @@ class HuggingFaceLocal(LLMBinding):
         binding_config_defaults = BaseConfig(config={
             "device": "auto",
             "quantization_bits": "None",
+            "execution_backend": "torch",
+            "export_int8": False,
             "use_flash_attention_2": False,
             "trust_remote_code": False,
             "transformers_offline": True,
+            "async_model_loading": False,
             "auto_infer_ctx_size": True,
             "ctx_size": 4096, # Fallback value
             "max_n_predict": 1024,
             "seed": -1,
             "apply_chat_template": True,
+            "template_token_cache_size": 16,
+            "optimize_decode": False,
+            "decode_loop": "threaded",
+            "batching_enabled": False,
+            "batch_window_ms": 20,
+            "max_batch_size": 8,
+            "draft_model_name": "",
+            "lora_adapters": "",
+            "default_lora_adapter": "",
+            "lora_budget_mb": 1024,
+            "gguf_quantizations": "Q4_K_M",
+            "llama_cpp_source_path": "",
+            "resident_models_budget_mb": 0,
+            "prefix_cache_enabled": False,
+            "prefix_cache_capacity_mb": 2048,
+            "prefill_chunk_size": 0,
+            "kv_policy": "dynamic",
+            "kv_sink_tokens": 4,
+            "kv_window_tokens": 2048,
+            "kv_quant_bits": 4,
+            "image_cache_size": 32,
             "favorite_providers": "microsoft,nvidia,mistralai,deepseek-ai,meta-llama,unsloth,ParisNeo,Bartowski", # Added default
+            "hub_cache_ttl_hours": 24,
             "hub_fetch_limit": 5000, # Increased default
             "model_sorting": "trending_score", # Added default
         })
@@ -233,6 +1235,35 @@ class HuggingFaceLocal(LLMBinding):
         self.device = None
         self.generation_thread: Optional[Thread] = None
         self._stop_generation = False
+        # Asynchronous loading state
+        self.model_swap_lock = Lock()
+        self.model_load_id = 0
+        self.model_load_future: Optional[ModelLoadFuture] = None
+        self.gguf_jobs: Dict[str, GGUFConversionJob] = {} # Last GGUF conversion of each model
+        self.gguf_jobs_lock = Lock()
+        self.batching_scheduler: Optional[BatchingScheduler] = None
+        self.prefix_cache: Optional[PrefixKVCacheStore] = None
+        self.resident_models = ResidentModelCache()
+        self.draft_model = None
+        self.draft_model_key = None
+        self.last_draft_stats: Dict[str, int] = {}
+        self.model_index: Optional[LocalModelIndex] = None
+        self.hub_catalog: Optional[dict] = None
+        self.hub_catalog_lock = Lock()
+        self.hub_catalog_refreshing = False
+        self.last_generation_output = None
+        self.inline_stop_events: Set[Event] = set()
+        self.batched_requests: Set[BatchedRequest] = set()
+        self.last_decode_stats: Dict[str, float] = {}
+        self.optimized_decode: Optional[Dict[str, Any]] = None
+        self.last_kv_stats: Dict[str, Any] = {}
+        self.execution_backend = "torch"
+        self.last_peak_memory: Dict[str, int] = {}
+        self.last_samples: List[str] = []
+        self.loaded_adapters: "OrderedDict[str, int]" = OrderedDict() # Adapters of the current model, with their size
+        self.adapter_gate = AdapterGate()
+        self.template_token_cache = TemplateTokenCache(int(self.binding_config.config.get("template_token_cache_size", 16)))
+        self.image_cache = ImageContentCache(self.downloads_path / "images", int(self.binding_config.config.get("image_cache_size", 32)))
 
         # Apply offline mode setting on init
         self._apply_offline_mode()
@@ -290,6 +1321,80 @@ class HuggingFaceLocal(LLMBinding):
         return model_full_path
 
 
+    def _check_settings_compatibility(self) -> List[str]:
+        """
+        Checks the combinations of generation settings that can't work together and warns about each one.
+        Generation falls back as described in the warnings; they are returned for the caller to show.
+        """
+        config = self.binding_config.config
+        if config.get("execution_backend", "torch") != "torch":
+            problems = self._backend_setting_conflicts(config)
+        else:
+            problems = []
+            for conflicts in [
+                self._batching_setting_conflicts,
+                self._adapter_setting_conflicts,
+                self._kv_policy_setting_conflicts,
+                self._optimize_decode_setting_conflicts,
+                self._prefix_cache_setting_conflicts,
+            ]:
+                problems += conflicts(config)
+        for problem in problems:
+            self.warning(f"Incompatible settings: {problem}")
+        return problems
+
+    def _batching_setting_conflicts(self, config: dict) -> List[str]:
+        """ Batched requests share one generate call, each row can't get its own cache or draft model. """
+        if not config.get("batching_enabled", False):
+            return []
+        if config.get("kv_policy", "dynamic") != "dynamic" or config.get("draft_model_name", "").strip() or config.get("prefix_cache_enabled", False):
+            return ["Batched requests use a plain dynamic cache, without kv_policy, draft model nor prefix cache."]
+        return []
+
+    def _adapter_setting_conflicts(self, config: dict) -> List[str]:
+        """ A batch runs a single adapter, so requests are not batched while adapters are set. """
+        if config.get("batching_enabled", False) and config.get("lora_adapters", "").strip():
+            return ["Batching is disabled while LoRA adapters are set: a batch runs a single adapter."]
+        return []
+
+    def _prefix_cache_setting_conflicts(self, config: dict) -> List[str]:
+        """ The prefix cache stores dynamic caches, the other kv_policy caches are not kept across turns. """
+        kv_policy = config.get("kv_policy", "dynamic")
+        if config.get("prefix_cache_enabled", False) and kv_policy != "dynamic":
+            return [f"The prefix cache is only used with the dynamic kv_policy, not {kv_policy}."]
+        return []
+
+    def _optimize_decode_setting_conflicts(self, config: dict) -> List[str]:
+        """ The compiled decode forward runs on its own static cache, the other caches and the draft model can't feed it. """
+        if not config.get("optimize_decode", False):
+            return []
+        if config.get("draft_model_name", "").strip() or config.get("prefix_cache_enabled", False) or config.get("kv_policy", "dynamic") != "dynamic":
+            return ["optimize_decode uses its own static cache: the draft model, the prefix cache and the kv_policy are not used."]
+        return []
+
+    def _kv_policy_setting_conflicts(self, config: dict) -> List[str]:
+        """ Assisted generation crops the cache after rejected draft tokens, which the sink cache refuses once it evicted tokens. """
+        if config.get("kv_policy", "dynamic") == "sink" and config.get("draft_model_name", "").strip():
+            return ["The draft model is not used with the sink kv_policy: assisted generation crops the cache, which the sink cache can't do once it evicted tokens."]
+        return []
+
+    def _backend_setting_conflicts(self, config: dict) -> List[str]:
+        """ The onnxruntime and openvino backends run their own generate, without the torch only settings. """
+        backend = config.get("execution_backend", "torch")
+        kv_policy = config.get("kv_policy", "dynamic")
+        torch_only = [name for name, enabled in [
+            ("optimize_decode", config.get("optimize_decode", False)),
+            ("decode_loop=inline", config.get("decode_loop", "threaded") == "inline"),
+            ("draft_model_name", bool(config.get("draft_model_name", "").strip())),
+            ("prefix_cache_enabled", config.get("prefix_cache_enabled", False)),
+            (f"kv_policy={kv_policy}", kv_policy != "dynamic"),
+            ("lora_adapters", bool(config.get("lora_adapters", "").strip())),
+            ("prefill_chunk_size", int(config.get("prefill_chunk_size", 0)) > 0),
+        ] if enabled]
+        if not torch_only:
+            return []
+        return [f"The {backend} backend ignores {', '.join(torch_only)} (torch backend only)."]
+
     def build_model(self, model_name: Optional[str] = None) -> LLMBinding:
         """
         Loads the specified Hugging Face model and tokenizer/processor.
@@ -297,6 +1402,7 @@ class HuggingFaceLocal(LLMBinding):
         Determines if the model is multimodal and attempts to infer context size.
         """
         super().build_model(model_name) # Sets self.config.model_name
+        self._check_settings_compatibility()
 
         current_model_name = self.config.model_name
         if not current_model_name:
@@ -315,6 +1421,11 @@ class HuggingFaceLocal(LLMBinding):
             if self.lollmsCom: self.lollmsCom.InfoMessage(f"HuggingFaceLocal Error: Model folder '{current_model_name}' not found.")
             return self
 
+        if self.binding_config.config.get("async_model_loading", False):
+            # Keep serving with the current model while the new one loads in the background
+            self.load_model_async(current_model_name, model_full_path)
+            return self
+
         # --- Unload Previous Model ---
         # Check if a model is currently loaded *before* trying to load the new one
         if self.model is not None:
@@ -325,264 +1436,9 @@ class HuggingFaceLocal(LLMBinding):
         self.ShowBlockingMessage(f"Loading {current_model_name}...\nPlease wait.")
 
         try:
-            # --- Determine Device ---
-            requested_device = self.binding_config.config.get("device", "auto")
-            if requested_device == "auto":
-                # Use get_torch_device to find the best *single* device for potential offloading/CPU parts
-                # The actual model placement is primarily handled by device_map="auto" below
-                self.device = get_torch_device()
-                ASCIIColors.info(f"Auto-detected primary device: {self.device}. Using device_map='auto' for potential multi-device loading.")
-                device_map_strategy: Union[str, Dict] = "auto" # Let accelerate handle splitting
-            elif requested_device in ["cuda", "mps", "cpu"]:
-                self.device = requested_device
-                # If a specific device is forced, we might still use 'auto' map for large models,
-                # or force everything to that device if possible. Let's stick with 'auto' map
-                # as it's generally more robust for potentially large models.
-                # User forcing 'cpu' will likely result in 'auto' placing everything on CPU anyway.
-                device_map_strategy = "auto"
-                # device_map_strategy = self.device # Alternative: Force to the single device (might OOM)
-                ASCIIColors.info(f"Using configured device: {self.device} with device_map='auto'.")
-            else:
-                self.warning(f"Invalid device '{requested_device}' requested. Falling back to 'auto'.")
-                self.device = get_torch_device()
-                device_map_strategy = "auto"
-
-            if "cuda" not in self.device and self.binding_config.quantization_bits in ["4bits", "8bits"]:
-                self.warning("Quantization requires CUDA. Disabling quantization.")
-                self.binding_config.config["quantization_bits"] = "None" # Update runtime config
-
-            # --- Load Model Config First ---
-            ASCIIColors.info(f"Loading config from: {model_full_path}")
-            trust_code = self.binding_config.config.get("trust_remote_code", False)
-            model_config = AutoConfig.from_pretrained(model_full_path, trust_remote_code=trust_code)
-
-            # --- Determine Model Class and Processor/Tokenizer ---
-            ModelClass = AutoModelForCausalLM; ProcessorTokenizerClass = AutoTokenizer; is_vision_model = False
-            model_type_str = getattr(model_config, "model_type", "").lower()
-            architectures = [arch.lower() for arch in getattr(model_config, "architectures", [])]
-            selected_class_key = "default"
-            for key, (model_cls, proc_tok_cls) in KNOWN_MODEL_CLASSES.items():
-                if key != "default" and (model_type_str == key or any(key in arch for arch in architectures)):
-                    selected_class_key = key; ModelClass = model_cls; ProcessorTokenizerClass = proc_tok_cls
-                    is_vision_model = ProcessorTokenizerClass == AutoProcessor # Assume VLM if Processor is needed
-                    ASCIIColors.info(f"Detected matching model type: {key}")
-                    break
-
-            if is_vision_model:
-                 self.binding_type = BindingType.TEXT_IMAGE
-                 self.SAFE_STORE_SUPPORTED_FILE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp', '.bmp']
-                 ASCIIColors.info(f"Loading as Vision Model using {ModelClass.__name__} and {ProcessorTokenizerClass.__name__}")
-            else:
-                 self.binding_type = BindingType.TEXT_ONLY
-                 self.SAFE_STORE_SUPPORTED_FILE_EXTENSIONS = []
-                 ASCIIColors.info(f"Loading as Text Model using {ModelClass.__name__} and {ProcessorTokenizerClass.__name__}")
-
-
-            # --- Prepare Loading Arguments ---
-            kwargs: Dict[str, Any] = {
-                "trust_remote_code": trust_code,
-                "device_map": device_map_strategy  # Use the determined strategy ('auto' or specific device)
-            }
-            quantization_bits = self.binding_config.config.get("quantization_bits", "None")
-            if quantization_bits in ["4bits", "8bits"] and torch.cuda.is_available(): # Check CUDA availability again
-                try:
-                    compute_dtype = torch.bfloat16 # Common compute type for 4-bit
-                    torch_dtype = torch.bfloat16 # Load weights in bfloat16 for 4-bit
-                    if quantization_bits == "8bits":
-                        # 8-bit usually doesn't need a specific compute_dtype set this way, torch_dtype controls load type
-                         torch_dtype = torch.float16 # Or keep None? Check BNB docs. Let's try float16
-
-                    bnb_config = BitsAndBytesConfig(
-                        load_in_8bit=(quantization_bits == "8bits"),
-                        load_in_4bit=(quantization_bits == "4bits"),
-                        bnb_4bit_use_double_quant=True,
-                        bnb_4bit_quant_type="nf4",
-                        bnb_4bit_compute_dtype=compute_dtype if quantization_bits == "4bits" else None # Only for 4-bit
-                    )
-                    kwargs["quantization_config"] = bnb_config
-                    kwargs["torch_dtype"] = torch_dtype # Set loading dtype
-                    ASCIIColors.info(f"Applying {quantization_bits} quantization.")
-                except Exception as bnb_ex:
-                    self.error(f"Failed to create BitsAndBytesConfig: {bnb_ex}. Disabling quantization.")
-                    trace_exception(bnb_ex)
-                    self.binding_config.config["quantization_bits"] = "None" # Update runtime config
-                    if "quantization_config" in kwargs: del kwargs["quantization_config"]
-                    if "torch_dtype" in kwargs: del kwargs["torch_dtype"]
-
-            # Set torch_dtype if not using quantization, based on primary device
-            if "quantization_config" not in kwargs:
-                if self.device == "cuda": kwargs["torch_dtype"] = torch.float16
-                elif self.device == "mps": kwargs["torch_dtype"] = torch.float16 # MPS often benefits from float16
-                else: kwargs["torch_dtype"] = torch.float32 # CPU default
-
-            use_flash_attention = self.binding_config.config.get("use_flash_attention_2", False)
-            if use_flash_attention and "cuda" in self.device:
-                 try:
-                     major, minor = map(int, transformers.__version__.split('.')[:2])
-                     if major >= 4 and minor >= 34: # Check transformers version
-                         kwargs["attn_implementation"] = "flash_attention_2"
-                         # Note: torch_dtype might need to be float16 or bfloat16 for FA2
-                         if kwargs.get("torch_dtype") == torch.float32:
-                              kwargs["torch_dtype"] = torch.float16 # Prefer float16 if not set
-                              ASCIIColors.warning("Flash Attention 2 typically requires float16/bfloat16. Setting torch_dtype to float16.")
-                         ASCIIColors.info("Attempting Flash Attention 2 implementation.")
-                     else:
-                         ASCIIColors.warning("Transformers version might be older than 4.34. Sticking to default attention mechanism.")
-                 except Exception as fa_ex:
-                     ASCIIColors.warning(f"Couldn't check/apply Flash Attention 2 setting: {fa_ex}")
-
-
-            # --- Load Processor or Tokenizer ---
-            ASCIIColors.info(f"Loading {ProcessorTokenizerClass.__name__} from: {model_full_path}")
-            processor_tokenizer_instance = ProcessorTokenizerClass.from_pretrained(model_full_path, trust_remote_code=trust_code)
-            if is_vision_model:
-                self.processor = processor_tokenizer_instance
-                self.tokenizer = getattr(self.processor, 'tokenizer', None)
-                if not self.tokenizer:
-                    self.warning("Could not find 'tokenizer' attribute on the processor. Text tokenization might rely solely on the processor.")
-                    if callable(getattr(self.processor, "encode", None)) and callable(getattr(self.processor, "decode", None)):
-                        self.tokenizer = self.processor
-                        ASCIIColors.info("Using the processor itself as a fallback tokenizer.")
-                    else:
-                        self.warning("Processor cannot be used as a fallback tokenizer (missing encode/decode).")
-            else:
-                self.tokenizer = processor_tokenizer_instance; self.processor = None
-
-            # --- Handle Missing Pad Token ---
-            tokenizer_to_check = self._get_tokenizer_or_processor()
-            pad_token_to_add = None
-            if tokenizer_to_check and getattr(tokenizer_to_check, 'pad_token_id', None) is None:
-                 pad_token = getattr(tokenizer_to_check,'pad_token',None)
-                 if pad_token is None:
-                     eos_token_id = getattr(tokenizer_to_check, 'eos_token_id', None)
-                     eos_token = getattr(tokenizer_to_check, 'eos_token', None)
-                     if eos_token_id is not None and eos_token is not None:
-                        try:
-                            tokenizer_to_check.pad_token_id = eos_token_id
-                            tokenizer_to_check.pad_token = eos_token
-                            ASCIIColors.warning("Tokenizer/Processor missing pad_token, setting to eos_token.")
-                        except Exception as pad_ex:
-                            ASCIIColors.warning(f"Could not set pad_token to eos_token: {pad_ex}")
-                     else:
-                        # Add a default pad token if both pad and eos are missing
-                        pad_token_to_add = '[PAD]'
-                        if pad_token_to_add not in tokenizer_to_check.get_vocab():
-                            try:
-                                num_added = tokenizer_to_check.add_special_tokens({'pad_token': pad_token_to_add})
-                                if num_added > 0:
-                                    ASCIIColors.warning(f"Added special token '{pad_token_to_add}' as pad_token.")
-                                    # Resize model embeddings later after model load
-                                else:
-                                    ASCIIColors.warning(f"Tried adding '{pad_token_to_add}', but it might already exist without being set.")
-                                # Explicitly set after adding
-                                tokenizer_to_check.pad_token = pad_token_to_add
-                            except Exception as add_tok_ex:
-                                ASCIIColors.error(f"Failed to add or set pad token '{pad_token_to_add}': {add_tok_ex}")
-                        else:
-                            try:
-                                tokenizer_to_check.pad_token = pad_token_to_add
-                                ASCIIColors.warning(f"'{pad_token_to_add}' token exists but wasn't set as pad token. Setting it now.")
-                            except Exception as pad_ex:
-                                ASCIIColors.warning(f"Could not set existing token '{pad_token_to_add}' as pad_token: {pad_ex}")
-
-                     # Final check if pad_token_id got set
-                     if getattr(tokenizer_to_check, 'pad_token_id', None) is None:
-                         self.warning("Could not determine or set a pad_token_id. Generation might fail for batching/padding.")
-
-            # --- Load Model ---
-            self.info(f"Loading model using {ModelClass.__name__} from: {model_full_path} with config: {kwargs}")
-            load_start_time = perf_counter()
-            self.model = ModelClass.from_pretrained(model_full_path, **kwargs)
-            self.info(f"Model loaded in {perf_counter() - load_start_time:.2f} seconds.")
-
-            # Report device map if using 'auto'
-            if device_map_strategy == "auto" and hasattr(self.model, 'hf_device_map'):
-                self.info(f"Model device map (accelerate): {self.model.hf_device_map}")
-            elif device_map_strategy != "auto":
-                 self.info(f"Model loaded on specified device: {device_map_strategy}")
-
-
-            # --- Resize Embeddings if Pad Token was Added ---
-            if pad_token_to_add and hasattr(self.model, 'resize_token_embeddings') and tokenizer_to_check:
-                 current_vocab_size = getattr(tokenizer_to_check, 'vocab_size', len(tokenizer_to_check))
-                 model_embedding_size = self.model.get_input_embeddings().weight.shape[0]
-                 if model_embedding_size < current_vocab_size:
-                     self.info(f"Resizing model token embeddings from {model_embedding_size} to match tokenizer size: {current_vocab_size}")
-                     self.model.resize_token_embeddings(current_vocab_size)
-                     # Re-check/set pad_token_id after resize, crucial if it wasn't set before
-                     if getattr(tokenizer_to_check, 'pad_token_id', None) is None and tokenizer_to_check.pad_token:
-                          pad_id = tokenizer_to_check.convert_tokens_to_ids(tokenizer_to_check.pad_token)
-                          if isinstance(pad_id, int):
-                              try:
-                                 tokenizer_to_check.pad_token_id = pad_id
-                                 ASCIIColors.info(f"Set pad_token_id to {pad_id} after resizing.")
-                              except Exception as pad_id_ex:
-                                  ASCIIColors.warning(f"Failed to set pad_token_id after resize: {pad_id_ex}")
-                 else:
-                     self.info("Token embeddings size already matches tokenizer vocab size after potential token addition.")
-
-
-            # --- Infer/Set Context Size ---
-            effective_ctx_size = 4096 # Default fallback
-            if self.binding_config.config.get("auto_infer_ctx_size", True):
-                detected_ctx_size = None
-                possible_keys = ['max_position_embeddings', 'n_positions', 'model_max_length', 'seq_length'] # Added model_max_length
-                for key in possible_keys:
-                    ctx_val = getattr(model_config, key, None)
-                    if isinstance(ctx_val, int) and ctx_val > 0:
-                        detected_ctx_size = ctx_val
-                        ASCIIColors.info(f"Auto-detected context size ({key}): {detected_ctx_size}")
-                        break
-                # Fallback check on tokenizer/processor if config fails
-                if not detected_ctx_size and tokenizer_to_check:
-                     ctx_val = getattr(tokenizer_to_check, 'model_max_length', None)
-                     if isinstance(ctx_val, int) and ctx_val > 512: # Avoid unrealistically small values
-                         detected_ctx_size = ctx_val
-                         ASCIIColors.info(f"Auto-detected context size (tokenizer.model_max_length): {detected_ctx_size}")
-
-                if detected_ctx_size:
-                    effective_ctx_size = detected_ctx_size
-                else:
-                    effective_ctx_size = self.binding_config.config.get("ctx_size", 4096)
-                    ASCIIColors.warning(f"Could not auto-detect context size. Using configured/default: {effective_ctx_size}")
-            else:
-                 effective_ctx_size = self.binding_config.config.get("ctx_size", 4096)
-                 ASCIIColors.info(f"Using manually configured context size: {effective_ctx_size}")
-
-            self.config.ctx_size = effective_ctx_size
-            # Ensure the binding's config reflects the potentially updated value
-            self.binding_config.config["ctx_size"] = effective_ctx_size
-
-
-            # --- Validate and Set Max Prediction Tokens ---
-            configured_max_predict = self.binding_config.config.get("max_n_predict", 1024)
-            effective_max_predict = configured_max_predict
-            # Ensure max_predict doesn't exceed context size minus a buffer (e.g., 10 tokens for safety)
-            buffer = 10
-            if effective_max_predict >= effective_ctx_size - buffer:
-                 capped_predict = max(64, effective_ctx_size - buffer) # Keep a minimum generation capability
-                 self.warning(f"Configured max_n_predict ({effective_max_predict}) too close to effective_ctx_size ({effective_ctx_size}). Capping to {capped_predict}.")
-                 effective_max_predict = capped_predict
-            elif effective_max_predict < 64: # Ensure a reasonable minimum
-                self.warning(f"Configured max_n_predict ({effective_max_predict}) is very low. Setting to minimum 64.")
-                effective_max_predict = 64
-
-            self.config.max_n_predict = effective_max_predict
-             # Ensure the binding's config reflects the potentially updated value
-            self.binding_config.config["max_n_predict"] = effective_max_predict
-
-
-            # --- Check if Chat Template Exists ---
-            tokenizer_or_processor = self._get_tokenizer_or_processor()
-            if tokenizer_or_processor and hasattr(tokenizer_or_processor, 'chat_template') and tokenizer_or_processor.chat_template:
-                 ASCIIColors.info("Model has a chat template defined.")
-                 self.binding_config.config["apply_chat_template"] = True # Ensure it's enabled if found
-            else:
-                 ASCIIColors.warning("Model does not have a chat template defined in its tokenizer/processor config. Will use raw prompt input.")
-                 self.binding_config.config["apply_chat_template"] = False # Disable if not found
-
-            ASCIIColors.success(f"Model {current_model_name} loaded successfully.")
-            ASCIIColors.success(f"Effective Ctx: {self.config.ctx_size}, Max Gen: {self.config.max_n_predict}. Type: {self.binding_type.name}")
+            components = self._get_or_load_model_components(current_model_name, model_full_path)
+            self._apply_model_components(components)
+            self._evict_resident_models()
             self.HideBlockingMessage()
 
         except ImportError as e:
@@ -598,8 +1454,716 @@ class HuggingFaceLocal(LLMBinding):
 
         return self
 
+    def _load_model_components(self, current_model_name: str, model_full_path: Path) -> Dict[str, Any]:
+        """
+        Loads a model and its tokenizer/processor without touching the model currently in use.
+        Determines if the model is multimodal and attempts to infer context size.
+        Returns the loaded components, to be installed with _apply_model_components.
+        """
+        # --- Determine Device ---
+        requested_device = self.binding_config.config.get("device", "auto")
+        if requested_device == "auto":
+            # Use get_torch_device to find the best *single* device for potential offloading/CPU parts
+            # The actual model placement is primarily handled by device_map="auto" below
+            device = get_torch_device()
+            ASCIIColors.info(f"Auto-detected primary device: {device}. Using device_map='auto' for potential multi-device loading.")
+            device_map_strategy: Union[str, Dict] = "auto" # Let accelerate handle splitting
+        elif requested_device in ["cuda", "mps", "cpu"]:
+            device = requested_device
+            # If a specific device is forced, we might still use 'auto' map for large models,
+            # or force everything to that device if possible. Let's stick with 'auto' map
+            # as it's generally more robust for potentially large models.
+            # User forcing 'cpu' will likely result in 'auto' placing everything on CPU anyway.
+            device_map_strategy = "auto"
+            # device_map_strategy = device # Alternative: Force to the single device (might OOM)
+            ASCIIColors.info(f"Using configured device: {device} with device_map='auto'.")
+        else:
+            self.warning(f"Invalid device '{requested_device}' requested. Falling back to 'auto'.")
+            device = get_torch_device()
+            device_map_strategy = "auto"
+
+        execution_backend = self.binding_config.config.get("execution_backend", "torch")
+        if execution_backend != "torch":
+            # The exported runtimes run on CPU
+            device = "cpu"
+            device_map_strategy = "cpu"
+        elif self.binding_config.config.get("quantization_bits", "None") == "int8_dynamic":
+            # Dynamic int8 quantization only has CPU kernels
+            device = "cpu"
+            device_map_strategy = "cpu"
+            ASCIIColors.info("int8_dynamic quantization: loading the model on CPU.")
+
+        if "cuda" not in device and self.binding_config.quantization_bits in ["4bits", "8bits"]:
+            self.warning("Quantization requires CUDA. Disabling quantization.")
+            self.binding_config.config["quantization_bits"] = "None" # Update runtime config
+
+        # --- Load Model Config First ---
+        ASCIIColors.info(f"Loading config from: {model_full_path}")
+        trust_code = self.binding_config.config.get("trust_remote_code", False)
+        model_config = AutoConfig.from_pretrained(model_full_path, trust_remote_code=trust_code)
+
+        # --- Determine Model Class and Processor/Tokenizer ---
+        ModelClass = AutoModelForCausalLM; ProcessorTokenizerClass = AutoTokenizer; is_vision_model = False
+        model_type_str = getattr(model_config, "model_type", "").lower()
+        architectures = [arch.lower() for arch in getattr(model_config, "architectures", [])]
+        selected_class_key = "default"
+        for key, (model_cls, proc_tok_cls) in KNOWN_MODEL_CLASSES.items():
+            if key != "default" and (model_type_str == key or any(key in arch for arch in architectures)):
+                selected_class_key = key; ModelClass = model_cls; ProcessorTokenizerClass = proc_tok_cls
+                is_vision_model = ProcessorTokenizerClass == AutoProcessor # Assume VLM if Processor is needed
+                ASCIIColors.info(f"Detected matching model type: {key}")
+                break
+
+        if is_vision_model and execution_backend != "torch":
+            self.warning(f"The {execution_backend} backend only supports text models. Using torch.")
+            execution_backend = "torch"
+
+        if is_vision_model:
+             binding_type = BindingType.TEXT_IMAGE
+             supported_extensions = ['.png', '.jpg', '.jpeg', '.webp', '.bmp']
+             ASCIIColors.info(f"Loading as Vision Model using {ModelClass.__name__} and {ProcessorTokenizerClass.__name__}")
+        else:
+             binding_type = BindingType.TEXT_ONLY
+             supported_extensions = []
+             ASCIIColors.info(f"Loading as Text Model using {ModelClass.__name__} and {ProcessorTokenizerClass.__name__}")
+
+
+        # --- Prepare Loading Arguments ---
+        kwargs: Dict[str, Any] = {
+            "trust_remote_code": trust_code,
+            "device_map": device_map_strategy,  # Use the determined strategy ('auto' or specific device)
+            "low_cpu_mem_usage": True # Fill the weights straight from the memory mapped safetensors, no random init copy
+        }
+        quantization_bits = self.binding_config.config.get("quantization_bits", "None")
+        if quantization_bits in ["4bits", "8bits"] and torch.cuda.is_available(): # Check CUDA availability again
+            try:
+                compute_dtype = torch.bfloat16 # Common compute type for 4-bit
+                torch_dtype = torch.bfloat16 # Load weights in bfloat16 for 4-bit
+                if quantization_bits == "8bits":
+                    # 8-bit usually doesn't need a specific compute_dtype set this way, torch_dtype controls load type
+                     torch_dtype = torch.float16 # Or keep None? Check BNB docs. Let's try float16
+
+                bnb_config = BitsAndBytesConfig(
+                    load_in_8bit=(quantization_bits == "8bits"),
+                    load_in_4bit=(quantization_bits == "4bits"),
+                    bnb_4bit_use_double_quant=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=compute_dtype if quantization_bits == "4bits" else None # Only for 4-bit
+                )
+                kwargs["quantization_config"] = bnb_config
+                kwargs["torch_dtype"] = torch_dtype # Set loading dtype
+                ASCIIColors.info(f"Applying {quantization_bits} quantization.")
+            except Exception as bnb_ex:
+                self.error(f"Failed to create BitsAndBytesConfig: {bnb_ex}. Disabling quantization.")
+                trace_exception(bnb_ex)
+                self.binding_config.config["quantization_bits"] = "None" # Update runtime config
+                if "quantization_config" in kwargs: del kwargs["quantization_config"]
+                if "torch_dtype" in kwargs: del kwargs["torch_dtype"]
+
+        # Set torch_dtype if not using quantization, based on primary device
+        if "quantization_config" not in kwargs:
+            if device == "cuda": kwargs["torch_dtype"] = torch.float16
+            elif device == "mps": kwargs["torch_dtype"] = torch.float16 # MPS often benefits from float16
+            else: kwargs["torch_dtype"] = torch.float32 # CPU default
+
+        use_flash_attention = self.binding_config.config.get("use_flash_attention_2", False)
+        if use_flash_attention and "cuda" in device:
+             try:
+                 major, minor = map(int, transformers.__version__.split('.')[:2])
+                 if major >= 4 and minor >= 34: # Check transformers version
+                     kwargs["attn_implementation"] = "flash_attention_2"
+                     # Note: torch_dtype might need to be float16 or bfloat16 for FA2
+                     if kwargs.get("torch_dtype") == torch.float32:
+                          kwargs["torch_dtype"] = torch.float16 # Prefer float16 if not set
+                          ASCIIColors.warning("Flash Attention 2 typically requires float16/bfloat16. Setting torch_dtype to float16.")
+                     ASCIIColors.info("Attempting Flash Attention 2 implementation.")
+                 else:
+                     ASCIIColors.warning("Transformers version might be older than 4.34. Sticking to default attention mechanism.")
+             except Exception as fa_ex:
+                 ASCIIColors.warning(f"Couldn't check/apply Flash Attention 2 setting: {fa_ex}")
+
+
+        # --- Load Processor or Tokenizer ---
+        ASCIIColors.info(f"Loading {ProcessorTokenizerClass.__name__} from: {model_full_path}")
+        processor_tokenizer_instance = ProcessorTokenizerClass.from_pretrained(model_full_path, trust_remote_code=trust_code)
+        if is_vision_model:
+            processor = processor_tokenizer_instance
+            tokenizer = getattr(processor, 'tokenizer', None)
+            if not tokenizer:
+                self.warning("Could not find 'tokenizer' attribute on the processor. Text tokenization might rely solely on the processor.")
+                if callable(getattr(processor, "encode", None)) and callable(getattr(processor, "decode", None)):
+                    tokenizer = processor
+                    ASCIIColors.info("Using the processor itself as a fallback tokenizer.")
+                else:
+                    self.warning("Processor cannot be used as a fallback tokenizer (missing encode/decode).")
+        else:
+            tokenizer = processor_tokenizer_instance; processor = None
+
+        # --- Handle Missing Pad Token ---
+        tokenizer_to_check = processor if processor else tokenizer
+        pad_token_to_add = None
+        if tokenizer_to_check and getattr(tokenizer_to_check, 'pad_token_id', None) is None:
+             pad_token = getattr(tokenizer_to_check,'pad_token',None)
+             if pad_token is None:
+                 eos_token_id = getattr(tokenizer_to_check, 'eos_token_id', None)
+                 eos_token = getattr(tokenizer_to_check, 'eos_token', None)
+                 if eos_token_id is not None and eos_token is not None:
+                    try:
+                        tokenizer_to_check.pad_token_id = eos_token_id
+                        tokenizer_to_check.pad_token = eos_token
+                        ASCIIColors.warning("Tokenizer/Processor missing pad_token, setting to eos_token.")
+                    except Exception as pad_ex:
+                        ASCIIColors.warning(f"Could not set pad_token to eos_token: {pad_ex}")
+                 else:
+                    # Add a default pad token if both pad and eos are missing
+                    pad_token_to_add = '[PAD]'
+                    if pad_token_to_add not in tokenizer_to_check.get_vocab():
+                        try:
+                            num_added = tokenizer_to_check.add_special_tokens({'pad_token': pad_token_to_add})
+                            if num_added > 0:
+                                ASCIIColors.warning(f"Added special token '{pad_token_to_add}' as pad_token.")
+                                # Resize model embeddings later after model load
+                            else:
+                                ASCIIColors.warning(f"Tried adding '{pad_token_to_add}', but it might already exist without being set.")
+                            # Explicitly set after adding
+                            tokenizer_to_check.pad_token = pad_token_to_add
+                        except Exception as add_tok_ex:
+                            ASCIIColors.error(f"Failed to add or set pad token '{pad_token_to_add}': {add_tok_ex}")
+                    else:
+                        try:
+                            tokenizer_to_check.pad_token = pad_token_to_add
+                            ASCIIColors.warning(f"'{pad_token_to_add}' token exists but wasn't set as pad token. Setting it now.")
+                        except Exception as pad_ex:
+                            ASCIIColors.warning(f"Could not set existing token '{pad_token_to_add}' as pad_token: {pad_ex}")
+
+                 # Final check if pad_token_id got set
+                 if getattr(tokenizer_to_check, 'pad_token_id', None) is None:
+                     self.warning("Could not determine or set a pad_token_id. Generation might fail for batching/padding.")
+
+        # --- Load Model ---
+        self.info(f"Loading model using {ModelClass.__name__} from: {model_full_path} with config: {kwargs}")
+        load_start_time = perf_counter()
+        int8_cache_file = self._int8_dynamic_cache_file(model_full_path) if quantization_bits == "int8_dynamic" and execution_backend == "torch" else None
+        int8_cached = int8_cache_file is not None and int8_cache_file.exists()
+        if execution_backend != "torch":
+            model = self._load_exported_model(model_full_path, execution_backend)
+        elif int8_cached:
+            self.info(f"Loading the int8 dynamic quantized model from {int8_cache_file}")
+            model = torch.load(int8_cache_file, mmap=True, weights_only=False)
+        else:
+            model = ModelClass.from_pretrained(model_full_path, **kwargs)
+        self.info(f"Model loaded in {perf_counter() - load_start_time:.2f} seconds.")
+
+        # Report device map if using 'auto'
+        if device_map_strategy == "auto" and hasattr(model, 'hf_device_map'):
+            self.info(f"Model device map (accelerate): {model.hf_device_map}")
+        elif device_map_strategy != "auto":
+             self.info(f"Model loaded on specified device: {device_map_strategy}")
+
+
+        # --- Resize Embeddings if Pad Token was Added ---
+        if pad_token_to_add and hasattr(model, 'resize_token_embeddings') and tokenizer_to_check:
+             current_vocab_size = getattr(tokenizer_to_check, 'vocab_size', len(tokenizer_to_check))
+             model_embedding_size = model.get_input_embeddings().weight.shape[0]
+             if model_embedding_size < current_vocab_size:
+                 self.info(f"Resizing model token embeddings from {model_embedding_size} to match tokenizer size: {current_vocab_size}")
+                 model.resize_token_embeddings(current_vocab_size)
+                 # Re-check/set pad_token_id after resize, crucial if it wasn't set before
+                 if getattr(tokenizer_to_check, 'pad_token_id', None) is None and tokenizer_to_check.pad_token:
+                      pad_id = tokenizer_to_check.convert_tokens_to_ids(tokenizer_to_check.pad_token)
+                      if isinstance(pad_id, int):
+                          try:
+                             tokenizer_to_check.pad_token_id = pad_id
+                             ASCIIColors.info(f"Set pad_token_id to {pad_id} after resizing.")
+                          except Exception as pad_id_ex:
+                              ASCIIColors.warning(f"Failed to set pad_token_id after resize: {pad_id_ex}")
+             else:
+                 self.info("Token embeddings size already matches tokenizer vocab size after potential token addition.")
+
+        # --- CPU int8 Dynamic Quantization ---
+        if int8_cache_file is not None and not int8_cached:
+            model = self._quantize_int8_dynamic(model, int8_cache_file)
+
+
+        # --- Infer/Set Context Size ---
+        effective_ctx_size = 4096 # Default fallback
+        if self.binding_config.config.get("auto_infer_ctx_size", True):
+            detected_ctx_size = None
+            possible_keys = ['max_position_embeddings', 'n_positions', 'model_max_length', 'seq_length'] # Added model_max_length
+            for key in possible_keys:
+                ctx_val = getattr(model_config, key, None)
+                if isinstance(ctx_val, int) and ctx_val > 0:
+                    detected_ctx_size = ctx_val
+                    ASCIIColors.info(f"Auto-detected context size ({key}): {detected_ctx_size}")
+                    break
+            # Fallback check on tokenizer/processor if config fails
+            if not detected_ctx_size and tokenizer_to_check:
+                 ctx_val = getattr(tokenizer_to_check, 'model_max_length', None)
+                 if isinstance(ctx_val, int) and ctx_val > 512: # Avoid unrealistically small values
+                     detected_ctx_size = ctx_val
+                     ASCIIColors.info(f"Auto-detected context size (tokenizer.model_max_length): {detected_ctx_size}")
+
+            if detected_ctx_size:
+                effective_ctx_size = detected_ctx_size
+            else:
+                effective_ctx_size = self.binding_config.config.get("ctx_size", 4096)
+                ASCIIColors.warning(f"Could not auto-detect context size. Using configured/default: {effective_ctx_size}")
+        else:
+             effective_ctx_size = self.binding_config.config.get("ctx_size", 4096)
+             ASCIIColors.info(f"Using manually configured context size: {effective_ctx_size}")
+
+
+
+        # --- Validate and Set Max Prediction Tokens ---
+        configured_max_predict = self.binding_config.config.get("max_n_predict", 1024)
+        effective_max_predict = configured_max_predict
+        # Ensure max_predict doesn't exceed context size minus a buffer (e.g., 10 tokens for safety)
+        buffer = 10
+        if effective_max_predict >= effective_ctx_size - buffer:
+             capped_predict = max(64, effective_ctx_size - buffer) # Keep a minimum generation capability
+             self.warning(f"Configured max_n_predict ({effective_max_predict}) too close to effective_ctx_size ({effective_ctx_size}). Capping to {capped_predict}.")
+             effective_max_predict = capped_predict
+        elif effective_max_predict < 64: # Ensure a reasonable minimum
+            self.warning(f"Configured max_n_predict ({effective_max_predict}) is very low. Setting to minimum 64.")
+            effective_max_predict = 64
+
+
+
+        # --- Check if Chat Template Exists ---
+        tokenizer_or_processor = processor if processor else tokenizer
+        if tokenizer_or_processor and hasattr(tokenizer_or_processor, 'chat_template') and tokenizer_or_processor.chat_template:
+             ASCIIColors.info("Model has a chat template defined.")
+             apply_chat_template = True # Ensure it's enabled if found
+        else:
+             ASCIIColors.warning("Model does not have a chat template defined in its tokenizer/processor config. Will use raw prompt input.")
+             apply_chat_template = False # Disable if not found
+
+
+        return {
+            "model_name": current_model_name,
+            "model": model,
+            "tokenizer": tokenizer,
+            "processor": processor,
+            "device": device,
+            "binding_type": binding_type,
+            "supported_extensions": supported_extensions,
+            "ctx_size": effective_ctx_size,
+            "max_n_predict": effective_max_predict,
+            "apply_chat_template": apply_chat_template,
+            "execution_backend": execution_backend,
+        }
+
+    def _resident_model_key(self, model_full_path: Path) -> tuple:
+        """ Settings that change what _load_model_components produces for a model folder. """
+        cfg = self.binding_config.config
+        return (
+            str(model_full_path.resolve()),
+            cfg.get("quantization_bits", "None"),
+            cfg.get("execution_backend", "torch"),
+            cfg.get("export_int8", False),
+            cfg.get("device", "auto"),
+            cfg.get("use_flash_attention_2", False),
+            cfg.get("trust_remote_code", False),
+            cfg.get("auto_infer_ctx_size", True),
+            cfg.get("ctx_size", 4096),
+            cfg.get("max_n_predict", 1024),
+        )
+
+    def _get_or_load_model_components(self, model_name: str, model_full_path: Path) -> Dict[str, Any]:
+        """ Returns the resident components of a model if it is still loaded, otherwise loads it. """
+        budget = int(self.binding_config.config.get("resident_models_budget_mb", 0)) * 1024 * 1024
+        if budget <= 0:
+            self.resident_models.clear()
+            return self._load_model_components(model_name, model_full_path)
+        key = self._resident_model_key(model_full_path)
+        components = self.resident_models.get(key)
+        if components is not None:
+            ASCIIColors.success(f"Model {model_name} is still resident in memory. Reusing it.")
+            return components
+        # Make room for the new model before loading it
+        weights_size = sum(f.stat().st_size for pattern in ["*.safetensors", "*.bin", "*.pth"] for f in model_full_path.glob(pattern))
+        self._evict_resident_models(max(budget - weights_size, 0), keep=self.model)
+        components = self._load_model_components(model_name, model_full_path)
+        try:
+            nbytes = components["model"].get_memory_footprint()
+        except Exception:
+            nbytes = weights_size
+        self.resident_models.put(key, components, nbytes)
+        return components
+
+    def _evict_resident_models(self, limit_bytes: Optional[int] = None, keep: Optional[Any] = None) -> None:
+        """ Unloads the least recently used resident models until they fit in the budget. The model in use is kept. """
+        if limit_bytes is None:
+            limit_bytes = int(self.binding_config.config.get("resident_models_budget_mb", 0)) * 1024 * 1024
+        evicted = self.resident_models.evict(limit_bytes, keep=keep if keep is not None else self.model)
+        if evicted:
+            self.info(f"Unloading resident models: {', '.join(evicted)}")
+            AdvancedGarbageCollector.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def _int8_dynamic_cache_file(self, model_full_path: Path) -> Path:
+        """
+        Returns the file caching the int8 dynamic quantized version of a model.
+        The name depends on the weight files and library versions, so any change triggers a new quantization.
+        """
+        fingerprint = hashlib.sha1()
+        for weight_file in sorted(f for pattern in ["*.safetensors", "*.bin", "*.pth"] for f in model_full_path.glob(pattern)):
+            stat = weight_file.stat()
+            fingerprint.update(f"{weight_file.name}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf8"))
+        fingerprint.update(f"{torch.__version__}|{transformers.__version__}|{torch.backends.quantized.engine}".encode("utf8"))
+        if os.access(model_full_path, os.W_OK):
+            cache_dir = model_full_path / ".int8_dynamic"
+        else: # Read only model volume
+            cache_dir = self.lollms_paths.personal_data_path / "hugging_face" / "int8_dynamic" / model_full_path.name
+        return cache_dir / f"{fingerprint.hexdigest()[:16]}.pt"
+
+    def _quantize_int8_dynamic(self, model, cache_file: Path):
+        """ Quantizes the linear layers of a CPU model to int8 and caches the result on disk. """
+        start_time = perf_counter()
+        size_before = model.get_memory_footprint()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        quantized_size = sum(
+            module.weight().numel() for module in model.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+        ) + sum(p.numel() * p.element_size() for p in model.parameters())
+        self.info(f"int8 dynamic quantization done in {perf_counter() - start_time:.2f} seconds. Weights: {size_before/1e9:.2f} GB -> {quantized_size/1e9:.2f} GB")
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            for old_file in cache_file.parent.glob("*.pt"):
+                old_file.unlink() # Quantized from older weights or library versions
+            temp_file = cache_file.with_suffix(".tmp")
+            torch.save(model, temp_file)
+            temp_file.replace(cache_file)
+            self.info(f"Cached the quantized model in {cache_file}")
+        except Exception as ex:
+            self.warning(f"Couldn't cache the quantized model: {ex}")
+        return model
+
+    def _exported_model_dir(self, model_full_path: Path, backend: str, int8: bool) -> Path:
+        """
+        Returns the folder holding the ONNX/OpenVINO export of a model.
+        Like the int8 dynamic cache, the name depends on the weight files, so changed weights are exported again.
+        """
+        fingerprint = hashlib.sha1()
+        for weight_file in sorted(f for pattern in ["*.safetensors", "*.bin", "*.pth"] for f in model_full_path.glob(pattern)):
+            stat = weight_file.stat()
+            fingerprint.update(f"{weight_file.name}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf8"))
+        fingerprint.update(f"{transformers.__version__}".encode("utf8"))
+        if os.access(model_full_path, os.W_OK):
+            export_root = model_full_path / ".exported"
+        else: # Read only model volume
+            export_root = self.lollms_paths.personal_data_path / "hugging_face" / "exported" / model_full_path.name
+        return export_root / f"{backend}{'_int8' if int8 else ''}-{fingerprint.hexdigest()[:16]}"
+
+    def _load_exported_model(self, model_full_path: Path, backend: str):
+        """
+        Loads a causal LM on CPU through ONNX Runtime or OpenVINO (optimum), exporting it first if needed.
+        The export (with int8 weights if export_int8 is set) is saved once and loaded directly afterwards.
+        The returned model has the usual generate() and keeps the KV cache on the runtime side
+        (IO binding for ONNX Runtime, stateful model for OpenVINO).
+        """
+        trust_code = self.binding_config.config.get("trust_remote_code", False)
+        int8 = self.binding_config.config.get("export_int8", False)
+        export_dir = self._exported_model_dir(model_full_path, backend, int8)
+        exported = (export_dir / "config.json").exists()
+        if not exported:
+            self.info(f"Exporting {model_full_path.name} for {backend} (only done once). This may take a while...")
+        if backend == "onnxruntime":
+            if not (pm.is_installed("optimum") and pm.is_installed("onnxruntime")):
+                pm.install("optimum[onnxruntime]")
+            from optimum.onnxruntime import ORTModelForCausalLM
+            file_name = "model_quantized.onnx" if int8 else "model.onnx"
+            if not exported:
+                temp_dir = export_dir.with_name(export_dir.name + ".tmp")
+                model = ORTModelForCausalLM.from_pretrained(model_full_path, export=True, use_cache=True, trust_remote_code=trust_code)
+                model.save_pretrained(temp_dir)
+                del model
+                if int8:
+                    from optimum.onnxruntime import ORTQuantizer
+                    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+                    quantizer = ORTQuantizer.from_pretrained(temp_dir, file_name="model.onnx")
+                    quantizer.quantize(save_dir=temp_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=True))
+                    for float_file in temp_dir.glob("model.onnx*"): # The float graph and its external data
+                        float_file.unlink()
+                os.replace(temp_dir, export_dir)
+                self.info(f"Exported the model to {export_dir}")
+            model = ORTModelForCausalLM.from_pretrained(
+                export_dir, file_name=file_name, use_cache=True, use_io_binding=True,
+                provider="CPUExecutionProvider", trust_remote_code=trust_code
+            )
+        else:
+            if not pm.is_installed("optimum-intel"):
+                pm.install("optimum[openvino]")
+            from optimum.intel import OVModelForCausalLM
+            if not exported:
+                temp_dir = export_dir.with_name(export_dir.name + ".tmp")
+                model = OVModelForCausalLM.from_pretrained(model_full_path, export=True, load_in_8bit=int8, trust_remote_code=trust_code)
+                model.save_pretrained(temp_dir)
+                del model
+                os.replace(temp_dir, export_dir)
+                self.info(f"Exported the model to {export_dir}")
+            model = OVModelForCausalLM.from_pretrained(export_dir, trust_remote_code=trust_code)
+        for stale_dir in export_dir.parent.glob(export_dir.name.split("-")[0] + "-*"):
+            if stale_dir != export_dir and stale_dir.is_dir():
+                shutil.rmtree(stale_dir, ignore_errors=True) # Exported from older weights (or an unfinished export)
+        return model
+
+    def _apply_model_components(self, components: Dict[str, Any]) -> None:
+        """ Installs freshly loaded components as the model in use, in a single step. """
+        with self.model_swap_lock:
+            self.model = components["model"]
+            self.tokenizer = components["tokenizer"]
+            self.processor = components["processor"]
+            self.device = components["device"]
+            self.binding_type = components["binding_type"]
+            self.execution_backend = components.get("execution_backend", "torch")
+            self.SAFE_STORE_SUPPORTED_FILE_EXTENSIONS = components["supported_extensions"]
+            self.config.ctx_size = components["ctx_size"]
+            self.config.max_n_predict = components["max_n_predict"]
+            # Ensure the binding's config reflects the potentially updated values
+            self.binding_config.config["ctx_size"] = components["ctx_size"]
+            self.binding_config.config["max_n_predict"] = components["max_n_predict"]
+            self.binding_config.config["apply_chat_template"] = components["apply_chat_template"]
+            if self.prefix_cache is not None:
+                self.prefix_cache.clear() # Caches of the previous model are useless
+            self.image_cache.clear_features()
+            self.template_token_cache.clear() # Token ids of the previous tokenizer
+            # A resident model may come back with adapters loaded
+            self.loaded_adapters = OrderedDict((name, 0) for name in getattr(self.model, "peft_config", {}) or {})
+            self.adapter_gate.reset()
+            self.optimized_decode = None # Built again for the new model at the next generation
+            image_processor = getattr(self.processor, "image_processor", None)
+            if image_processor is not None and not isinstance(image_processor, CachedImageProcessor):
+                self.processor.image_processor = CachedImageProcessor(image_processor, self.image_cache)
+        ASCIIColors.success(f"Model {components['model_name']} loaded successfully.")
+        ASCIIColors.success(f"Effective Ctx: {self.config.ctx_size}, Max Gen: {self.config.max_n_predict}. Type: {self.binding_type.name}")
+
+    def _has_memory_for(self, model_full_path: Path) -> bool:
+        """ Rough check that the weights of a model fit in the free memory next to the model in use. """
+        weights_size = sum(f.stat().st_size for pattern in ["*.safetensors", "*.bin", "*.pth"] for f in model_full_path.glob(pattern))
+        try:
+            if torch.cuda.is_available() and self.device and "cuda" in str(self.device):
+                free_memory = torch.cuda.mem_get_info()[0]
+            else:
+                import psutil
+                free_memory = psutil.virtual_memory().available
+        except Exception as ex:
+            self.warning(f"Couldn't determine free memory: {ex}")
+            return True
+        return free_memory > weights_size * 1.1
+
+    def load_model_async(self, model_name: str, model_full_path: Path) -> "ModelLoadFuture":
+        """
+        Loads a model on a background thread and swaps it in once it is ready.
+        The previous model keeps serving requests meanwhile, unless there is not enough free memory to hold both.
+        Returns a future that resolves to the binding once the new model is in use.
+        """
+        future = ModelLoadFuture(model_name)
+        with self.model_swap_lock:
+            self.model_load_id += 1
+            load_id = self.model_load_id
+            self.model_load_future = future
+
+        def runner():
+            future.set_running_or_notify_cancel()
+            try:
+                if self.model is not None and self.resident_models.get(self._resident_model_key(model_full_path)) is None and not self._has_memory_for(model_full_path):
+                    future.set_status("Not enough free memory to keep the current model while loading. Unloading it first")
+                    self.resident_models.clear()
+                    self._unload_model()
+                future.set_status(f"Loading from {model_full_path}")
+                components = self._get_or_load_model_components(model_name, model_full_path)
+                if load_id != self.model_load_id:
+                    future.set_status("Superseded by a newer load request. Discarding it")
+                    del components
+                    AdvancedGarbageCollector.collect()
+                    future.set_result(None)
+                    return
+                self._apply_model_components(components)
+                self._evict_resident_models()
+                # Free the previous model once no generation uses it anymore
+                AdvancedGarbageCollector.collect()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                future.set_status("Ready")
+                future.set_result(self)
+            except Exception as e:
+                self.error(f"Failed to load model {model_name}: {e}")
+                trace_exception(e)
+                future.set_status(f"Failed: {e}")
+                future.set_exception(e)
+
+        Thread(target=runner, name="hf_model_loader", daemon=True).start()
+        return future
+
+    def convert_to_gguf(self, model_name: Optional[str] = None, quantizations: Optional[List[str]] = None) -> "GGUFConversionJob":
+        """
+        Converts a local transformers model (the current one by default) to GGUF and quantizes it, on a background thread.
+        The conversion uses llama.cpp's convert_hf_to_gguf.py (cloned on first use) and the quantization uses llama_cpp.llama_model_quantize.
+        Files go to <personal models>/gguf/<model name>/, where the llama.cpp bindings list them.
+        Each file has a provenance JSON recording the hash of its source weights, so up to date files are not converted again.
+        Returns a job (future) that resolves to the list of GGUF files.
+        """
+        model_name = model_name or self.config.model_name
+        quantizations = [q.strip().upper() for q in (quantizations or self.binding_config.config.get("gguf_quantizations", "Q4_K_M").split(",")) if q.strip()]
+        with self.gguf_jobs_lock:
+            running_job = self.gguf_jobs.get(model_name)
+            if running_job is not None and not running_job.done():
+                return running_job # Same model already being converted
+            job = GGUFConversionJob(model_name)
+            self.gguf_jobs[model_name] = job
+
+        def runner():
+            job.set_running_or_notify_cancel()
+            try:
+                job.set_result(self._run_gguf_conversion(model_name, quantizations, job))
+                job.set_status("Done", 100)
+            except Exception as e:
+                self.error(f"GGUF conversion of {model_name} failed: {e}")
+                trace_exception(e)
+                job.set_status(f"Failed: {e}")
+                job.set_exception(e)
+
+        Thread(target=runner, name="hf_gguf_converter", daemon=True).start()
+        return job
+
+    def _gguf_source_hash(self, model_full_path: Path) -> str:
+        """ Hash of the files a GGUF conversion reads (weights, configuration and tokenizer), by name, size and modification time. """
+        source_hash = hashlib.sha256()
+        for source_file in sorted(f for f in model_full_path.iterdir() if f.is_file()):
+            stat = source_file.stat()
+            source_hash.update(f"{source_file.name}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf8"))
+        return source_hash.hexdigest()
+
+    def _get_llama_cpp_converter(self, job: "GGUFConversionJob") -> Path:
+        """ Returns the llama.cpp source folder holding convert_hf_to_gguf.py, shallow cloning llama.cpp on first use. """
+        configured_path = self.binding_config.config.get("llama_cpp_source_path", "").strip()
+        llama_cpp_path = Path(configured_path) if configured_path else self.lollms_paths.personal_data_path / "hugging_face" / "llama.cpp"
+        if not (llama_cpp_path / "convert_hf_to_gguf.py").exists():
+            if configured_path:
+                raise FileNotFoundError(f"convert_hf_to_gguf.py not found in {llama_cpp_path}")
+            if shutil.which("git") is None:
+                raise RuntimeError("git is needed to fetch llama.cpp's converter. Install git or set llama_cpp_source_path to a llama.cpp source folder.")
+            job.set_status("Fetching llama.cpp converter")
+            llama_cpp_path.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.run(["git", "clone", "--depth", "1", "https://github.com/ggml-org/llama.cpp.git", str(llama_cpp_path)], check=True, capture_output=True)
+        for package in ["gguf", "sentencepiece", "protobuf"]:
+            if not pm.is_installed(package):
+                pm.install(package)
+        return llama_cpp_path
+
+    def _run_gguf_conversion(self, model_name: str, quantizations: List[str], job: "GGUFConversionJob") -> List[Path]:
+        unknown = [q for q in quantizations if q not in GGUF_QUANTIZATIONS]
+        if unknown or not quantizations:
+            raise ValueError(f"Unsupported GGUF quantization(s) {unknown}. Supported: {', '.join(GGUF_QUANTIZATIONS)}")
+        model_full_path = self.get_local_hf_model_path(model_name)
+        if model_full_path is None or not (model_full_path / "config.json").exists():
+            raise FileNotFoundError(f"Local model {model_name} not found")
+        output_dir = self.lollms_paths.personal_models_path / "gguf" / model_name.replace("/", "__")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        base_name = model_full_path.name
+        source_hash = self._gguf_source_hash(model_full_path)
+
+        def is_up_to_date(gguf_file: Path) -> bool:
+            provenance_file = gguf_file.with_name(gguf_file.name + ".provenance.json")
+            if not gguf_file.exists() or not provenance_file.exists():
+                return False
+            try:
+                return json.loads(provenance_file.read_text(encoding="utf8")).get("source_sha256") == source_hash
+            except Exception:
+                return False
+
+        targets = {q: output_dir / f"{base_name}.{q}.gguf" for q in quantizations}
+        pending = [q for q, target in targets.items() if not is_up_to_date(target)]
+        if not pending:
+            self.info(f"GGUF files of {model_name} are up to date")
+            return list(targets.values())
+
+        llama_cpp_path = self._get_llama_cpp_converter(job)
+        converter_version = subprocess.run(["git", "-C", str(llama_cpp_path), "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() if shutil.which("git") else ""
+
+        def write_provenance(gguf_file: Path, quantization: str):
+            provenance = {
+                "source_model": model_name,
+                "source_path": str(model_full_path),
+                "source_sha256": source_hash,
+                "quantization": quantization,
+                "llama_cpp_commit": converter_version,
+                "created": datetime.now().isoformat(),
+            }
+            gguf_file.with_name(gguf_file.name + ".provenance.json").write_text(json.dumps(provenance, indent=4), encoding="utf8")
+
+        # 1. Full precision GGUF, written to a .tmp file and only moved in place once complete (kept only if F16 was asked)
+        partial_f16_file = output_dir / f"{base_name}.F16.gguf.tmp"
+        f16_file = targets["F16"] if "F16" in targets and is_up_to_date(targets["F16"]) else partial_f16_file
+        conversion_share = 60 if pending != ["F16"] else 100
+        if f16_file == partial_f16_file:
+            job.set_status("Converting to GGUF (F16)", 0)
+            environment = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(llama_cpp_path / "gguf-py"), os.environ.get("PYTHONPATH")]))}
+            process = subprocess.Popen(
+                [sys.executable, str(llama_cpp_path / "convert_hf_to_gguf.py"), str(model_full_path), "--outfile", str(f16_file), "--outtype", "f16"],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=environment, text=True, bufsize=1
+            )
+            log_tail = []
+            for line in process.stdout:
+                log_tail = (log_tail + [line.rstrip()])[-20:]
+                percentages = re.findall(r"(\d{1,3})%\|", line) # tqdm progress of the tensors being written
+                if percentages:
+                    job.set_status("Writing GGUF tensors", int(percentages[-1]) * conversion_share / 100)
+            if process.wait() != 0:
+                f16_file.unlink(missing_ok=True)
+                raise RuntimeError("convert_hf_to_gguf.py failed:\n" + "\n".join(log_tail))
+            if "F16" in targets:
+                f16_file = partial_f16_file.replace(targets["F16"]) # Never leave a partial file where list_models would see it
+                write_provenance(f16_file, "F16")
+        job.set_status("Converted to GGUF", conversion_share)
+
+        # 2. Quantizations
+        to_quantize = [q for q in pending if q != "F16"]
+        if to_quantize:
+            try:
+                import llama_cpp
+            except ImportError:
+                job.set_status("Installing llama-cpp-python")
+                pm.install("llama-cpp-python")
+                import llama_cpp
+            for index, quantization in enumerate(to_quantize):
+                job.set_status(f"Quantizing to {quantization}", conversion_share + index * (100 - conversion_share) / len(to_quantize))
+                params = llama_cpp.llama_model_quantize_default_params()
+                params.ftype = getattr(llama_cpp, GGUF_QUANTIZATIONS[quantization])
+                params.nthread = os.cpu_count() or 1
+                partial_file = targets[quantization].with_name(targets[quantization].name + ".tmp")
+                start_time = perf_counter()
+                if llama_cpp.llama_model_quantize(str(f16_file).encode("utf8"), str(partial_file).encode("utf8"), ctypes.byref(params)) != 0:
+                    partial_file.unlink(missing_ok=True)
+                    raise RuntimeError(f"llama_model_quantize failed for {quantization}")
+                partial_file.replace(targets[quantization]) # Never leave a partial file where list_models would see it
+                write_provenance(targets[quantization], quantization)
+                self.info(f"Wrote {targets[quantization].name} in {perf_counter() - start_time:.1f} seconds")
+        partial_f16_file.unlink(missing_ok=True)
+        self.success(f"GGUF conversion of {model_name} done. Files are in {output_dir}")
+        return list(targets.values())
+
+    def _wait_for_model(self) -> bool:
+        """ Waits for the background load when no model is in use yet. Returns True if a model is ready. """
+        while self.model is None:
+            future = self.model_load_future
+            if future is None or future.done():
+                break
+            self.info(f"Waiting for {future.model_name} to finish loading ({future.status})")
+            try:
+                future.result()
+            except Exception:
+                pass # Already reported by the loader
+        return self.model is not None
+
     def _unload_model(self):
         """ Safely unloads the model and associated components, freeing memory. """
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        self.optimized_decode = None
+        self.draft_model = None
+        self.draft_model_key = None
         if self.model is not None:
             self.info("Unloading previous model from memory...")
             try:
@@ -767,15 +2331,28 @@ class HuggingFaceLocal(LLMBinding):
 
         return final_gen_kwargs
 
-
-
+    def _get_stop_strings(self, gpt_params: dict) -> List[str]:
+        """ Stop strings of a request: the lollms discussion headers plus the optional 'stop' parameter (string or list). """
+        stop_strings = [
+            getattr(self.config, "start_header_id_template", None),
+            getattr(self.config, "start_user_header_id_template", None),
+            getattr(self.config, "start_ai_header_id_template", None),
+        ]
+        extra_stops = gpt_params.get("stop")
+        if isinstance(extra_stops, str):
+            extra_stops = [extra_stops]
+        if isinstance(extra_stops, (list, tuple)):
+            stop_strings += [stop for stop in extra_stops if isinstance(stop, str)]
+        elif extra_stops is not None:
+            self.warning(f"Invalid stop sequence format ignored: {extra_stops}")
+        return list(dict.fromkeys(stop for stop in stop_strings if stop and stop.strip()))
 
     def _generation_thread_runner(self, **kwargs):
         """ Helper function to run model.generate in a thread and catch exceptions. """
         try:
             with torch.no_grad():
                 # The stopping_criteria passed in kwargs will now be used by generate
-                self.model.generate(**kwargs)
+                self.last_generation_output = self.model.generate(**kwargs)
         except Exception as e:
             # Don't check _stop_generation here, as it might be a legitimate stop
             # Only log if it's an actual *unexpected* error
@@ -794,54 +2371,38 @@ class HuggingFaceLocal(LLMBinding):
             pass # Clean exit
 
 
+    @wait_for_model_load
+    @with_lora_adapter
     def generate(self,
                  prompt: str,
                  n_predict: Optional[int] = None,
                  callback: Optional[Callable[[str, int], bool]] = None, # Adjusted callback sig
                  verbose: bool = False,
                  **gpt_params) -> str:
-        """ Generates text using the loaded text-only model, applying chat template if enabled. """
+        """
+        Generates text using the loaded text-only model, applying chat template if enabled.
+        gpt_params may set n (number of samples sharing one prefill, with optional per sample callbacks, see _generate_samples),
+        stop (extra stop strings) and adapter (name of the LoRA adapter to use).
+        The request goes to one decode path: samples, batching, the inline loop or the generation thread.
+        """
         effective_n_predict = self._validate_n_predict(n_predict)
         tokenizer_or_processor = self._get_tokenizer_or_processor()
         if not self.model or not tokenizer_or_processor:
             self.error("Model or Tokenizer/Processor not loaded.")
             return "[Error: Model not ready]"
 
-        self.stop_generation() # Stop any previous generation and clear thread/flag
+        batching = self.binding_config.config.get("batching_enabled", False) and not self._lora_enabled() # A batch runs one adapter
+        torch_backend = self.execution_backend == "torch" # Exported runtimes only go through their generate()
+        optimize_decode = torch_backend and self.binding_config.config.get("optimize_decode", False)
+        inline_decode = torch_backend and (optimize_decode or self.binding_config.config.get("decode_loop", "threaded") == "inline")
+        if not batching and not inline_decode:
+            self.stop_generation() # Stop any previous generation and clear thread/flag
 
         try:
             final_gen_kwargs = self._prepare_common_generation_kwargs(effective_n_predict, gpt_params)
             if self.config.debug or verbose: ASCIIColors.debug(f"Text Gen raw params: {gpt_params}")
             if self.config.debug or verbose: ASCIIColors.debug(f"Text Gen effective params: {final_gen_kwargs}")
-
-            apply_template = self.binding_config.config.get("apply_chat_template", True)
-            input_ids = None
-
-            # --- Prepare Inputs (Apply Template if enabled) ---
-            # (Keep your existing template application logic here)
-            # ... (your code for applying template or using raw prompt) ...
-            if apply_template and hasattr(tokenizer_or_processor, 'chat_template') and tokenizer_or_processor.chat_template:
-                try:
-                    messages = self.parse_lollms_discussion(prompt)
-                    if not messages:
-                        self.warning("Prompt parsing resulted in empty message list. Using raw prompt.")
-                        input_ids = tokenizer_or_processor.encode(prompt, return_tensors="pt").to(self.model.device if hasattr(self.model,'device') else self.device)
-                    else:
-                        if self.config.debug or verbose: ASCIIColors.debug(f"Parsed messages for template: {messages}")
-                        templated_inputs = tokenizer_or_processor.apply_chat_template(
-                            messages, add_generation_prompt=True, return_tensors="pt"
-                        )
-                        input_ids = templated_inputs.to(self.model.device if hasattr(self.model,'device') else self.device)
-                        if self.config.debug or verbose: ASCIIColors.debug(f"Formatted prompt via template (tokens): {input_ids.shape}")
-                except Exception as template_ex:
-                    self.error(f"Failed to apply chat template: {template_ex}. Falling back to raw prompt.")
-                    trace_exception(template_ex)
-                    input_ids = tokenizer_or_processor.encode(prompt, return_tensors="pt").to(self.model.device if hasattr(self.model,'device') else self.device)
-            else:
-                if apply_template: self.warning("Chat template application requested but no template found or disabled. Using raw prompt.")
-                input_ids = tokenizer_or_processor.encode(prompt, return_tensors="pt").to(self.model.device if hasattr(self.model,'device') else self.device)
-            # --- End Input Preparation ---
-
+            input_ids = self._encode_text_prompt(prompt, tokenizer_or_processor, verbose)
 
             input_token_count = input_ids.shape[1]
             if input_token_count >= self.config.ctx_size:
@@ -861,6 +2422,53 @@ class HuggingFaceLocal(LLMBinding):
             if callback: callback(f"Input Prep Error: {e}", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_EXCEPTION)
             return f"[Input Preparation Error: {e}]"
 
+        stop_strings = self._get_stop_strings(gpt_params)
+        num_samples = int(gpt_params.get("n", 1) or 1)
+        if num_samples > 1 and torch_backend: # The samples are their own batch, they never go through the batching scheduler
+            return self._generate_samples(input_ids, final_gen_kwargs, num_samples, callback, gpt_params.get("callbacks"), stop_strings, verbose)
+        if batching:
+            return self._generate_batched(input_ids, final_gen_kwargs, callback, verbose, stop_strings)
+        dynamic_kv = self.binding_config.config.get("kv_policy", "dynamic") == "dynamic"
+        use_prefix_cache = self.binding_config.config.get("prefix_cache_enabled", False) and dynamic_kv and torch_backend
+        if inline_decode:
+            past_key_values = self._take_prefix_cache(input_ids[0].tolist(), verbose) if use_prefix_cache and not optimize_decode else None
+            return self._decode_inline({"input_ids": input_ids}, final_gen_kwargs, callback, verbose, past_key_values, optimized=optimize_decode, stop_strings=stop_strings)
+        return self._generate_threaded(input_ids, final_gen_kwargs, callback, verbose, stop_strings, use_prefix_cache)
+
+    def _encode_text_prompt(self, prompt: str, tokenizer_or_processor, verbose: bool) -> torch.Tensor:
+        """ Tokenizes a text prompt, through the chat template (and the template token cache) when enabled. """
+        device = self.model.device if hasattr(self.model,'device') else self.device
+        apply_template = self.binding_config.config.get("apply_chat_template", True)
+        if not (apply_template and hasattr(tokenizer_or_processor, 'chat_template') and tokenizer_or_processor.chat_template):
+            if apply_template: self.warning("Chat template application requested but no template found or disabled. Using raw prompt.")
+            return tokenizer_or_processor.encode(prompt, return_tensors="pt").to(device)
+        try:
+            messages = self.parse_lollms_discussion(prompt)
+            if not messages:
+                self.warning("Prompt parsing resulted in empty message list. Using raw prompt.")
+                return tokenizer_or_processor.encode(prompt, return_tensors="pt").to(device)
+            if self.config.debug or verbose: ASCIIColors.debug(f"Parsed messages for template: {messages}")
+            templated_text = tokenizer_or_processor.apply_chat_template(
+                messages, add_generation_prompt=True, tokenize=False
+            )
+            self.template_token_cache.capacity = int(self.binding_config.config.get("template_token_cache_size", 16))
+            templated_ids = self.template_token_cache.tokenize(tokenizer_or_processor, templated_text) # Only tokenizes the new turns
+            input_ids = torch.tensor([templated_ids], dtype=torch.long, device=device)
+            if self.config.debug or verbose: ASCIIColors.debug(f"Templated token cache: {self.template_token_cache.stats()}")
+            if self.config.debug or verbose: ASCIIColors.debug(f"Formatted prompt via template (tokens): {input_ids.shape}")
+            return input_ids
+        except Exception as template_ex:
+            self.error(f"Failed to apply chat template: {template_ex}. Falling back to raw prompt.")
+            trace_exception(template_ex)
+            return tokenizer_or_processor.encode(prompt, return_tensors="pt").to(device)
+
+    def _generate_threaded(self, input_ids: torch.Tensor, final_gen_kwargs: dict, callback: Optional[Callable[[str, int], bool]], verbose: bool, stop_strings: List[str], use_prefix_cache: bool) -> str:
+        """
+        Runs model.generate in the generation thread and streams its text from the calling thread, up to the first stop string.
+        On the torch backend, the KV cache follows the kv_policy (or comes from the prefix cache) and the draft model assists decoding.
+        """
+        tokenizer_or_processor = self._get_tokenizer_or_processor()
+        torch_backend = self.execution_backend == "torch"
         streamer = TextIteratorStreamer(
             tokenizer_or_processor, skip_prompt=True, skip_special_tokens=True
         )
@@ -876,6 +2484,8 @@ class HuggingFaceLocal(LLMBinding):
              stopping_criteria_list.append(existing_criteria) # Handle single criterion
 
         stopping_criteria_list.append(stop_criterion) # Add our custom stop checker
+        stopping_criteria_list.append(StopSequencesCriteria(getattr(tokenizer_or_processor, "tokenizer", tokenizer_or_processor), stop_strings, input_ids.shape[1]))
+        stop_filter = StopStringFilter(stop_strings)
 
 
         generation_kwargs_for_thread = {
@@ -884,13 +2494,33 @@ class HuggingFaceLocal(LLMBinding):
              "streamer": streamer,
              "stopping_criteria": stopping_criteria_list # Pass the combined list
         }
+        if use_prefix_cache:
+            generation_kwargs_for_thread["past_key_values"] = self._take_prefix_cache(input_ids[0].tolist(), verbose)
+        elif torch_backend:
+            try:
+                generation_kwargs_for_thread["past_key_values"] = self._new_kv_cache() # Held here to report its memory
+            except RuntimeError as e:
+                if callback: callback(str(e), MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_EXCEPTION)
+                return f"[Error: {e}]"
+        forward_counter = None
+        # Assisted generation crops the cache, which the sink cache can't do (see _kv_policy_setting_conflicts)
+        draft_model = self._get_draft_model() if torch_backend and self.binding_config.config.get("kv_policy", "dynamic") != "sink" else None
+        if draft_model is not None:
+            generation_kwargs_for_thread["assistant_model"] = draft_model
 
         output_buffer = ""
         start_time = perf_counter()
+        memory_monitor = PeakRSSMonitor().start()
 
         try:
             # Reset stop flag *before* starting the thread
             self._stop_generation = False
+            self.last_generation_output = None
+            if generation_kwargs_for_thread.get("past_key_values") is not None:
+                self._prefill_in_chunks(input_ids, generation_kwargs_for_thread["past_key_values"], verbose)
+            if draft_model is not None:
+                # Counted from here so the prefill chunks are not taken for assisted decoding forwards
+                forward_counter = ForwardCounter(target=self.model, draft=draft_model)
             self.generation_thread = Thread(target=self._generation_thread_runner, kwargs=generation_kwargs_for_thread)
             self.generation_thread.start()
             if self.config.debug or verbose: ASCIIColors.info("Starting text generation stream...")
@@ -904,6 +2534,7 @@ class HuggingFaceLocal(LLMBinding):
                     ASCIIColors.warning("Stop generation requested (detected in main loop).")
                     break # Exit loop even if streamer hasn't technically finished
 
+                new_text = stop_filter.push(new_text) # Holds back a possible stop string, cuts at a complete one
                 if new_text:
                     output_buffer += new_text
                     if callback:
@@ -923,6 +2554,10 @@ class HuggingFaceLocal(LLMBinding):
                              trace_exception(cb_ex)
                              self._stop_generation = True # Signal stop on callback error
                              break # Exit loop on error
+            held_text = "" if self._stop_generation else stop_filter.flush()
+            if held_text:
+                output_buffer += held_text
+                if callback: callback(held_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
 
             # Wait for thread to finish *after* the streamer is exhausted or loop broken
             if self.generation_thread and self.generation_thread.is_alive():
@@ -930,6 +2565,12 @@ class HuggingFaceLocal(LLMBinding):
                  self.generation_thread.join() # Wait for the thread runner to exit
                  if self.config.debug or verbose: ASCIIColors.info("Generation thread finished.")
 
+            self._report_kv_usage(generation_kwargs_for_thread.get("past_key_values"), verbose)
+            if use_prefix_cache:
+                self._store_prefix_cache(generation_kwargs_for_thread["past_key_values"])
+            if forward_counter is not None:
+                self._report_draft_stats(forward_counter, input_ids.shape[1], verbose)
+
 
 
         except Exception as e:
@@ -942,6 +2583,9 @@ class HuggingFaceLocal(LLMBinding):
         finally:
             # Thread cleanup is now handled within stop_generation or naturally when joined
             self.generation_thread = None # Clear reference after join/stop
+            if forward_counter is not None:
+                forward_counter.remove()
+            self._report_peak_memory(memory_monitor, verbose)
             end_time = perf_counter()
             total_time = end_time - start_time
             # Token counting might be slightly off if stopped early, but gives an idea
@@ -954,6 +2598,568 @@ class HuggingFaceLocal(LLMBinding):
 
         return output_buffer
 
+    def _registered_adapters(self) -> Dict[str, Path]:
+        """
+        LoRA (PEFT) adapters listed in the lora_adapters setting, by name. Entries are comma separated and are either
+        a folder (name = folder name) or name=folder. Folders are absolute or relative to the local transformers models folder.
+        """
+        adapters = {}
+        for entry in self.binding_config.config.get("lora_adapters", "").split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            name, _, location = entry.partition("=") if "=" in entry else (Path(entry).name, "", entry)
+            location_path = Path(location.strip())
+            adapters[name.strip()] = location_path if location_path.is_absolute() else self.get_local_hf_model_path(location.strip())
+        return adapters
+
+    def _lora_enabled(self) -> bool:
+        return self.model is not None and self.execution_backend == "torch" and (
+            bool(self.loaded_adapters) or bool(self.binding_config.config.get("lora_adapters", "").strip())
+        )
+
+    def _switch_adapter(self, name: Optional[str]) -> None:
+        """ Makes the adapter active (loading it on first use), or runs the base model for None. Called by the AdapterGate. """
+        if name is None:
+            if self.loaded_adapters:
+                self.model.disable_adapters()
+            return
+        if name not in self.loaded_adapters:
+            self._load_adapter(name)
+        self.model.set_adapter(name)
+        self.model.enable_adapters()
+        self.loaded_adapters.move_to_end(name)
+
+    def _load_adapter(self, name: str) -> None:
+        """ Loads a registered adapter on top of the resident base model, unloading the least recently used ones over the lora_budget_mb budget. """
+        adapter_path = self._registered_adapters().get(name)
+        if adapter_path is None:
+            raise ValueError(f"Unknown adapter '{name}'. Add it to the lora_adapters setting.")
+        if not (adapter_path / "adapter_config.json").exists():
+            raise ValueError(f"No PEFT adapter (adapter_config.json) found in {adapter_path}")
+        if not pm.is_installed("peft"):
+            pm.install("peft")
+        start_time = perf_counter()
+        self.model.load_adapter(str(adapter_path), adapter_name=name)
+        self.loaded_adapters[name] = sum(
+            p.numel() * p.element_size() for parameter_name, p in self.model.named_parameters() if f".{name}." in parameter_name
+        )
+        self.info(f"Loaded adapter {name} ({self.loaded_adapters[name]/(1024*1024):.1f} MB) in {perf_counter() - start_time:.2f} seconds")
+        budget = int(self.binding_config.config.get("lora_budget_mb", 1024)) * 1024 * 1024
+        while sum(self.loaded_adapters.values()) > budget and len(self.loaded_adapters) > 1:
+            evicted = next(adapter for adapter in self.loaded_adapters if adapter != name)
+            self.model.delete_adapter(evicted)
+            del self.loaded_adapters[evicted]
+            self.info(f"Unloaded adapter {evicted} (lora_budget_mb exceeded)")
+
+    def _get_draft_model(self):
+        """
+        Returns the draft model used for assisted generation, loading it next to the main model if needed.
+        Returns None if no draft model is configured or it can't be used with the main model.
+        """
+        draft_model_name = self.binding_config.config.get("draft_model_name", "").strip()
+        if not draft_model_name or self.model is None:
+            self.draft_model = None
+            self.draft_model_key = None
+            return None
+        key = (draft_model_name, str(self.model.device), str(self.model.dtype))
+        if self.draft_model is not None and self.draft_model_key == key:
+            return self.draft_model
+        self.draft_model = None
+        self.draft_model_key = key # Don't retry a failed load at every generation
+        draft_path = self.get_local_hf_model_path(draft_model_name)
+        if not draft_path or not self._is_valid_model_dir(draft_path):
+            self.warning(f"Draft model {draft_model_name} not found in {self.lollms_paths.personal_models_path / HF_LOCAL_MODELS_DIR}. Assisted generation disabled.")
+            return None
+        try:
+            trust_code = self.binding_config.config.get("trust_remote_code", False)
+            draft_config = AutoConfig.from_pretrained(draft_path, trust_remote_code=trust_code)
+            main_vocab_size = getattr(self.model.config, "vocab_size", None)
+            draft_vocab_size = getattr(draft_config, "vocab_size", None)
+            tokenizer = self._get_tokenizer_or_processor()
+            tokenizer = getattr(tokenizer, "tokenizer", tokenizer)
+            if draft_vocab_size is None or draft_vocab_size < len(tokenizer):
+                self.warning(f"Draft model {draft_model_name} doesn't share the vocabulary of the main model ({draft_vocab_size} vs {main_vocab_size}). Assisted generation disabled.")
+                return None
+            # Same sized vocabularies can still map the ids to other tokens, the draft tokens would be rejected or wrongly accepted
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_path, trust_remote_code=trust_code)
+            if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+                self.warning(f"Draft model {draft_model_name} doesn't use the tokenizer of the main model. Assisted generation disabled.")
+                return None
+            self.info(f"Loading draft model {draft_model_name}")
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_path, trust_remote_code=trust_code, torch_dtype=self.model.dtype, low_cpu_mem_usage=True
+            ).to(self.model.device)
+            self.draft_model.eval()
+        except Exception as e:
+            self.error(f"Failed to load draft model {draft_model_name}: {e}")
+            trace_exception(e)
+            self.draft_model = None
+        return self.draft_model
+
+    def _report_draft_stats(self, forward_counter: ForwardCounter, prompt_length: int, verbose: bool = False) -> None:
+        """
+        Computes the assisted generation statistics of the last generation.
+        Each main model forward yields the accepted draft tokens plus one token of its own,
+        so the accepted draft tokens are the generated tokens minus the main model forwards.
+        """
+        output = self.last_generation_output
+        if output is None:
+            return
+        generated = (output.sequences if hasattr(output, "sequences") else output)[0].shape[0] - prompt_length
+        target_forwards = forward_counter.counts["target"]
+        draft_tokens = forward_counter.counts["draft"]
+        accepted = max(generated - target_forwards, 0)
+        self.last_draft_stats = {
+            "generated_tokens": generated,
+            "target_forwards": target_forwards,
+            "draft_tokens": draft_tokens,
+            "accepted_draft_tokens": accepted,
+        }
+        if self.config.debug or verbose:
+            ASCIIColors.info(f"Assisted generation: {accepted}/{draft_tokens} draft tokens accepted ({100*accepted/max(draft_tokens,1):.1f}%), {generated} tokens in {target_forwards} main model forwards ({generated/max(target_forwards,1):.2f} tokens/forward)")
+
+    def _new_kv_cache(self):
+        """
+        Returns an empty key/value cache following the kv_policy setting:
+        dynamic grows with the text, sink keeps the first tokens (attention sinks) plus a window of recent tokens
+        for a constant memory, and quantized stores the keys/values in 2 or 4 bits (recent tokens stay in full precision).
+        Raises a RuntimeError if the policy can't be built with the installed packages.
+        """
+        policy = self.binding_config.config.get("kv_policy", "dynamic")
+        try:
+            if policy == "sink":
+                num_sink_tokens = int(self.binding_config.config.get("kv_sink_tokens", 4))
+                window_length = int(self.binding_config.config.get("kv_window_tokens", 2048))
+                if DynamicLayer is not None:
+                    rotary_emb = getattr(getattr(self.model, "model", self.model), "rotary_emb", None)
+                    if rotary_emb is None:
+                        raise ValueError("the sink policy needs a model with rotary position embeddings")
+                    return SinkWindowCache(num_sink_tokens, window_length, rotary_emb)
+                from transformers import SinkCache # Removed from transformers 4.53
+                return SinkCache(window_length=window_length, num_sink_tokens=num_sink_tokens)
+            if policy == "quantized":
+                if not pm.is_installed("optimum-quanto"):
+                    pm.install("optimum-quanto")
+                nbits = int(self.binding_config.config.get("kv_quant_bits", 4))
+                try:
+                    from transformers import QuantizedCache
+                    return QuantizedCache(backend="quanto", config=self.model.config, nbits=nbits)
+                except (ImportError, TypeError): # Older transformers
+                    from transformers import QuantizedCacheConfig, QuantoQuantizedCache
+                    return QuantoQuantizedCache(cache_config=QuantizedCacheConfig(backend="quanto", nbits=nbits))
+        except Exception as e:
+            self.error(f"KV policy '{policy}' is not available: {e}")
+            raise RuntimeError(f"KV policy '{policy}' is not available with the installed packages ({e}). Choose another kv_policy.") from e
+        return DynamicCache()
+
+    def _report_kv_usage(self, cache, verbose: bool = False) -> None:
+        """ Records (and shows in debug mode) the memory held by the key/value cache of the last generation. """
+        if cache is None:
+            return
+        self.last_kv_stats = {
+            "policy": self.binding_config.config.get("kv_policy", "dynamic"),
+            "cache_type": type(cache).__name__,
+            "tokens": cache.get_seq_length(),
+            "bytes": kv_cache_nbytes(cache),
+        }
+        if self.config.debug or verbose:
+            stats = self.last_kv_stats
+            message = f"KV cache ({stats['cache_type']}): {stats['tokens']} tokens, {stats['bytes']/(1024*1024):.1f} MB for this session"
+            if self.prefix_cache is not None:
+                prefix_stats = self.prefix_cache.stats()
+                message += f", {prefix_stats['bytes']/(1024*1024):.1f} MB held by {prefix_stats['entries']} cached sessions"
+            ASCIIColors.info(message)
+
+    def _prefill_in_chunks(self, input_ids: torch.Tensor, cache, verbose: bool = False, always: bool = False) -> None:
+        """
+        Feeds the prompt, except its last token, to the model in windows of prefill_chunk_size tokens, filling cache.
+        Attention and activation memory then scale with the window instead of the whole prompt. The decoding
+        (generate or the inline loop) starts from the filled cache and only computes the last prompt token.
+        With always, the prompt is prefilled even when chunking is disabled or not needed (in a single window).
+        """
+        chunk_size = int(self.binding_config.config.get("prefill_chunk_size", 0))
+        start = cache.get_seq_length()
+        end = input_ids.shape[1] - 1
+        if always and end > start and (chunk_size <= 0 or end - start <= chunk_size):
+            chunk_size = end - start
+        elif chunk_size <= 0 or end - start <= chunk_size:
+            return
+        forward_parameters = inspect.signature(self.model.forward).parameters
+        extra_kwargs = {}
+        for name in ("logits_to_keep", "num_logits_to_keep"):
+            if name in forward_parameters:
+                extra_kwargs[name] = 1 # Don't materialize the vocabulary sized logits of the whole window
+                break
+        prefill_start = perf_counter()
+        with torch.no_grad():
+            for chunk_start in range(start, end, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, end)
+                self.model(
+                    input_ids=input_ids[:, chunk_start:chunk_end],
+                    attention_mask=torch.ones((input_ids.shape[0], chunk_end), dtype=torch.long, device=input_ids.device),
+                    cache_position=torch.arange(chunk_start, chunk_end, device=input_ids.device),
+                    past_key_values=cache, use_cache=True, **extra_kwargs
+                )
+        if self.config.debug or verbose:
+            ASCIIColors.info(f"Chunked prefill: {end - start} prompt tokens in windows of {chunk_size} in {perf_counter() - prefill_start:.2f} seconds")
+
+    def _report_peak_memory(self, monitor: PeakRSSMonitor, verbose: bool = False) -> None:
+        """ Records (and shows in debug mode) the peak resident memory measured during a request. """
+        self.last_peak_memory = monitor.stop()
+        if (self.config.debug or verbose) and self.last_peak_memory["peak_rss"]:
+            peak_mb = self.last_peak_memory["peak_rss"] / (1024 * 1024)
+            growth_mb = (self.last_peak_memory["peak_rss"] - self.last_peak_memory["start_rss"]) / (1024 * 1024)
+            ASCIIColors.info(f"Peak RSS during the request: {peak_mb:.0f} MB (+{growth_mb:.0f} MB)")
+
+    def _take_prefix_cache(self, prompt_tokens: List[int], verbose: bool = False):
+        """ Returns the cached past_key_values sharing the longest prefix with the prompt, or a fresh DynamicCache. """
+        capacity = int(self.binding_config.config.get("prefix_cache_capacity_mb", 2048)) * 1024 * 1024
+        if self.prefix_cache is None or self.prefix_cache.capacity_bytes != capacity:
+            self.prefix_cache = PrefixKVCacheStore(capacity)
+        cache, reused_tokens = self.prefix_cache.take(prompt_tokens)
+        if self.config.debug or verbose:
+            ASCIIColors.info(f"Prefix cache: reusing {reused_tokens}/{len(prompt_tokens)} prompt tokens. {self.prefix_cache.stats()}")
+        return cache if cache is not None else DynamicCache()
+
+    def _store_prefix_cache(self, cache, output=None) -> None:
+        """ Stores the cache of the last generation (or of output) under the tokens it holds (prompt and generated tokens). """
+        if output is None:
+            output = self.last_generation_output
+        if output is None or self.prefix_cache is None:
+            return # Generation failed, the cache content is unknown
+        sequence = (output.sequences if hasattr(output, "sequences") else output)[0].tolist()
+        cached_length = cache.get_seq_length()
+        if 0 < cached_length <= len(sequence):
+            self.prefix_cache.put(sequence[:cached_length], cache)
+
+    def _generate_batched(self, input_ids: torch.Tensor, final_gen_kwargs: dict, callback: Optional[Callable[[str, int], bool]], verbose: bool, stop_strings: Optional[List[str]] = None) -> str:
+        """ Submits a prepared text request to the batching scheduler and streams its output from the calling thread, up to the first stop string. """
+        if self.batching_scheduler is None:
+            self.batching_scheduler = BatchingScheduler(
+                self,
+                int(self.binding_config.config.get("batch_window_ms", 20)),
+                int(self.binding_config.config.get("max_batch_size", 8))
+            )
+        request = BatchedRequest(input_ids[0].tolist(), final_gen_kwargs, final_gen_kwargs["max_new_tokens"])
+        start_time = perf_counter()
+        self.batched_requests.add(request)
+        self.batching_scheduler.submit(request)
+        stop_filter = StopStringFilter(stop_strings or [])
+        callback_stopped = False
+        output_buffer = ""
+        while True:
+            chunk = request.queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                self.error(f"Batched generation error: {chunk}")
+                if callback: callback(f"Generation Error: {chunk}", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_EXCEPTION)
+                output_buffer += f"\n[Error during generation: {chunk}]"
+                continue
+            chunk = stop_filter.push(chunk)
+            if stop_filter.stopped:
+                request.stopped = True # Ends this sequence at the stop string
+            if not chunk:
+                continue
+            output_buffer += chunk
+            if callback and not callback_stopped:
+                try:
+                    if callback(chunk, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK) is False:
+                        request.stopped = callback_stopped = True # Only this sequence stops, the rest of the batch continues
+                except Exception as cb_ex:
+                    self.error(f"Callback exception: {cb_ex}")
+                    trace_exception(cb_ex)
+                    request.stopped = callback_stopped = True
+        self.batched_requests.discard(request)
+        held_text = "" if callback_stopped else stop_filter.flush()
+        if held_text:
+            output_buffer += held_text
+            if callback: callback(held_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
+        if self.config.debug or verbose:
+            total_time = perf_counter() - start_time
+            ASCIIColors.info(f"Batched generation finished in {total_time:.2f} seconds. Tokens: {len(request.tokens)}, Tokens/sec: {len(request.tokens)/total_time if total_time > 0 else 0:.2f}")
+        return output_buffer
+
+    def _generate_samples(self, input_ids: torch.Tensor, final_gen_kwargs: dict, num_samples: int, callback: Optional[Callable[[str, int], bool]], callbacks: Optional[List[Callable[[str, int], bool]]], stop_strings: List[str], verbose: bool) -> str:
+        """
+        Generates num_samples completions of one prompt: the prompt is prefilled once, the KV cache is repeated
+        for each sample and the samples are decoded as one batch. Sample i streams to callbacks[i] when callbacks
+        are given, otherwise the first sample streams to callback. All the texts are left in self.last_samples,
+        the first one is returned. With the prefix cache, the prefilled prompt is stored back for the next turns
+        and the samples decode from a copy of it.
+        """
+        if not final_gen_kwargs.get("do_sample", False):
+            self.warning(f"{num_samples} samples requested with greedy decoding: they will all be identical.")
+        use_prefix_cache = self.binding_config.config.get("prefix_cache_enabled", False) and self.binding_config.config.get("kv_policy", "dynamic") == "dynamic"
+        cache = self._take_prefix_cache(input_ids[0].tolist(), verbose) if use_prefix_cache else DynamicCache()
+        sample_callbacks = list(callbacks or [])[:num_samples]
+        sample_callbacks += [callback if not sample_callbacks and index == 0 else None for index in range(len(sample_callbacks), num_samples)]
+        shared_queue = queue.Queue()
+        requests = []
+        for index in range(num_samples):
+            request = BatchedRequest(input_ids[0].tolist(), final_gen_kwargs, final_gen_kwargs["max_new_tokens"])
+            request.queue = SampleChannel(shared_queue, index)
+            requests.append(request)
+        self.batched_requests.update(requests)
+        eos_token_ids = final_gen_kwargs.get("eos_token_id")
+        eos_token_ids = set(eos_token_ids if isinstance(eos_token_ids, list) else [eos_token_ids] if eos_token_ids is not None else [])
+        tokenizer = self._get_tokenizer_or_processor()
+        stop_filters = [StopStringFilter(stop_strings) for _ in range(num_samples)]
+        callback_stopped = [False] * num_samples
+        samples = [""] * num_samples
+        start_time = perf_counter()
+        self._stop_generation = False
+        self.last_generation_output = None
+
+        def runner(**kwargs):
+            try:
+                self._generation_thread_runner(**kwargs)
+            finally:
+                for request in requests:
+                    request.finish() # Unblocks the reader if generate failed
+
+        try:
+            self._prefill_in_chunks(input_ids, cache, verbose, always=True) # The prompt but its last token, once
+            if use_prefix_cache:
+                prompt_cache, cache = cache, copy.deepcopy(cache)
+                self._store_prefix_cache(prompt_cache, input_ids) # The samples extend their own copy
+            cache.batch_repeat_interleave(num_samples)
+            generation_kwargs = {
+                **final_gen_kwargs,
+                "input_ids": input_ids.repeat(num_samples, 1),
+                "attention_mask": torch.ones((num_samples, input_ids.shape[1]), dtype=torch.long, device=input_ids.device),
+                "past_key_values": cache,
+                "streamer": BatchRoutingStreamer(tokenizer, requests),
+                "stopping_criteria": StoppingCriteriaList([BatchStopCriteria(requests, eos_token_ids)]),
+            }
+            self.generation_thread = Thread(target=runner, kwargs=generation_kwargs)
+            self.generation_thread.start()
+            finished = 0
+            while finished < num_samples:
+                index, chunk = shared_queue.get()
+                if chunk is None:
+                    finished += 1
+                    continue
+                chunk = stop_filters[index].push(chunk)
+                if stop_filters[index].stopped:
+                    requests[index].stopped = True # Ends this sample only
+                if not chunk:
+                    continue
+                samples[index] += chunk
+                sample_callback = sample_callbacks[index]
+                if sample_callback and not callback_stopped[index]:
+                    try:
+                        if sample_callback(chunk, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK) is False:
+                            requests[index].stopped = callback_stopped[index] = True
+                    except Exception as cb_ex:
+                        self.error(f"Callback exception: {cb_ex}")
+                        trace_exception(cb_ex)
+                        requests[index].stopped = callback_stopped[index] = True
+            self.generation_thread.join()
+            for index in range(num_samples):
+                held_text = "" if callback_stopped[index] else stop_filters[index].flush()
+                if held_text:
+                    samples[index] += held_text
+                    if sample_callbacks[index]: sample_callbacks[index](held_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
+        except Exception as e:
+            self.error(f"Generation Error (Samples): {e}")
+            trace_exception(e)
+            samples[0] += f"\n[Error during generation: {e}]"
+            if callback: callback(f"Generation Error: {e}", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_EXCEPTION)
+            self.stop_generation()
+        finally:
+            self.generation_thread = None
+            self.batched_requests.difference_update(requests)
+        self.last_samples = samples
+        if self.config.debug or verbose:
+            total_time = perf_counter() - start_time
+            generated = sum(len(request.tokens) for request in requests)
+            ASCIIColors.info(f"{num_samples} samples from one prefill of {input_ids.shape[1]} tokens in {total_time:.2f} seconds. Tokens: {generated}, Tokens/sec: {generated/total_time if total_time > 0 else 0:.2f}")
+        return samples[0]
+
+    def _decode_inline(self, model_inputs: Dict[str, Any], final_gen_kwargs: dict, callback: Optional[Callable[[str, int], bool]], verbose: bool, past_key_values=None, optimized: bool = False, stop_strings: Optional[List[str]] = None) -> str:
+        """
+        Decodes token by token in the calling thread, without a generation thread nor a streamer queue.
+        The loop owns the KV cache, detokenizes incrementally and checks the end of sequence on token ids.
+        It only listens to stop_generation for its own stop event, so concurrent generations keep running.
+        Generation ends at the first stop string, which is left out of the text.
+        With optimized, the decode steps run the compiled forward on the preallocated static cache
+        (when another request holds it, this one falls back to the eager path).
+        """
+        optimized_decode = None
+        if optimized and past_key_values is None:
+            optimized_decode = self._acquire_optimized_decode()
+        memory_monitor = PeakRSSMonitor().start()
+        try:
+            return self._decode_inline_loop(model_inputs, final_gen_kwargs, callback, verbose, past_key_values, optimized_decode, stop_strings or [])
+        finally:
+            if optimized_decode is not None:
+                optimized_decode["lock"].release()
+            self._report_peak_memory(memory_monitor, verbose)
+
+    def _acquire_optimized_decode(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the static KV cache and compiled decode forward of the current model, locked for the caller
+        (who releases optimized_decode["lock"]). They are created on first use, with the compiled graphs cached
+        on disk so that later runs load them instead of compiling again. Returns None if they are busy or unavailable.
+        """
+        with self.model_swap_lock:
+            key = (id(self.model), self.config.ctx_size)
+            if self.optimized_decode is None or self.optimized_decode["key"] != key:
+                self.optimized_decode = None
+                if self.binding_type != BindingType.TEXT_ONLY:
+                    self.warning("optimize_decode only applies to text models.")
+                    return None
+                try:
+                    compile_cache_dir = self.lollms_paths.personal_data_path / "hugging_face" / "compile_cache"
+                    compile_cache_dir.mkdir(parents=True, exist_ok=True)
+                    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(compile_cache_dir)
+                    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+                    import torch._inductor.config as inductor_config
+                    inductor_config.fx_graph_cache = True
+                    try:
+                        cache = StaticCache(config=self.model.config, max_batch_size=1, max_cache_len=self.config.ctx_size, device=self.model.device, dtype=self.model.dtype)
+                    except TypeError: # Recent transformers take the device and dtype from the first update
+                        cache = StaticCache(config=self.model.config, max_cache_len=self.config.ctx_size)
+                    on_cuda = "cuda" in str(self.model.device)
+                    forward = torch.compile(self.model.forward, mode="reduce-overhead" if on_cuda else "default", dynamic=False)
+                except Exception as e:
+                    self.error(f"Couldn't prepare the optimized decode: {e}. Using the eager decode.")
+                    trace_exception(e)
+                    return None
+                self.optimized_decode = {"key": key, "cache": cache, "forward": forward, "max_cache_len": self.config.ctx_size, "lock": Lock(), "warm": False}
+                self.info(f"Optimized decode ready: static cache of {self.config.ctx_size} tokens, the forward is compiled at the first decode step.")
+            optimized_decode = self.optimized_decode
+        if not optimized_decode["lock"].acquire(blocking=False):
+            return None # Another request uses the static cache
+        optimized_decode["cache"].reset()
+        return optimized_decode
+
+    def _decode_inline_loop(self, model_inputs: Dict[str, Any], final_gen_kwargs: dict, callback: Optional[Callable[[str, int], bool]], verbose: bool, past_key_values, optimized_decode: Optional[Dict[str, Any]], stop_strings: List[str]) -> str:
+        """ Body of _decode_inline, see there. """
+        tokenizer = self.tokenizer if self.tokenizer else self._get_tokenizer_or_processor()
+        tokenizer = getattr(tokenizer, "tokenizer", tokenizer) # Processors wrap their tokenizer
+        sequence = model_inputs["input_ids"]
+        attention_mask = model_inputs.get("attention_mask")
+        if attention_mask is None:
+            attention_mask = torch.ones_like(sequence)
+        model_kwargs = {k: v for k, v in model_inputs.items() if k not in ("input_ids", "attention_mask")}
+        decode_forward = None
+        if optimized_decode is not None:
+            decode_forward = optimized_decode["forward"]
+        prompt_length = sequence.shape[1]
+        max_new_tokens = final_gen_kwargs["max_new_tokens"]
+        if optimized_decode is not None:
+            max_new_tokens = min(max_new_tokens, optimized_decode["max_cache_len"] - prompt_length)
+        warmup_time = None
+        logits_processors = build_logits_processors(final_gen_kwargs)
+        eos_ids = set()
+        for eos in (final_gen_kwargs.get("eos_token_id"), getattr(self.model.generation_config, "eos_token_id", None)):
+            if eos is not None:
+                eos_ids.update(eos if isinstance(eos, (list, tuple)) else [eos])
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        stop_criteria = StopSequencesCriteria(tokenizer, stop_strings, prompt_length)
+        stop_filter = StopStringFilter(stop_strings)
+        generated_ids: List[int] = []
+        stop_event = Event()
+        self.inline_stop_events.add(stop_event)
+        output_buffer = ""
+        step_times = []
+        try:
+            if optimized_decode is not None:
+                cache = optimized_decode["cache"]
+            elif past_key_values is not None:
+                cache = past_key_values
+            else:
+                cache = DynamicCache() if model_kwargs else self._new_kv_cache() # The kv_policy applies to text models
+            with torch.no_grad():
+                prefill_start = perf_counter() # The first step time covers the whole prefill, chunks included
+                if not model_kwargs: # Image inputs must reach the model in one pass
+                    self._prefill_in_chunks(sequence, cache, verbose)
+                cache_position = torch.arange(cache.get_seq_length(), prompt_length, device=sequence.device)
+                for step in range(max_new_tokens):
+                    step_start = prefill_start if step == 0 else perf_counter()
+                    if decode_forward is not None and step > 0:
+                        # Static shapes: one token, positions from the cache, causal mask sized by the static cache
+                        outputs = decode_forward(
+                            input_ids=sequence[:, -1:], position_ids=cache_position.unsqueeze(0), cache_position=cache_position,
+                            past_key_values=cache, use_cache=True, return_dict=True
+                        )
+                    else:
+                        step_inputs = self.model.prepare_inputs_for_generation(
+                            sequence, past_key_values=cache, attention_mask=attention_mask,
+                            cache_position=cache_position, use_cache=True, **model_kwargs
+                        )
+                        outputs = self.model(**step_inputs, return_dict=True)
+                    scores = logits_processors(sequence, outputs.logits[:, -1, :].float())
+                    if final_gen_kwargs.get("do_sample", False):
+                        next_token = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)
+                    else:
+                        next_token = torch.argmax(scores, dim=-1, keepdim=True)
+                    sequence = torch.cat([sequence, next_token], dim=-1)
+                    attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=-1)
+                    cache_position = cache_position[-1:] + 1
+                    token_id = next_token[0, 0].item() # Synchronizes with the device, so the step time is exact
+                    if decode_forward is not None and step == 1 and not optimized_decode["warm"]:
+                        # First call of the compiled forward: compilation (or compile cache load) time
+                        warmup_time = perf_counter() - step_start
+                        optimized_decode["warm"] = True
+                    else:
+                        step_times.append(perf_counter() - step_start)
+                    if token_id in eos_ids or stop_event.is_set():
+                        break
+                    generated_ids.append(token_id)
+                    new_text = stop_filter.push(detokenizer.push(token_id))
+                    if new_text:
+                        output_buffer += new_text
+                        if callback:
+                            try:
+                                if callback(new_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK) is False:
+                                    ASCIIColors.warning("Generation stopped by callback returning False.")
+                                    break
+                            except Exception as cb_ex:
+                                self.error(f"Callback exception: {cb_ex}")
+                                trace_exception(cb_ex)
+                                break
+                    if stop_filter.stopped or stop_criteria.matches(generated_ids):
+                        stop_filter.stopped = True # Drops the held back beginning of the stop string
+                        break
+                held_text = stop_filter.push(detokenizer.flush()) + stop_filter.flush()
+                if held_text:
+                    output_buffer += held_text
+                    if callback: callback(held_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
+            self.last_generation_output = sequence
+            self._report_kv_usage(cache, verbose)
+            if past_key_values is not None and optimized_decode is None:
+                self._store_prefix_cache(cache, sequence)
+        except Exception as e:
+            self.error(f"Generation Error (Inline Decode): {e}")
+            trace_exception(e)
+            output_buffer += f"\n[Error during generation: {e}]"
+            if callback: callback(f"Generation Error: {e}", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_EXCEPTION)
+        finally:
+            self.inline_stop_events.discard(stop_event)
+
+        decode_times = step_times[1:]
+        self.last_decode_stats = {
+            "prompt_tokens": prompt_length,
+            "generated_tokens": len(generated_ids), # The end of sequence token is not part of the output
+            "prefill_ms": step_times[0] * 1000 if step_times else 0.0,
+            "decode_ms_per_token": 1000 * sum(decode_times) / len(decode_times) if decode_times else 0.0,
+            "decode_max_ms": 1000 * max(decode_times) if decode_times else 0.0,
+            "optimized": optimized_decode is not None,
+            "warmup_ms": warmup_time * 1000 if warmup_time is not None else 0.0,
+        }
+        if self.config.debug or verbose:
+            stats = self.last_decode_stats
+            if warmup_time is not None:
+                ASCIIColors.info(f"Compiled decode warm-up (compilation or compile cache load): {warmup_time:.2f} seconds")
+            ASCIIColors.info(f"Inline decode: {stats['generated_tokens']} tokens, prefill of {stats['prompt_tokens']} tokens in {stats['prefill_ms']:.1f} ms, {stats['decode_ms_per_token']:.2f} ms/token (max {stats['decode_max_ms']:.2f} ms)")
+        return output_buffer
+
+    @wait_for_model_load
+    @with_lora_adapter
     def generate_with_images(self,
                              prompt: str,
                              images: List[str],
@@ -981,8 +3187,13 @@ class HuggingFaceLocal(LLMBinding):
             self.warning("No images provided to generate_with_images. Falling back to text-only generation.")
             return self.generate(prompt, effective_n_predict, callback, verbose=verbose, **gpt_params)
 
-        # Stop any ongoing generation
-        self.stop_generation() # Use helper method
+        # Stop any ongoing generation, unless text generations run next to each other (batching or inline decode loops)
+        inline_decode = self.binding_config.config.get("decode_loop", "threaded") == "inline"
+        torch_backend = self.execution_backend == "torch"
+        batching = self.binding_config.config.get("batching_enabled", False) and not self._lora_enabled()
+        text_inline_decode = torch_backend and (self.binding_config.config.get("optimize_decode", False) or inline_decode)
+        if not batching and not text_inline_decode:
+            self.stop_generation() # Use helper method
 
         loaded_pil_images: List[Image.Image] = []
         try:
@@ -993,8 +3204,11 @@ class HuggingFaceLocal(LLMBinding):
 
             # --- Load Images ---
             failed_images = []
-            for img_path_or_url in images:
-                pil_img = self._process_image_argument(img_path_or_url) # Handles download/load/convert
+            self.image_cache.capacity = int(self.binding_config.config.get("image_cache_size", 32))
+            # Fetch and decode the images in parallel, keeping their order
+            with ThreadPoolExecutor(max_workers=min(len(images), 8), thread_name_prefix="hf_image_loader") as executor:
+                pil_results = list(executor.map(self._process_image_argument, images)) # Handles download/load/convert
+            for img_path_or_url, pil_img in zip(images, pil_results):
                 if pil_img:
                     loaded_pil_images.append(pil_img)
                 else:
@@ -1007,6 +3221,7 @@ class HuggingFaceLocal(LLMBinding):
 
             if failed_images:
                 self.warning(f"Skipped loading {len(failed_images)} invalid/missing images: {failed_images}")
+            if self.config.debug or verbose: ASCIIColors.debug(f"Image cache: {self.image_cache.stats()}")
 
             # --- Prepare Inputs (Apply Template if enabled) ---
             apply_template = self.binding_config.config.get("apply_chat_template", True)
@@ -1132,8 +3347,14 @@ class HuggingFaceLocal(LLMBinding):
              self.error("Inputs are not in the expected dictionary format for vision model generation.")
              return "[Error: Invalid input format for generation]"
 
+        stop_strings = self._get_stop_strings(gpt_params)
+        if inline_decode:
+            return self._decode_inline(inputs, final_gen_kwargs, callback, verbose, stop_strings=stop_strings)
+
         # Combine the processed inputs (input_ids, pixel_values etc.) with generation kwargs
-        generation_kwargs_for_thread = {**inputs, **final_gen_kwargs, "streamer": streamer}
+        stop_criteria = StopSequencesCriteria(getattr(stream_tokenizer, "tokenizer", stream_tokenizer), stop_strings, inputs["input_ids"].shape[1])
+        stop_filter = StopStringFilter(stop_strings)
+        generation_kwargs_for_thread = {**inputs, **final_gen_kwargs, "streamer": streamer, "stopping_criteria": StoppingCriteriaList([stop_criteria])}
         output_buffer = ""
         start_time = perf_counter()
 
@@ -1149,6 +3370,7 @@ class HuggingFaceLocal(LLMBinding):
                 if self._stop_generation: # Check stop flag
                     ASCIIColors.warning("Stop generation requested.")
                     break
+                new_text = stop_filter.push(new_text) # Holds back a possible stop string, cuts at a complete one
                 if new_text:
                     output_buffer += new_text
                     if callback:
@@ -1163,6 +3385,10 @@ class HuggingFaceLocal(LLMBinding):
                              trace_exception(cb_ex)
                              self._stop_generation = True # Stop if callback fails
                              break
+            held_text = "" if self._stop_generation else stop_filter.flush()
+            if held_text:
+                output_buffer += held_text
+                if callback: callback(held_text, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
 
             # Wait for thread to finish
             if self.config.debug or verbose: ASCIIColors.info("Vision generation stream finished.")
@@ -1190,8 +3416,12 @@ class HuggingFaceLocal(LLMBinding):
 
 
     def stop_generation(self):
-        """Requests the generation thread to stop."""
+        """Requests the generation thread (and the inline decode loops) to stop."""
         self._stop_generation = True
+        for stop_event in list(self.inline_stop_events):
+            stop_event.set()
+        for request in list(self.batched_requests):
+            request.stopped = True
         if self.generation_thread and self.generation_thread.is_alive():
             self.info("Requesting generation stop...")
             # No direct way to interrupt model.generate, relies on checking _stop_generation in streamer loop
@@ -1205,81 +3435,56 @@ class HuggingFaceLocal(LLMBinding):
         self._stop_generation = False # Reset flag for next generation
 
     def _process_image_argument(self, image_path_or_url: str) -> Optional[Image.Image]:
-        """ Loads an image from a local path or URL. Downloads URL if necessary. """
+        """
+        Loads an image from a local path or URL as RGB, tagged with its content hash.
+        URL bytes are downloaded once into the content addressed image store, and decoded
+        images are served from the in-memory image cache when they were seen recently.
+        """
         try:
-            pil_image = None
+            data = None
             if is_file_path(image_path_or_url):
                 # Try absolute path first
                 path_obj = Path(image_path_or_url)
-                if path_obj.is_file() and path_obj.exists():
-                    pil_image = Image.open(path_obj)
-                else:
+                if not (path_obj.is_file() and path_obj.exists()):
                     # Try relative paths (uploads, shared etc.)
-                    found_path = find_first_available_file_path([
+                    path_obj = find_first_available_file_path([
                         self.lollms_paths.personal_uploads_path / image_path_or_url,
                         self.lollms_paths.shared_uploads_path / image_path_or_url,
                         self.downloads_path / image_path_or_url, # Check downloads too
                     ])
-                    if found_path and found_path.is_file():
-                        pil_image = Image.open(found_path)
-                    else:
+                    if not (path_obj and path_obj.is_file()):
                         self.warning(f"Local image file not found: {image_path_or_url}")
                         return None
+                digest = self.image_cache.file_digest(path_obj)
+                image_source = path_obj
             elif image_path_or_url.startswith(("http://", "https://")):
                 # Handle URL
-                self.info(f"Processing image URL: {image_path_or_url}")
                 try:
-                    # Generate a safe filename from URL hash for caching
-                    filename = f"image_{hash(image_path_or_url)}.png" # Use hash for uniqueness, png assumed common
-                    local_filepath = self.downloads_path / filename
-
-                    if local_filepath.exists():
-                        self.info(f"Using cached image: {local_filepath}")
-                        pil_image = Image.open(local_filepath)
-                    else:
-                        # Download the image
-                        self.info(f"Downloading image to {local_filepath}...")
-                        # Use requests with stream=True for potentially large images
+                    digest = self.image_cache.url_digest(image_path_or_url)
+                    if digest is None:
+                        self.info(f"Downloading image {image_path_or_url}...")
                         headers = {'User-Agent': 'Lollms_HuggingFaceLocal_Binding/1.0'} # Be polite
-                        response = requests.get(image_path_or_url, stream=True, timeout=30, headers=headers)
+                        response = requests.get(image_path_or_url, timeout=30, headers=headers)
                         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-                        # Try to open directly from stream first (memory efficient)
-                        try:
-                             pil_image = Image.open(response.raw)
-                             # Save to cache after successful open
-                             pil_image.save(local_filepath) # Save in a common format like PNG
-                             self.info(f"Image downloaded and cached successfully.")
-                        except Exception as img_open_ex:
-                            self.error(f"Failed to open image stream from {image_path_or_url}: {img_open_ex}. Trying download then open.")
-                            # Fallback: download completely then open
-                            local_filepath.parent.mkdir(parents=True, exist_ok=True) # Ensure dir exists
-                            with open(local_filepath, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                            if local_filepath.exists():
-                                pil_image = Image.open(local_filepath)
-                                self.info(f"Image downloaded and opened from file.")
-                            else:
-                                raise IOError("Failed to save downloaded image file.")
-
+                        data = response.content
+                        digest = self.image_cache.store_url(image_path_or_url, data)
+                    elif self.config.debug:
+                        ASCIIColors.debug(f"Using cached image {digest[:12]} for {image_path_or_url}")
+                    image_source = self.image_cache.blob_path(digest)
                 except requests.exceptions.RequestException as req_ex:
                     self.error(f"Error downloading image {image_path_or_url}: {req_ex}")
                     trace_exception(req_ex)
                     return None
-                except Exception as dl_ex:
-                     self.error(f"Error processing image URL {image_path_or_url}: {dl_ex}")
-                     trace_exception(dl_ex)
-                     return None
             else:
                 self.warning(f"Invalid image format or path: {image_path_or_url}. Expecting local path or HTTP/HTTPS URL.")
                 return None
 
-            # Ensure image is RGB and return a copy (safer)
-            if pil_image:
-                 return pil_image.convert("RGB").copy() # Return a copy to avoid issues if original is closed elsewhere
-            else:
-                 return None # Should have returned earlier if failed
+            pil_image = self.image_cache.get_image(digest)
+            if pil_image is None:
+                with Image.open(io.BytesIO(data) if data is not None else image_source) as opened_image:
+                    # Returns an RGB copy, the cache keeps its own
+                    pil_image = self.image_cache.put_image(digest, opened_image)
+            return pil_image
 
         except Exception as e:
             self.error(f"Failed to load or process image '{image_path_or_url}': {e}")
@@ -1311,6 +3516,8 @@ class HuggingFaceLocal(LLMBinding):
         """
         Checks if a specific directory likely contains Hugging Face model files.
         It should NOT return true for an 'author' directory that only contains model subdirs.
+        list_models only calls it (through _indexed_model_metadata) on a local models index miss,
+        i.e. for new directories or when the directory, its config.json or its weight files changed.
         """
         if not model_path.is_dir():
             return False
@@ -1333,6 +3540,80 @@ class HuggingFaceLocal(LLMBinding):
         # An author directory usually only contains subdirectories.
         return has_config or has_weights
 
+    def _get_model_index(self) -> LocalModelIndex:
+        if self.model_index is None:
+            self.model_index = LocalModelIndex(self.lollms_paths.personal_data_path / "hugging_face" / "local_models_index.json")
+        return self.model_index
+
+    def _read_local_model_metadata(self, model_path: Path) -> Dict[str, Any]:
+        """ Reads the metadata of a local model directory from its config.json and weight files. """
+        metadata = {"architecture": None, "model_type": None, "is_vision": False, "ctx_size": None, "dtype": None, "weights_size": 0, "license": "Unknown"}
+        metadata["weights_size"] = sum(
+            f.stat().st_size for pattern in ["*.safetensors", "*.bin", "*.pth"] for f in model_path.glob(pattern) if f.is_file()
+        )
+        config_path = model_path / "config.json"
+        if not config_path.exists():
+            return metadata
+        with open(config_path, 'r', encoding='utf-8') as f: config_data = json.load(f)
+        model_type = config_data.get("model_type", "").lower()
+        architectures = [a.lower() for a in config_data.get("architectures", [])]
+        # Check against known VLM keys
+        is_vision = any(key in model_type or any(key in arch for arch in architectures)
+                        for key in KNOWN_MODEL_CLASSES if key != "default" and KNOWN_MODEL_CLASSES[key][1] == AutoProcessor)
+        # Also check pipeline tag if present
+        if not is_vision and 'pipeline_tag' in config_data:
+            pipeline = config_data['pipeline_tag'].lower()
+            if any(p in pipeline for p in ["image-to-text", "visual-question-answering","image-text-to-text"]):
+                is_vision = True
+        text_config = config_data.get("text_config", {}) if isinstance(config_data.get("text_config"), dict) else {}
+        for key in ['max_position_embeddings', 'n_positions', 'model_max_length', 'seq_length']:
+            ctx_val = config_data.get(key, text_config.get(key))
+            if isinstance(ctx_val, int) and ctx_val > 0:
+                metadata["ctx_size"] = ctx_val
+                break
+        metadata.update({
+            "architecture": config_data.get("architectures", [None])[0] if config_data.get("architectures") else None,
+            "model_type": model_type or None,
+            "is_vision": is_vision,
+            "dtype": config_data.get("torch_dtype", text_config.get("torch_dtype")),
+            "license": config_data.get("license", "Unknown"),
+        })
+        return metadata
+
+    def _indexed_model_metadata(self, model_path: Path) -> Optional[Dict[str, Any]]:
+        """
+        Returns the metadata of a model directory, or None if the directory is not a model directory.
+        Uses the local models index unless the directory, its config.json or its weight files changed since it was indexed.
+        """
+        try:
+            stamp = LocalModelIndex.model_dir_stamp(model_path)
+        except OSError:
+            return None
+        model_index = self._get_model_index()
+        entry = model_index.get(model_path, stamp)
+        if entry is None:
+            entry = {"is_model": self._is_valid_model_dir(model_path), "metadata": None, "subdirs": None}
+            if entry["is_model"]:
+                try:
+                    entry["metadata"] = self._read_local_model_metadata(model_path)
+                except Exception as ex:
+                    self.warning(f"Could not read the metadata of local model {model_path}: {ex}")
+                    entry["metadata"] = {"architecture": None, "model_type": None, "is_vision": False, "ctx_size": None, "dtype": None, "weights_size": 0, "license": "Unknown"}
+            model_index.set(model_path, stamp, entry)
+        return entry["metadata"] if entry["is_model"] else None
+
+    def _indexed_subdirs(self, folder: Path) -> List[str]:
+        """ Returns the names of the subdirectories of a folder, from the local models index when the folder didn't change. """
+        stamp = [folder.stat().st_mtime_ns]
+        model_index = self._get_model_index()
+        entry = model_index.get(folder, stamp)
+        if entry is None:
+            entry = model_index.set(folder, stamp, {"is_model": False, "metadata": None, "subdirs": None})
+        if entry.get("subdirs") is None:
+            entry["subdirs"] = [sub_item.name for sub_item in folder.iterdir() if sub_item.is_dir()]
+            model_index.mark_dirty()
+        return entry["subdirs"]
+
     def list_models(self) -> List[str]:
         """
         Lists locally available models. Handles:
@@ -1346,6 +3627,8 @@ class HuggingFaceLocal(LLMBinding):
             return []
 
         model_identifiers: Set[str] = set()
+        seen_paths: Set[str] = set()
+        model_index = self._get_model_index()
 
         try:
             for item in local_hf_root.iterdir():
@@ -1365,7 +3648,8 @@ class HuggingFaceLocal(LLMBinding):
                         target_path = Path(target_path_str)
 
                         # IMPORTANT: Validate the *target* path using _is_valid_model_dir
-                        if self._is_valid_model_dir(target_path):
+                        seen_paths.add(str(target_path))
+                        if self._indexed_model_metadata(target_path) is not None:
                             # Use the reference file name as the identifier
                             model_identifier = model_name_from_file.replace("\\", "/")
                             model_identifiers.add(model_identifier)
@@ -1380,7 +3664,8 @@ class HuggingFaceLocal(LLMBinding):
                 # 2. Handle directories
                 elif item_path.is_dir():
                     # Check if 'item' itself is a model directory (e.g., hf_models/model-A)
-                    if self._is_valid_model_dir(item_path):
+                    seen_paths.add(str(item_path))
+                    if self._indexed_model_metadata(item_path) is not None:
                         # Yes, it's a model directory directly under local_hf_root
                         model_identifier = item.name.replace("\\", "/")
                         model_identifiers.add(model_identifier)
@@ -1391,12 +3676,13 @@ class HuggingFaceLocal(LLMBinding):
                         # Check if it contains subdirectories that *are* model directories
                         # (i.e., treat 'item' as a potential author folder like hf_models/TheBloke)
                         is_author_folder = False
-                        for sub_item in item_path.iterdir():
+                        for sub_item in self._indexed_subdirs(item_path):
                             sub_item_path = item_path / sub_item
+                            seen_paths.add(str(sub_item_path))
                             # Check if the sub-item is a directory AND a valid model directory
-                            if sub_item_path.is_dir() and self._is_valid_model_dir(sub_item_path):
+                            if self._indexed_model_metadata(sub_item_path) is not None:
                                 # Found a nested model like hf_models/authorB/model-C
-                                model_identifier = f"{item.name}/{sub_item.name}".replace("\\", "/")
+                                model_identifier = f"{item.name}/{sub_item}".replace("\\", "/")
                                 model_identifiers.add(model_identifier)
                                 is_author_folder = True # Mark that 'item' acted as an author folder
 
@@ -1410,6 +3696,9 @@ class HuggingFaceLocal(LLMBinding):
             trace_exception(e) # Uncomment if you have this helper
             return [] # Return empty list on major scanning error
 
+        model_index.prune(seen_paths)
+        model_index.save()
+
         # Convert the set to a sorted list for consistent output
         sorted_models = sorted(list(model_identifiers))
 
@@ -1422,6 +3711,187 @@ class HuggingFaceLocal(LLMBinding):
         return sorted_models
 
 
+    def _hub_catalog_query(self) -> Dict[str, Any]:
+        """ The settings that define the Hub catalog. A snapshot made with other settings is refreshed. """
+        favorite_providers_list = [p.strip() for p in self.binding_config.favorite_providers.split(",") if p.strip()] # Clean list
+        if not favorite_providers_list: favorite_providers_list = [None] # Search all if empty
+        limit_per_provider = self.binding_config.config.get("hub_fetch_limit", 5000) // max(1, len(favorite_providers_list)) # Distribute limit
+        return {
+            "providers": favorite_providers_list,
+            "limit_per_provider": max(10, limit_per_provider), # Ensure a minimum fetch
+            "sort": self.binding_config.config.get("model_sorting", "trending_score"), # Use configured sorting, default 'trending'
+            # Prioritize pipelines most relevant to this binding
+            "tasks": ["text-generation", "image-text-to-text"],
+        }
+
+    def _get_hub_catalog(self, default_icon: str) -> List[dict]:
+        """
+        Returns the Hub models entries from the catalog snapshot without waiting for the network.
+        An expired snapshot (older than hub_cache_ttl_hours or made with other settings) is served as is while
+        a background refresh runs. Only the very first listing, without any snapshot, waits for the Hub.
+        In offline mode, the snapshot is the only source.
+        """
+        catalog_file = self.lollms_paths.personal_data_path / "hugging_face" / "hub_catalog.json"
+        query = self._hub_catalog_query()
+        with self.hub_catalog_lock:
+            if self.hub_catalog is None and catalog_file.exists():
+                try:
+                    self.hub_catalog = json.loads(catalog_file.read_text(encoding="utf-8"))
+                except Exception as ex:
+                    self.warning(f"Couldn't read the Hub catalog snapshot {catalog_file}: {ex}")
+            catalog = self.hub_catalog
+
+        if self.binding_config.config.get("transformers_offline", True):
+            if catalog is None: self.info("Offline mode and no Hub catalog snapshot available. Listing local models only.")
+            return self._with_icon(catalog["entries"] if catalog else [], default_icon)
+
+        if catalog is None:
+            self.info("No Hub catalog snapshot yet. Fetching it now...")
+            self._refresh_hub_catalog(catalog_file, query)
+            catalog = self.hub_catalog
+            return self._with_icon(catalog["entries"] if catalog else [], default_icon)
+
+        ttl_seconds = float(self.binding_config.config.get("hub_cache_ttl_hours", 24)) * 3600
+        expired = datetime.now().timestamp() - catalog.get("fetched_at", 0) > ttl_seconds or catalog.get("query") != query
+        if expired and not self.hub_catalog_refreshing:
+            self.hub_catalog_refreshing = True
+            self.info("Hub catalog snapshot expired. Refreshing it in the background.")
+            Thread(target=self._refresh_hub_catalog, args=(catalog_file, query), name="hf_hub_catalog_refresh", daemon=True).start()
+        return self._with_icon(catalog["entries"], default_icon)
+
+    def _with_icon(self, entries: List[dict], default_icon: str) -> List[dict]:
+        return [{**entry, "icon": default_icon} for entry in entries]
+
+    def _refresh_hub_catalog(self, catalog_file: Path, query: Dict[str, Any]) -> None:
+        """ Fetches the Hub catalog with concurrent per provider and task queries, then saves the snapshot. """
+        try:
+            self.hub_catalog_refreshing = True
+            start_time = perf_counter()
+            api = HfApi()
+            queries = [(provider, task) for provider in query["providers"] for task in query["tasks"]]
+
+            def fetch(provider_task):
+                provider, task = provider_task
+                try:
+                    return list(api.list_models(
+                        author=provider if provider else None,
+                        task=task,
+                        sort=query["sort"],
+                        direction=-1, # Most popular/recent first
+                        limit=query["limit_per_provider"],
+                        cardData=True # Fetch card data for license etc.
+                        ))
+                except Exception as pipe_ex:
+                    ASCIIColors.warning(f"Could not fetch models for provider '{provider}' task '{task}': {pipe_ex}")
+                    return None
+
+            with ThreadPoolExecutor(max_workers=min(8, max(1, len(queries)))) as executor:
+                results = list(executor.map(fetch, queries))
+            if all(result is None for result in results):
+                self.warning("Couldn't reach the Hugging Face Hub. Keeping the current Hub catalog snapshot.")
+                return
+
+            entries = []
+            seen_ids = set()
+            for result in results:
+                for model in result or []:
+                    if model.modelId in seen_ids: continue
+                    seen_ids.add(model.modelId)
+                    try:
+                        entry = self._hub_model_to_entry(model)
+                        if entry is not None:
+                            entries.append(entry)
+                    except Exception as ex:
+                        ASCIIColors.debug(f"Error processing Hub model {model.modelId}: {ex}")
+
+            catalog = {"fetched_at": datetime.now().timestamp(), "query": query, "entries": entries}
+            with self.hub_catalog_lock:
+                self.hub_catalog = catalog
+            catalog_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = catalog_file.with_suffix(".tmp")
+            temp_file.write_text(json.dumps(catalog, default=str), encoding="utf-8")
+            temp_file.replace(catalog_file)
+            ASCIIColors.info(f"Fetched {len(entries)} Hub models from {len(queries)} queries in {perf_counter() - start_time:.2f} seconds.")
+        except ImportError: self.error("huggingface_hub library not found. Cannot fetch Hub models.")
+        except Exception as e: self.error(f"Failed to fetch models from Hugging Face Hub: {e}"); trace_exception(e)
+        finally:
+            self.hub_catalog_refreshing = False
+
+    def _hub_model_to_entry(self, model) -> Optional[dict]:
+        """ Converts a Hub ModelInfo into a model zoo entry. Returns None for models this binding can't load. """
+        model_id = model.modelId
+        # Filter out formats typically not handled by this binding directly
+        # Check model ID first, then tags for confirmation
+        skip_keywords = ["gguf", "ggml", "awq", "gptq", "exl2", "onnx"]
+        if any(kw in model_id.lower() for kw in skip_keywords):
+            # Check tags to see if it ALSO has 'transformers' - might be base + quant
+            if 'transformers' not in (model.tags or []):
+                return None # Skip if only quant tag and not transformers tag
+
+        # Filter based on tags (more reliable)
+        format_tags = {'gguf', 'ggml', 'awq', 'gptq', 'onnx', 'exl2'}
+        model_tags = set(model.tags or [])
+        # Skip if it has a quant/format tag AND doesn't have a core 'transformers' or 'pytorch' tag
+        is_quant_only = format_tags.intersection(model_tags) and not {'transformers', 'pytorch', 'jax', 'safetensors'}.intersection(model_tags)
+        if is_quant_only:
+            return None
+
+        # Determine category based on pipeline tag primarily
+        pipeline = model.pipeline_tag.lower() if model.pipeline_tag else ""
+        category = "hub_other"
+        if any(p in pipeline for p in ["image-to-text", "visual-question-answering", "image-text-to-text"]): category = "hub_vision"
+        elif any(p in pipeline for p in ["text-generation", "text2text-generation", "conversational", "summarization"]): category = "hub_text"
+        # Refine category based on tags if pipeline is missing/generic
+        elif 'text-generation' in model_tags or 'text2text-generation' in model_tags: category = "hub_text"
+        elif 'image-to-text' in model_tags: category = "hub_vision"
+
+
+        # Extract info from cardData if available
+        license_info = "Check card"
+        datasets_info = "Check card"
+        if model.cardData:
+            license_info = model.cardData.get('license', "Check card")
+            # Simplify common licenses
+            if isinstance(license_info, list): license_info = license_info[0] # Take first if list
+            if isinstance(license_info, str):
+                license_info=license_info.replace("apache-2.0","Apache 2.0").replace("mit","MIT") # Prettify common ones
+                if len(license_info)>20: license_info=license_info[:17]+"..." # Truncate long names
+
+            datasets_info = model.cardData.get('datasets', "Check card")
+            if isinstance(datasets_info, list): datasets_info = ", ".join(datasets_info) # Join if list
+            if isinstance(datasets_info, str) and len(datasets_info)>30: datasets_info = datasets_info[:27]+"..." # Truncate
+
+        # Build description string
+        description_parts = []
+        if model.downloads is not None: description_parts.append(f"Dl: {model.downloads:,}")
+        if model.likes is not None: description_parts.append(f"Likes: {model.likes:,}")
+        last_modified = str(model.lastModified) if model.lastModified else None # datetime in recent huggingface_hub versions
+        if last_modified: description_parts.append(f"Upd: {last_modified.split('T')[0].split(' ')[0]}")
+        description = ", ".join(description_parts)
+
+
+        author_hub = model.author or None
+        model_name_only_hub = model_id.split('/')[-1] # Get last part as name
+
+        entry = {
+            "category": category,
+            "datasets": datasets_info,
+            "icon": None, # Set by _get_hub_catalog
+            "last_commit_time": last_modified,
+            "license": license_info,
+            "model_creator": author_hub,
+            "model_creator_link": f"https://huggingface.co/{author_hub}" if author_hub != "Unknown" else "https://huggingface.co/",
+            "name": model_id, # Full ID is the unique identifier
+            "display_name": model_name_only_hub, # For display
+            "provider": author_hub, # Indicate source provider/author
+            "rank": model.likes or model.downloads or 0, # Rank by likes or downloads
+            "type": "downloadable", # Mark as needing download
+            "description": description,
+            "link": f"https://huggingface.co/{model_id}",
+            "variants": [{"name": model_id, "size": -1, "is_local": False}], # Size unknown, mark not local
+        }
+        return entry
+
     def get_available_models(self, app: Optional[LoLLMsCom] = None) -> List[dict]:
         """ Gets available models: local + fetched from Hub. """
         lollms_models = []
@@ -1462,178 +3932,31 @@ class HuggingFaceLocal(LLMBinding):
                 if model_path.exists():
                     model_info["last_commit_time"] = datetime.fromtimestamp(model_path.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
 
-                config_path = model_path / "config.json"
-                is_vision = False
-                if config_path.exists():
-                    with open(config_path, 'r', encoding='utf-8') as f: config_data = json.load(f)
-                    model_type = config_data.get("model_type", "").lower()
-                    architectures = [a.lower() for a in config_data.get("architectures", [])]
-                    # Check against known VLM keys
-                    is_vision = any(key in model_type or any(key in arch for arch in architectures)
-                                    for key in KNOWN_MODEL_CLASSES if key != "default" and KNOWN_MODEL_CLASSES[key][1] == AutoProcessor)
-                    # Also check pipeline tag if present
-                    if not is_vision and 'pipeline_tag' in config_data:
-                        pipeline = config_data['pipeline_tag'].lower()
-                        if any(p in pipeline for p in ["image-to-text", "visual-question-answering","image-text-to-text"]):
-                            is_vision = True
-
-                    if is_vision:
+                metadata = self._indexed_model_metadata(model_path)
+                if metadata is not None:
+                    if metadata["is_vision"]:
                         model_info["description"] += " (Vision Capable)"
                         model_info["category"] = "local_vision" # Add a subcategory
                     else:
                          model_info["category"] = "local_text"
-
-                    # Try to get license if available
-                    model_info["license"] = config_data.get("license", "Unknown")
+                    model_info["license"] = metadata["license"]
+                    model_info["variants"][0]["size"] = metadata["weights_size"]
+                    if metadata["ctx_size"]:
+                        model_info["ctx_size"] = metadata["ctx_size"]
 
             except Exception as local_info_ex:
                  self.warning(f"Could not get extra info for local model {model_id}: {local_info_ex}")
 
             lollms_models.append(model_info)
+        self._get_model_index().save()
 
-        # Fetch Models from Hub
+        # Add Models from the Hub catalog snapshot
         filtered_hub_count = 0
-        favorite_providers_list = [p.strip() for p in self.binding_config.favorite_providers.split(",") if p.strip()] # Clean list
-        if not favorite_providers_list: favorite_providers_list = [None] # Search all if empty
-
-        try:
-            self.info("Fetching models from Hugging Face Hub...")
-            
-            api = HfApi()
-            limit_per_provider = self.binding_config.config.get("hub_fetch_limit", 5000) // max(1, len(favorite_providers_list)) # Distribute limit
-            limit_per_provider = max(10, limit_per_provider) # Ensure a minimum fetch
-            hub_sort_key = self.binding_config.config.get("model_sorting", "trending_score") # Use configured sorting, default 'trending'
-
-
-            # Fetch potentially relevant models: text-gen, text2text, image-to-text etc.
-            hub_models_list = []
-            # Prioritize pipelines most relevant to this binding
-            relevant_tasks = ["text-generation", "image-text-to-text"]
-            # Add general 'transformers' tag search as fallback? Maybe too broad.
-
-            seen_ids = set(local_model_names) # Keep track of seen models (including local)
-
-            for provider in favorite_providers_list:
-                self.info(f"Fetching models for provider: {provider if provider else 'All Providers'} (sort: {hub_sort_key}, limit per type: {limit_per_provider})")
-                provider_models = set() # Track models found for this provider to avoid duplicates across pipelines
-                # Search by tasks first
-                for task in relevant_tasks:
-                    try:
-                        model_iterator = api.list_models(
-                            author=provider if provider else None,
-                            task=task,
-                            sort=hub_sort_key,
-                            direction=-1, # Most popular/recent first
-                            limit=limit_per_provider,
-                            cardData=True # Fetch card data for license etc.
-                            )
-                        count = 0
-                        models= list(model_iterator)
-                        for model in models:
-                             if model.modelId not in seen_ids:
-                                 hub_models_list.append(model)
-                                 seen_ids.add(model.modelId)
-                                 provider_models.add(model.modelId)
-                                 count += 1
-                        if count > 0: self.info(f" Found {count} models for task '{task}'")
-
-                    except Exception as pipe_ex:
-                        ASCIIColors.warning(f"Could not fetch models for provider '{provider}' task '{task}': {pipe_ex}")
-
-                 # Optional: Add a broader search for the provider if few results found?
-                 # if not provider_models and provider:
-                 #     # Maybe search just by author tag 'transformers'?
-                 #     pass
-
-            ASCIIColors.info(f"Fetched {len(hub_models_list)} unique potential models from Hub.")
-
-
-            # Process fetched Hub models
-            for model in hub_models_list:
-                try:
-                    model_id = model.modelId
-                    # Skip if already local (double check)
-                    if model_id in local_model_names: continue
-
-                    # Filter out formats typically not handled by this binding directly
-                    # Check model ID first, then tags for confirmation
-                    skip_keywords = ["gguf", "ggml", "awq", "gptq", "exl2", "onnx"]
-                    if any(kw in model_id.lower() for kw in skip_keywords):
-                        # Check tags to see if it ALSO has 'transformers' - might be base + quant
-                        if 'transformers' not in (model.tags or []):
-                            continue # Skip if only quant tag and not transformers tag
-
-                    # Filter based on tags (more reliable)
-                    format_tags = {'gguf', 'ggml', 'awq', 'gptq', 'onnx', 'exl2'}
-                    model_tags = set(model.tags or [])
-                    # Skip if it has a quant/format tag AND doesn't have a core 'transformers' or 'pytorch' tag
-                    is_quant_only = format_tags.intersection(model_tags) and not {'transformers', 'pytorch', 'jax', 'safetensors'}.intersection(model_tags)
-                    if is_quant_only:
-                        continue
-
-                    # Determine category based on pipeline tag primarily
-                    pipeline = model.pipeline_tag.lower() if model.pipeline_tag else ""
-                    category = "hub_other"
-                    if any(p in pipeline for p in ["image-to-text", "visual-question-answering", "image-text-to-text"]): category = "hub_vision"
-                    elif any(p in pipeline for p in ["text-generation", "text2text-generation", "conversational", "summarization"]): category = "hub_text"
-                    # Refine category based on tags if pipeline is missing/generic
-                    elif 'text-generation' in model_tags or 'text2text-generation' in model_tags: category = "hub_text"
-                    elif 'image-to-text' in model_tags: category = "hub_vision"
-
-
-                    # Extract info from cardData if available
-                    license_info = "Check card"
-                    datasets_info = "Check card"
-                    if model.cardData:
-                        license_info = model.cardData.get('license', "Check card")
-                        # Simplify common licenses
-                        if isinstance(license_info, list): license_info = license_info[0] # Take first if list
-                        if isinstance(license_info, str):
-                            license_info=license_info.replace("apache-2.0","Apache 2.0").replace("mit","MIT") # Prettify common ones
-                            if len(license_info)>20: license_info=license_info[:17]+"..." # Truncate long names
-
-                        datasets_info = model.cardData.get('datasets', "Check card")
-                        if isinstance(datasets_info, list): datasets_info = ", ".join(datasets_info) # Join if list
-                        if isinstance(datasets_info, str) and len(datasets_info)>30: datasets_info = datasets_info[:27]+"..." # Truncate
-
-                    # Build description string
-                    description_parts = []
-                    if model.downloads is not None: description_parts.append(f"Dl: {model.downloads:,}")
-                    if model.likes is not None: description_parts.append(f"Likes: {model.likes:,}")
-                    if model.lastModified: description_parts.append(f"Upd: {model.lastModified.split('T')[0]}")
-                    description = ", ".join(description_parts)
-
-
-                    author_hub = model.author or None
-                    model_name_only_hub = model_id.split('/')[-1] # Get last part as name
-
-                    entry = {
-                        "category": category,
-                        "datasets": datasets_info,
-                        "icon": default_icon,
-                        "last_commit_time": model.lastModified,
-                        "license": license_info,
-                        "model_creator": author_hub,
-                        "model_creator_link": f"https://huggingface.co/{author_hub}" if author_hub != "Unknown" else "https://huggingface.co/",
-                        "name": model_id, # Full ID is the unique identifier
-                        "display_name": model_name_only_hub, # For display
-                        "provider": author_hub, # Indicate source provider/author
-                        "rank": model.likes or model.downloads or 0, # Rank by likes or downloads
-                        "type": "downloadable", # Mark as needing download
-                        "description": description,
-                        "link": f"https://huggingface.co/{model_id}",
-                        "variants": [{"name": model_id, "size": -1, "is_local": False}], # Size unknown, mark not local
-                    }
-                    lollms_models.append(entry)
-                    filtered_hub_count += 1
-                except Exception as ex:
-                    ASCIIColors.debug(f"Error processing Hub model {model.modelId}: {ex}")
-
-            ASCIIColors.info(f"Added {filtered_hub_count} Hugging Face Hub models after filtering.")
-
-        except ImportError: self.error("huggingface_hub library not found. Cannot fetch Hub models.")
-        except ConnectionError: pass # Already warned about offline mode
-        except Exception as e: self.error(f"Failed to fetch models from Hugging Face Hub: {e}"); trace_exception(e)
+        for entry in self._get_hub_catalog(default_icon):
+            if entry["name"] in local_model_names: continue # Already local
+            lollms_models.append(entry)
+            filtered_hub_count += 1
+        ASCIIColors.info(f"Added {filtered_hub_count} Hugging Face Hub models after filtering.")
 
         # Add fallbacks only if Hub fetch failed or yielded zero results
         if filtered_hub_count == 0 and not self.binding_config.transformers_offline:
@@ -18,7 +18,6 @@ from lollms.binding import LLMBinding, LOLLMSConfig, BindingType
 from lollms.helpers import ASCIIColors
 from lollms.com import NotificationType
 from lollms.types import MSG_OPERATION_TYPE
-from lollms.utilities import discussion_path_to_url
 from lollms.utilities import AdvancedGarbageCollector, show_yes_no_dialog
 from ascii_colors import ASCIIColors, trace_exception
 import subprocess
@@ -26,6 +25,19 @@ import os
 import sys
 import platform
 import gc
+import base64
+import collections
+import ctypes
+import json
+import hashlib
+import importlib.util
+import inspect
+import mmap
+import struct
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
 
 __author__ = "parisneo"
 __github__ = "https://github.com/ParisNeo/lollms_bindings_zoo"
@@ -55,6 +67,475 @@ def check_file_type(suffix, extensions):
         if ext.replace('.', '').lower() in suffix.lower():
             return True
     return False
+
+
+# The worker script has no lollms dependency, so it holds the helpers shared with the worker processes
+_worker_spec = importlib.util.spec_from_file_location("python_llama_cpp_worker", Path(__file__).parent / "llama_worker.py")
+llama_worker = importlib.util.module_from_spec(_worker_spec)
+_worker_spec.loader.exec_module(llama_worker)
+longest_token_prefix = llama_worker.longest_token_prefix
+LlamaDraftCounter = llama_worker.LlamaDraftCounter
+
+
+class LlavaImageEmbedCache:
+    """
+    Mixin for the llava chat handlers of llama_cpp.
+
+    Keeps the CLIP embeddings of the last images, keyed by the sha256 of the image bytes,
+    so a discussion about an image only encodes it once. Local image paths are read
+    directly from disk instead of being fetched through a URL.
+    """
+    def __init__(self, *args, embed_cache_size: int = 8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.embed_cache_size = max(embed_cache_size, 1)
+        self.embed_cache = collections.OrderedDict()
+        self.embed_cache_hits = 0
+        self.embed_cache_misses = 0
+        self._exit_stack.callback(self.clear_embed_cache)
+
+    def clear_embed_cache(self):
+        while self.embed_cache:
+            _, embed = self.embed_cache.popitem()
+            self._llava_cpp.llava_image_embed_free(embed)
+
+    def load_image(self, image_url: str) -> bytes:
+        if not image_url.startswith(("data:", "http://", "https://")) and Path(image_url).is_file():
+            return Path(image_url).read_bytes()
+        return super().load_image(image_url)
+
+    def _embed_image_bytes(self, image_bytes: bytes, n_threads_batch: int = 1):
+        key = hashlib.sha256(image_bytes).hexdigest()
+        embed = self.embed_cache.get(key)
+        if embed is not None:
+            self.embed_cache.move_to_end(key)
+            self.embed_cache_hits += 1
+            return embed
+        self.embed_cache_misses += 1
+        embed = self._llava_cpp.llava_image_embed_make_with_bytes(
+            self.clip_ctx,
+            n_threads_batch,
+            (ctypes.c_uint8 * len(image_bytes)).from_buffer(bytearray(image_bytes)),
+            len(image_bytes),
+        )
+        self.embed_cache[key] = embed
+        while len(self.embed_cache) > self.embed_cache_size:
+            _, evicted = self.embed_cache.popitem(last=False)
+            self._llava_cpp.llava_image_embed_free(evicted)
+        return embed
+
+
+def image_to_url(image):
+    """
+    Converts an image given to generate_with_images into an url the chat handler can load.
+    Bytes become a data url, urls are kept and anything else is treated as a local file path.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return "data:image/png;base64," + base64.b64encode(image).decode("ascii")
+    image = str(image)
+    if image.startswith(("data:", "http://", "https://")):
+        return image
+    return str(Path(image).resolve())
+
+
+class LlamaTieredCache:
+    """
+    Prompt state cache with a RAM tier and an optional disk tier.
+
+    It follows the llama_cpp BaseLlamaCache protocol (item access by token prefix)
+    so it can be handed directly to Llama.set_cache. Lookups return the state with the
+    longest matching prefix from either tier, disk hits are promoted to RAM and new
+    states are written through to disk so they survive RAM evictions.
+    """
+    def __init__(self, ram_cache, disk_cache=None):
+        self.ram_cache = ram_cache
+        self.disk_cache = disk_cache
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def cache_size(self):
+        return self.ram_cache.cache_size + (self.disk_cache.cache_size if self.disk_cache is not None else 0)
+
+    def _find_longest_prefix(self, key):
+        best_tier, best_key, best_len = None, None, 0
+        for tier in [self.ram_cache, self.disk_cache]:
+            if tier is None:
+                continue
+            tier_key = tier._find_longest_prefix_key(tuple(key))
+            if tier_key is None:
+                continue
+            prefix_len = longest_token_prefix(tier_key, key)
+            if prefix_len > best_len:
+                best_tier, best_key, best_len = tier, tier_key, prefix_len
+        return best_tier, best_key
+
+    def __contains__(self, key):
+        return self._find_longest_prefix(key)[0] is not None
+
+    def __getitem__(self, key):
+        tier, tier_key = self._find_longest_prefix(key)
+        if tier is None:
+            self.misses += 1
+            raise KeyError("Key not found")
+        state = tier[tier_key]
+        self.hits += 1
+        if tier is self.disk_cache:
+            self.disk_hits += 1
+            self.ram_cache[tier_key] = state
+            self.disk_cache[tier_key] = state # LlamaDiskCache pops the entries it returns
+        return state
+
+    def __setitem__(self, key, value):
+        self.ram_cache[key] = value
+        if self.disk_cache is not None:
+            self.disk_cache[key] = value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "ram_bytes": self.ram_cache.cache_size,
+            "disk_bytes": self.disk_cache.cache_size if self.disk_cache is not None else 0,
+        }
+
+
+class LlamaStateSnapshotStore:
+    """
+    On-disk store of Llama.save_state() snapshots, one file per discussion.
+
+    Snapshots are read back through mmap so restoring does not need an extra copy of the
+    file in memory. The store keeps an index of snapshot sizes and last use times and
+    evicts the least recently used snapshots once the byte budget is exceeded.
+    save_async hands the file writes to a background thread so they don't delay the answer.
+    """
+    MAGIC = b"LLSNAP01"
+
+    def __init__(self, folder: Path, capacity_bytes: int):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.capacity_bytes = capacity_bytes
+        self.index_path = self.folder / "index.json"
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.writer = None
+        self.index = {}
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except Exception as ex:
+                ASCIIColors.warning(f"Couldn't read snapshot index, starting a new one: {ex}")
+        # Forget entries whose file disappeared
+        self.index = {k: v for k, v in self.index.items() if self._file(k).exists()}
+
+    def _file(self, key: str) -> Path:
+        return self.folder / f"{key}.snap"
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= self.capacity_bytes:
+                break
+            total -= self.index[key]["size"]
+            self._file(key).unlink(missing_ok=True)
+            del self.index[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index or key in self.pending
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.index.values())
+
+    def save(self, key: str, state) -> None:
+        input_ids = np.ascontiguousarray(state.input_ids)
+        scores = np.ascontiguousarray(state.scores)
+        llama_state = bytes(state.llama_state)
+        header = json.dumps({
+            "n_tokens": int(state.n_tokens),
+            "llama_state_size": int(state.llama_state_size),
+            "seed": getattr(state, "seed", None),
+            "input_ids": [str(input_ids.dtype), list(input_ids.shape)],
+            "scores": [str(scores.dtype), list(scores.shape)],
+        }).encode("utf-8")
+        with self.lock:
+            tmp_path = self._file(key).with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(struct.pack("<Q", len(header)))
+                f.write(header)
+                f.write(input_ids.tobytes())
+                f.write(scores.tobytes())
+                f.write(llama_state)
+            os.replace(tmp_path, self._file(key))
+            self.index[key] = {"size": self._file(key).stat().st_size, "last_used": time.time()}
+            self._evict()
+            self._save_index()
+
+    def save_async(self, key: str, state) -> None:
+        """
+        Queues a snapshot to be written by the background writer thread.
+        A snapshot of the same discussion still waiting to be written is replaced by the newer one.
+        """
+        with self.pending_lock:
+            self.pending[key] = state
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_pending, name="llama_cpp_snapshot_writer", daemon=True)
+                self.writer.start()
+
+    def _write_pending(self):
+        while True:
+            with self.pending_lock:
+                if not self.pending:
+                    self.writer = None
+                    return
+                key = next(iter(self.pending))
+                state = self.pending[key]
+            try:
+                self.save(key, state)
+            except Exception as ex:
+                trace_exception(ex)
+                ASCIIColors.warning("Couldn't save the discussion state")
+            with self.pending_lock:
+                # Keep a newer snapshot queued while this one was written
+                if self.pending.get(key) is state:
+                    del self.pending[key]
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Waits for the queued snapshots to be written.
+        """
+        writer = self.writer
+        if writer is not None:
+            writer.join(timeout)
+
+    def restore(self, key: str, model) -> bool:
+        """
+        Loads the snapshot of a discussion into a llama_cpp.Llama instance.
+
+        Returns:
+            bool: True if a snapshot was restored.
+        """
+        import llama_cpp
+        with self.pending_lock:
+            pending_state = self.pending.get(key)
+        if pending_state is not None:
+            # Not written yet, the state is still in memory
+            model.load_state(pending_state)
+            return True
+        with self.lock:
+            if key not in self.index:
+                return False
+            with open(self._file(key), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(self.MAGIC)] != self.MAGIC:
+                    raise ValueError(f"Invalid snapshot file {self._file(key)}")
+                offset = len(self.MAGIC)
+                header_len, = struct.unpack("<Q", mm[offset:offset+8])
+                offset += 8
+                header = json.loads(mm[offset:offset+header_len].decode("utf-8"))
+                offset += header_len
+                buffer = memoryview(mm)
+                arrays = []
+                for name in ["input_ids", "scores"]:
+                    dtype, shape = np.dtype(header[name][0]), header[name][1]
+                    count = int(np.prod(shape))
+                    arrays.append(np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape))
+                    offset += count * dtype.itemsize
+                state_kwargs = {}
+                if "seed" in inspect.signature(llama_cpp.LlamaState).parameters:
+                    # Required since llama-cpp-python 0.3, older snapshots may not have it
+                    seed = header.get("seed")
+                    state_kwargs["seed"] = seed if seed is not None else getattr(model, "_seed", getattr(llama_cpp, "LLAMA_DEFAULT_SEED", 0xFFFFFFFF))
+                state = llama_cpp.LlamaState(
+                    input_ids=arrays[0],
+                    scores=arrays[1],
+                    n_tokens=header["n_tokens"],
+                    llama_state=buffer[offset:offset+header["llama_state_size"]],
+                    llama_state_size=header["llama_state_size"],
+                    **state_kwargs
+                )
+                model.load_state(state)
+                # Release the views before the mmap gets closed
+                del state, arrays, buffer
+            self.index[key]["last_used"] = time.time()
+            self._save_index()
+        return True
+
+
+class LlamaWorkerPool:
+    """
+    Pool of worker processes, each running its own llama_cpp.Llama on the same GGUF file.
+
+    Weights are memory mapped by every worker so they are shared through the page cache.
+    Requests go to the worker with the fewest requests in flight and the generated text
+    is streamed back over a multiprocessing connection.
+    """
+    def __init__(self, llama_kwargs: dict, n_workers: int, cache_capacity: int = 0):
+        self.llama_kwargs = llama_kwargs
+        self.n_workers = n_workers
+        self.cache_capacity = cache_capacity
+        self.workers = []
+        self.processes = []
+        self.lock = threading.Lock()
+        self.next_request_id = 0
+
+    def start(self, timeout: float = 600):
+        from multiprocessing.connection import Listener
+        authkey = os.urandom(32)
+        env = os.environ.copy()
+        env["LLAMA_WORKER_AUTHKEY"] = authkey.hex()
+        worker_script = Path(__file__).parent / "llama_worker.py"
+        connections = []
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            host, port = listener.address
+            self.processes = [
+                subprocess.Popen([sys.executable, str(worker_script), host, str(port), json.dumps(self.llama_kwargs), str(self.cache_capacity)], env=env)
+                for _ in range(self.n_workers)
+            ]
+            def accept_all():
+                for _ in self.processes:
+                    try:
+                        connections.append(listener.accept())
+                    except OSError:
+                        break
+            acceptor = threading.Thread(target=accept_all, daemon=True)
+            acceptor.start()
+            start_time = time.time()
+            while acceptor.is_alive():
+                acceptor.join(timeout=0.5)
+                dead = [p for p in self.processes if p.poll() is not None]
+                if dead or time.time() - start_time > timeout:
+                    self.shutdown()
+                    raise RuntimeError("llama_cpp workers failed to start" + (f" (exit code {dead[0].returncode})" if dead else " in time"))
+        for conn in connections:
+            kind, _, info = conn.recv()
+            if kind != "ready":
+                self.shutdown()
+                raise RuntimeError(f"A llama_cpp worker failed to load the model: {info}")
+            worker = {"conn": conn, "send_lock": threading.Lock(), "inflight": 0, "queues": {}, "alive": True}
+            worker["reader"] = threading.Thread(target=self._read_worker, args=(worker,), daemon=True)
+            worker["reader"].start()
+            self.workers.append(worker)
+        ASCIIColors.success(f"Started {len(self.workers)} llama_cpp workers")
+
+    def _read_worker(self, worker):
+        while True:
+            try:
+                kind, request_id, payload = worker["conn"].recv()
+            except (EOFError, OSError):
+                break
+            queue = worker["queues"].get(request_id)
+            if queue is not None:
+                queue.put((kind, payload))
+        # The worker died: no new request goes to it, and everyone waiting on it is unblocked
+        with self.lock:
+            worker["alive"] = False
+            queues = list(worker["queues"].values())
+        for queue in queues:
+            queue.put(("error", "llama_cpp worker process exited"))
+
+    def _send(self, worker, message):
+        with worker["send_lock"]:
+            worker["conn"].send(message)
+
+    def stream(self, mode: str, kwargs: dict, stats: dict = None):
+        """
+        Generates on the least busy worker and yields the text chunks as they arrive.
+        Closing the generator cancels the request on the worker.
+        When a stats dict is provided, it is filled with the draft counters of the request once it is done.
+        """
+        import queue as queue_module
+        queue = queue_module.Queue()
+        with self.lock:
+            alive_workers = [w for w in self.workers if w["alive"]]
+            if not alive_workers:
+                raise RuntimeError("All llama_cpp worker processes have exited. Reload the model")
+            worker = min(alive_workers, key=lambda w: w["inflight"])
+            worker["inflight"] += 1
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            # Registered under the lock, so a worker dying from now on posts an error to this queue
+            worker["queues"][request_id] = queue
+        finished = False
+        sent = False
+        try:
+            self._send(worker, ("generate", request_id, {"mode": mode, "kwargs": kwargs}))
+            sent = True
+            while True:
+                kind, payload = queue.get()
+                if kind == "chunk":
+                    yield payload
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(payload)
+                else:
+                    finished = True
+                    if stats is not None and payload:
+                        stats.update(payload)
+                    break
+        finally:
+            if sent and not finished:
+                try:
+                    self._send(worker, ("cancel", request_id, None))
+                except Exception:
+                    pass
+                # Wait for the worker to acknowledge (or die) so the request slot is really free
+                while queue.get()[0] == "chunk":
+                    pass
+            del worker["queues"][request_id]
+            with self.lock:
+                worker["inflight"] -= 1
+
+    def drain_and_shutdown(self, timeout: float = 600):
+        """
+        Waits for the requests in flight to finish (or the timeout to expire), then stops the workers.
+        """
+        start_time = time.time()
+        while any(worker["inflight"] for worker in self.workers) and time.time() - start_time < timeout:
+            time.sleep(0.5)
+        self.shutdown()
+
+    def shutdown(self):
+        for worker in self.workers:
+            try:
+                self._send(worker, ("shutdown", None, None))
+                worker["conn"].close()
+            except Exception:
+                pass
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.workers = []
+        self.processes = []
+
+
+class ModelLoadFuture(Future):
+    """
+    Future returned by asynchronous model loads.
+    Resolves to the binding once the new model is in use (None if a newer load superseded it).
+    The status attribute describes the current loading step.
+    """
+    def __init__(self, model_name: str):
+        super().__init__()
+        self.model_name = model_name
+        self.status = "Queued"
+
+    def set_status(self, status: str):
+        self.status = status
+        ASCIIColors.info(f"[{self.model_name}] {status}")
+
+
 class LLAMA_Python_CPP(LLMBinding):
     def __init__(self, 
                 config: LOLLMSConfig, 
@@ -78,6 +559,19 @@ class LLAMA_Python_CPP(LLMBinding):
             installation_option (InstallOption, optional): The installation option for LOLLMS. Defaults to InstallOption.INSTALL_IF_NECESSARY.
         """
         self.model = None
+        self.prompt_cache = None
+        self.state_store = None
+        self.state_owner = None
+        self.worker_pool = None
+        self.chat_handler = None
+        self.embedding_model = None
+        self.embedding_model_key = None
+        self.embedding_lock = threading.RLock()
+        self.draft_counter = None
+        self.last_draft_stats = {}
+        self.model_swap_lock = threading.Lock()
+        self.model_load_id = 0
+        self.model_load_future = None
         
         self.config = config
         if lollms_paths is None:
@@ -90,7 +584,22 @@ class LLAMA_Python_CPP(LLMBinding):
             {"name":"n_gpu_layers","type":"int","value":-1 if config.hardware_mode=="nvidia" or  config.hardware_mode=="nvidia-tensorcores" or  config.hardware_mode=="amd" or  config.hardware_mode=="amd-noavx" else 0, "min":-1},
             {"name":"main_gpu","type":"int","value":0, "help":"If you have more than one gpu you can select the gpu to be used here"},
             {"name":"offload_kqv","type":"bool","value":False if 'cpu' in self.config.hardware_mode or 'apple' in self.config.hardware_mode else True, "help":"If you have more than one gpu you can select the gpu to be used here"},
-            {"name":"cache_capacity","type":"int","value":(2 << 30) , "help":"The size of the cache in bytes"},            
+            {"name":"cache_capacity","type":"int","value":(2 << 30) , "help":"The size of the RAM prompt state cache in bytes. Cached states let follow-up requests only evaluate the new tokens. Set to 0 to disable the cache."},
+            {"name":"disk_cache_enabled","type":"bool","value":False, "help":"Also keep prompt states in an on-disk cache so they survive RAM cache evictions and restarts."},
+            {"name":"disk_cache_dir","type":"str","value":"", "help":"Folder of the on-disk prompt state cache. Leave empty to use the lollms personal data folder."},
+            {"name":"disk_cache_capacity","type":"int","value":(10 << 30), "help":"The size of the on-disk prompt state cache in bytes"},
+            {"name":"state_snapshots","type":"bool","value":False, "help":"Save the model state of each discussion to disk after every generation (in the background) and restore it when the discussion comes back, so long discussions are not prefilled again. Snapshots survive model reloads and restarts as long as the model file and context size don't change."},
+            {"name":"state_snapshots_dir","type":"str","value":"", "help":"Folder of the discussion state snapshots. Leave empty to use the lollms personal data folder."},
+            {"name":"state_snapshots_capacity","type":"int","value":(8 << 30), "help":"Maximum size of the discussion state snapshots in bytes. The least recently used snapshots are removed first."},
+            {"name":"execution_mode","type":"str","value":"single", "options":["single","process_pool"], "help":"single runs one model that serves requests one after the other.\nprocess_pool starts n_workers processes that each run the model on the same memory mapped file, so concurrent requests are served in parallel. Meant for CPU hosts: set n_threads to the number of cores divided by n_workers. Vision models always use single mode."},
+            {"name":"n_workers","type":"int","value":4, "min":1, "help":"Number of worker processes in process_pool mode"},
+            {"name":"draft_mode","type":"str","value":"none", "options":["none","prompt_lookup"], "help":"Speculative decoding mode.\nprompt_lookup drafts the next tokens by finding the last generated n-gram in the prompt and copying what follows it. No second model is needed, and it speeds up answers that copy large spans of the prompt (RAG answers, code edits). Not used by vision models."},
+            {"name":"draft_ngram_size","type":"int","value":2, "min":1, "help":"Size of the n-gram looked up in the prompt in prompt_lookup mode"},
+            {"name":"draft_num_pred_tokens","type":"int","value":10, "min":1, "help":"Number of tokens drafted at each step in prompt_lookup mode. Higher values help on copy heavy outputs but waste more compute when drafts are rejected."},
+            {"name":"embedding_model_name","type":"str","value":"", "help":"Name (or path) of a GGUF embedding model loaded next to the chat model to compute embeddings. Leave empty to compute embeddings with the chat model."},
+            {"name":"embedding_batch_size","type":"int","value":2048, "min":64, "help":"Maximum number of tokens evaluated at once by the embedding model. Longer texts are truncated to this size."},
+            {"name":"image_embed_cache_size","type":"int","value":8, "min":1, "help":"Number of image embeddings kept in memory by vision models. An image that is still in the cache is not encoded again in the following messages of the discussion."},
+            {"name":"async_model_loading","type":"bool","value":False, "help":"Load new models in the background and swap them in once ready. The current model keeps answering meanwhile if there is enough RAM for both."},
             {"name":"batch_size","type":"int","value":512, "min":1, "help":"The batch size (the bigger the less warmup time)"},
             {"name":"ctx_size","type":"int","value":4090, "min":512, "help":"The current context size (it depends on the model you are using). Make sure the context size if correct or you may encounter bad outputs."},
             {"name":"max_n_predict","type":"int","value":4090, "min":512, "help":"The maximum amount of tokens to generate"},
@@ -123,6 +632,8 @@ class LLAMA_Python_CPP(LLMBinding):
         
 
     def __del__(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
         if self.model:
             del self.model
 
@@ -132,10 +643,9 @@ class LLAMA_Python_CPP(LLMBinding):
         super().build_model(model_name)
         self.config.ctx_size=self.binding_config.config.ctx_size
         self.config.max_n_predict=self.binding_config.max_n_predict
-        if self.model:
-            ASCIIColors.yellow("A model is already loaded. Unloading it")
-            self.model = None
-            gc.collect()
+        async_loading = self.binding_config.async_model_loading
+        if not async_loading:
+            self.unload_model()
 
         try:
             import llama_cpp
@@ -152,72 +662,364 @@ class LLAMA_Python_CPP(LLMBinding):
         
         model_path = self.get_model_path()
         if not model_path:
-            self.model = None
+            self.unload_model()
             return None
-        
-        self.binding_type = BindingType.TEXT_ONLY
+
+        if async_loading:
+            # The current model keeps answering until the new one is ready
+            self.load_model_async(llama_cpp, model_path)
+            return self
+
+        self.install_model_components(llama_cpp, model_path, self.load_model_components(llama_cpp, model_path))
+        ASCIIColors.success("Model built")            
+        return self
+
+    def unload_model(self):
+        if self.state_store is not None:
+            self.state_store.flush() # Write the queued snapshots before their states are freed
+        if self.model:
+            ASCIIColors.yellow("A model is already loaded. Unloading it")
+            self.model = None
+            gc.collect()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+
+    def load_model_components(self, llama_cpp, model_path:Path, status:Callable[[str], None]=None):
+        """
+        Loads a model without touching the model in use.
+
+        Args:
+            llama_cpp (module): The imported llama_cpp module.
+            model_path (Path): Path to the model file.
+            status (Callable[[str], None], optional): Receives the loading steps. Defaults to blocking messages in the UI.
+
+        Returns:
+            dict: model, chat_handler, binding_type and worker_pool, to be installed with install_model_components.
+        """
+        components = {"chat_handler":None, "binding_type":BindingType.TEXT_ONLY, "worker_pool":None, "draft_counter":None}
+        llama_kwargs = self.get_llama_kwargs(model_path)
+        text_kwargs = dict(llama_kwargs)
+        if self.binding_config.draft_mode=="prompt_lookup":
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            components["draft_counter"] = LlamaDraftCounter(LlamaPromptLookupDecoding(max_ngram_size=self.binding_config.draft_ngram_size, num_pred_tokens=self.binding_config.draft_num_pred_tokens))
+            text_kwargs["draft_model"] = components["draft_counter"]
 
         if "llava" in self.config.model_name.lower() or "vision" in self.config.model_name.lower():
             mmproj_variants = [v for v in model_path.parent.iterdir() if "mmproj" in str(v)]
             if len(mmproj_variants)==0:
                 self.InfoMessage("Projector file was not found. Please download it first.\nReverting to text only")
 
-                self.model = llama_cpp.Llama(
-                                        model_path=str(model_path), 
-                                        n_gpu_layers=self.binding_config.n_gpu_layers, 
-                                        main_gpu=self.binding_config.main_gpu, 
-                                        n_ctx=self.config.ctx_size,
-                                        n_threads=self.binding_config.n_threads,
-                                        n_batch=self.binding_config.batch_size,
-                                        offload_kqv=self.binding_config.offload_kqv,
-                                        seed=self.binding_config.seed,
-                                        lora_path=self.binding_config.lora_path if self.binding_config.lora_path!="" else None,
-                                        lora_scale=self.binding_config.lora_scale, 
-                                    )
+                components["model"] = llama_cpp.Llama(**text_kwargs)
 
             else:
                 proj_file = mmproj_variants[0]
-                self.binding_type = BindingType.TEXT_IMAGE
-                self.chat_handler = llama_cpp.llama_chat_format.Llava15ChatHandler(clip_model_path=str(proj_file))
-                self.model = llama_cpp.Llama(
-                                        model_path=str(model_path), 
-                                        n_gpu_layers=self.binding_config.n_gpu_layers, 
-                                        main_gpu=self.binding_config.main_gpu, 
-                                        n_ctx=self.config.ctx_size,
-                                        n_threads=self.binding_config.n_threads,
-                                        n_batch=self.binding_config.batch_size,
-                                        offload_kqv=self.binding_config.offload_kqv,
-                                        seed=self.binding_config.seed,
-                                        lora_path=self.binding_config.lora_path if self.binding_config.lora_path!="" else None,
-                                        lora_scale=self.binding_config.lora_scale,
-
-                                        chat_handler=self.chat_handler,
+                components["binding_type"] = BindingType.TEXT_IMAGE
+                components["draft_counter"] = None
+                handler_class = type("CachedLlava15ChatHandler", (LlavaImageEmbedCache, llama_cpp.llama_chat_format.Llava15ChatHandler), {})
+                components["chat_handler"] = handler_class(clip_model_path=str(proj_file), embed_cache_size=self.binding_config.image_embed_cache_size)
+                components["model"] = llama_cpp.Llama(
+                                        **llama_kwargs,
+                                        chat_handler=components["chat_handler"],
                                         logits_all=True
                                     )
+        elif self.binding_config.execution_mode=="process_pool":
+            # The workers hold the real models, the binding only keeps the vocabulary for tokenization
+            components["model"] = llama_cpp.Llama(model_path=str(model_path), vocab_only=True)
+            try:
+                if status is None:
+                    self.ShowBlockingMessage(f"Starting {self.binding_config.n_workers} llama_cpp workers")
+                else:
+                    status(f"Starting {self.binding_config.n_workers} llama_cpp workers")
+                worker_kwargs = dict(llama_kwargs)
+                if components["draft_counter"] is not None:
+                    # The draft model can't cross the process boundary, each worker builds its own
+                    worker_kwargs["draft_prompt_lookup"] = {"max_ngram_size":self.binding_config.draft_ngram_size, "num_pred_tokens":self.binding_config.draft_num_pred_tokens}
+                    components["draft_counter"] = None
+                worker_pool = LlamaWorkerPool(worker_kwargs, self.binding_config.n_workers, self.binding_config.cache_capacity)
+                worker_pool.start()
+                components["worker_pool"] = worker_pool
+                if status is None:
+                    self.HideBlockingMessage()
+            except Exception as ex:
+                trace_exception(ex)
+                if status is None:
+                    self.HideBlockingMessage()
+                self.InfoMessage(f"Couldn't start the llama_cpp worker pool:\n{ex}\nReverting to a single model")
+                if self.binding_config.draft_mode=="prompt_lookup":
+                    components["draft_counter"] = text_kwargs["draft_model"]
+                components["model"] = llama_cpp.Llama(**text_kwargs)
         else:
-            self.model = llama_cpp.Llama(
-                                    model_path=str(model_path), 
-                                    n_gpu_layers= self.binding_config.n_gpu_layers, 
-                                    main_gpu=self.binding_config.main_gpu, 
-                                    n_ctx=self.config.ctx_size,
-                                    n_threads=self.binding_config.n_threads,
-                                    n_batch=self.binding_config.batch_size,
-                                    offload_kqv=self.binding_config.offload_kqv,
-                                    seed=self.binding_config.seed,
-                                    lora_path=self.binding_config.lora_path if self.binding_config.lora_path!="" else None,
-                                    lora_scale=self.binding_config.lora_scale, 
-                                )
-
-        # self.model.set_cache(LlamaCache(capacity_bytes=0))
-        print("Testing model")
-        for chunk in self.model.create_completion("question: What is 1+1\nanswer:",
-                                        max_tokens = 2,
-                                        stream=True):
-            print(chunk["choices"][0]["text"])
-        
-        ASCIIColors.success("Model built")            
-        return self
+            components["model"] = llama_cpp.Llama(**text_kwargs)
+
+        if components["worker_pool"] is None:
+            print("Testing model")
+            for chunk in components["model"].create_completion("question: What is 1+1\nanswer:",
+                                            max_tokens = 2,
+                                            stream=True):
+                print(chunk["choices"][0]["text"])
+        self.get_embedding_model(llama_cpp)
+        return components
+
+    def install_model_components(self, llama_cpp, model_path:Path, components:dict):
+        """
+        Makes freshly loaded components the model in use.
+        A replaced worker pool is shut down once its running requests are finished.
+        """
+        with self.model_swap_lock:
+            old_pool = self.worker_pool
+            self.model = components["model"]
+            self.chat_handler = components["chat_handler"]
+            self.binding_type = components["binding_type"]
+            self.worker_pool = components["worker_pool"]
+            self.draft_counter = components["draft_counter"]
+            self.last_draft_stats = {}
+            self.prompt_cache = None
+            self.state_store = None
+            self.state_owner = None
+            if self.worker_pool is None:
+                self.setup_prompt_cache(llama_cpp)
+                self.setup_state_snapshots(model_path)
+        if old_pool is not None and old_pool is not self.worker_pool:
+            threading.Thread(target=old_pool.drain_and_shutdown, daemon=True).start()
+
+    def has_memory_for(self, model_path:Path):
+        """
+        Rough check that a model file fits in the available RAM next to the model in use.
+        """
+        try:
+            import psutil
+            needed = model_path.stat().st_size
+            if self.binding_config.execution_mode=="process_pool":
+                # The weights are shared through the page cache, but each worker has its own context
+                needed *= 1.2
+            return psutil.virtual_memory().available > needed * 1.1
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't determine the available memory: {ex}")
+            return True
+
+    def load_model_async(self, llama_cpp, model_path:Path):
+        """
+        Loads a model on a background thread and swaps it in once it is ready.
+        The current model keeps answering meanwhile, unless the available memory can't hold both models.
+
+        Args:
+            llama_cpp (module): The imported llama_cpp module.
+            model_path (Path): Path to the model file.
+
+        Returns:
+            ModelLoadFuture: Resolves to the binding once the new model is in use.
+        """
+        future = ModelLoadFuture(model_path.name)
+        with self.model_swap_lock:
+            self.model_load_id += 1
+            load_id = self.model_load_id
+            self.model_load_future = future
+
+        def runner():
+            future.set_running_or_notify_cancel()
+            try:
+                if (self.model is not None or self.worker_pool is not None) and not self.has_memory_for(model_path):
+                    future.set_status("Not enough memory to keep the current model while loading. Unloading it first")
+                    self.unload_model()
+                future.set_status(f"Loading {model_path}")
+                components = self.load_model_components(llama_cpp, model_path, future.set_status)
+                if load_id != self.model_load_id:
+                    future.set_status("Superseded by a newer load request. Discarding it")
+                    if components["worker_pool"] is not None:
+                        components["worker_pool"].shutdown()
+                    del components
+                    gc.collect()
+                    future.set_result(None)
+                    return
+                self.install_model_components(llama_cpp, model_path, components)
+                gc.collect()
+                future.set_status("Ready")
+                ASCIIColors.success("Model built")
+                future.set_result(self)
+            except Exception as ex:
+                trace_exception(ex)
+                future.set_status(f"Failed: {ex}")
+                self.InfoMessage(f"Couldn't load {model_path.name}:\n{ex}")
+                future.set_exception(ex)
+
+        threading.Thread(target=runner, name="llama_cpp_model_loader", daemon=True).start()
+        return future
+
+    def wait_for_model(self):
+        """
+        Waits for the background load when no model is in use yet (first load with async_model_loading).
+
+        Returns:
+            bool: True if a model is ready to generate.
+        """
+        while self.model is None:
+            future = self.model_load_future
+            if future is None or future.done():
+                break
+            ASCIIColors.info(f"Waiting for {future.model_name} to finish loading ({future.status})")
+            try:
+                future.result()
+            except Exception:
+                pass # Already reported by the loader
+        return self.model is not None
+
+    def get_llama_kwargs(self, model_path:Path):
+        """
+        Returns the llama_cpp.Llama construction arguments built from the binding configuration.
+
+        Args:
+            model_path (Path): Path to the model file.
+        """
+        return {
+            "model_path":str(model_path),
+            "n_gpu_layers":self.binding_config.n_gpu_layers,
+            "main_gpu":self.binding_config.main_gpu,
+            "n_ctx":self.config.ctx_size,
+            "n_threads":self.binding_config.n_threads,
+            "n_batch":self.binding_config.batch_size,
+            "offload_kqv":self.binding_config.offload_kqv,
+            "seed":self.binding_config.seed,
+            "lora_path":self.binding_config.lora_path if self.binding_config.lora_path!="" else None,
+            "lora_scale":self.binding_config.lora_scale,
+        }
+
+    def setup_prompt_cache(self, llama_cpp):
+        """
+        Attaches the RAM (and optionally disk) prompt state cache to the model.
+
+        Args:
+            llama_cpp (module): The imported llama_cpp module.
+        """
+        self.prompt_cache = None
+        if self.binding_config.cache_capacity<=0:
+            ASCIIColors.info("Prompt state cache disabled")
+            return
+        try:
+            ram_cache = llama_cpp.LlamaRAMCache(capacity_bytes=self.binding_config.cache_capacity)
+            disk_cache = None
+            if self.binding_config.disk_cache_enabled:
+                if self.binding_config.disk_cache_dir!="":
+                    cache_dir = Path(self.binding_config.disk_cache_dir)
+                else:
+                    cache_dir = self.lollms_paths.personal_data_path/"python_llama_cpp"/"prompt_cache"/Path(self.config.model_name).stem
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                disk_cache = llama_cpp.LlamaDiskCache(cache_dir=str(cache_dir), capacity_bytes=self.binding_config.disk_cache_capacity)
+                ASCIIColors.info(f"Prompt state disk cache: {cache_dir}")
+            self.prompt_cache = LlamaTieredCache(ram_cache, disk_cache)
+            self.model.set_cache(self.prompt_cache)
+        except Exception as ex:
+            trace_exception(ex)
+            self.prompt_cache = None
+            ASCIIColors.warning("Couldn't set up the prompt state cache. Continuing without it")
+
+    def setup_state_snapshots(self, model_path:Path):
+        """
+        Opens the discussion state snapshot store of the current model.
+        Snapshots are grouped by model file, context size and lora so a snapshot is only restored into a compatible context.
+
+        Args:
+            model_path (Path): Path to the loaded model file.
+        """
+        self.state_store = None
+        self.state_owner = None
+        if not self.binding_config.state_snapshots:
+            return
+        try:
+            stat = model_path.stat()
+            fingerprint = hashlib.sha1(
+                f"{model_path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{self.config.ctx_size}|{self.binding_config.lora_path}|{self.binding_config.lora_scale}".encode("utf8")
+            ).hexdigest()[:16]
+            if self.binding_config.state_snapshots_dir!="":
+                root = Path(self.binding_config.state_snapshots_dir)
+            else:
+                root = self.lollms_paths.personal_data_path/"python_llama_cpp"/"state_snapshots"
+            self.state_store = LlamaStateSnapshotStore(root/f"{model_path.stem}_{fingerprint}", self.binding_config.state_snapshots_capacity)
+            ASCIIColors.info(f"Discussion state snapshots: {self.state_store.folder}")
+        except Exception as ex:
+            trace_exception(ex)
+            self.state_store = None
+            ASCIIColors.warning("Couldn't open the discussion state snapshot store. Continuing without it")
+
+    def get_discussion_id(self, gpt_params:dict):
+        """
+        Returns the id of the discussion being generated: the discussion_id parameter if given,
+        otherwise the discussion of the only lollms client that is currently generating.
+
+        Returns:
+            The discussion id, or None if it can't be told (no client, several clients generating at once).
+        """
+        if gpt_params.get("discussion_id") is not None:
+            return gpt_params["discussion_id"]
+        session = getattr(self.lollmsCom, "session", None)
+        clients = list(getattr(session, "clients", {}).values()) if session is not None else []
+        generating = [client for client in clients if getattr(client, "processing", False) and getattr(client, "discussion", None) is not None]
+        if len(generating)==1:
+            return generating[0].discussion.discussion_id
+        return None
+
+    def get_snapshot_key(self, discussion_id):
+        """
+        Returns the snapshot key of a discussion, or None when there is no discussion id (no snapshot is used then).
+        """
+        if discussion_id is None:
+            return None
+        return hashlib.sha1(f"id:{discussion_id}".encode("utf8")).hexdigest()
+
+    def restore_discussion_state(self, key:str):
+        if self.state_store is None or key is None or self.state_owner==key:
+            return
+        try:
+            if self.state_store.restore(key, self.model):
+                ASCIIColors.info(f"Restored discussion state ({self.model.n_tokens} tokens)")
+                self.state_owner = key
+        except Exception as ex:
+            trace_exception(ex)
+            ASCIIColors.warning("Couldn't restore the discussion state. The prompt will be evaluated from scratch")
+
+    def save_discussion_state(self, key:str):
+        if self.state_store is None or key is None or self.model.n_tokens==0:
+            # Nothing worth saving, e.g. the model was swapped during the generation
+            return
+        try:
+            # Copying the state is fast, writing it to disk is done in the background
+            self.state_store.save_async(key, self.model.save_state())
+            self.state_owner = key
+        except Exception as ex:
+            trace_exception(ex)
+            ASCIIColors.warning("Couldn't save the discussion state")
+
+    def get_prompt_cache_stats(self):
+        """
+        Returns the prompt state cache counters.
+
+        Returns:
+            dict: hits, disk_hits, misses and the bytes used by each tier (empty if the cache is disabled).
+        """
+        if self.prompt_cache is None:
+            return {}
+        return self.prompt_cache.stats()
+
+    def report_prompt_cache_stats(self, verbose=False):
+        if self.prompt_cache is not None and (verbose or self.config.debug):
+            stats = self.prompt_cache.stats()
+            ASCIIColors.info(f"Prompt cache: {stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses, RAM {stats['ram_bytes']/(1<<20):.1f} MiB, disk {stats['disk_bytes']/(1<<20):.1f} MiB")
     
+    def get_draft_stats(self):
+        """
+        Returns the speculative decoding counters of the last request.
+
+        Returns:
+            dict: proposed and accepted draft tokens (empty if draft_mode is none).
+        """
+        return self.last_draft_stats
+
+    def report_draft_stats(self, verbose=False):
+        if self.last_draft_stats and (verbose or self.config.debug):
+            proposed = self.last_draft_stats["proposed"]
+            accepted = self.last_draft_stats["accepted"]
+            ASCIIColors.info(f"Prompt lookup drafts: {accepted}/{proposed} tokens accepted ({100*accepted/max(proposed,1):.1f}%)")
+
     def install_cpu(self):
         # Set the environment variable
         os.environ['CMAKE_ARGS'] = ""
@@ -393,15 +1195,86 @@ class LLAMA_Python_CPP(LLMBinding):
         """
         return self.model.detokenize(tokens_list).decode("utf8", errors="ignore")
     
+    def find_embedding_model_path(self):
+        """
+        Returns the path of the embedding model, either given as a path or searched by name in the gguf models folders.
+        """
+        name = self.binding_config.embedding_model_name.strip()
+        if Path(name).is_file():
+            return Path(name)
+        file_name = name if name.lower().endswith(".gguf") else name+".gguf"
+        for models_dir_name in ["gguf", "ggml"]:
+            models_dir = self.lollms_paths.personal_models_path/models_dir_name
+            if models_dir.exists():
+                for candidate in models_dir.rglob("*.gguf"):
+                    if candidate.name.lower()==file_name.lower():
+                        return candidate
+        return None
+
+    def get_embedding_model(self, llama_cpp=None):
+        """
+        Returns the dedicated embedding model, loading it if needed.
+        The model has its own context, so embeddings never evict the chat model state.
+        The model is searched and loaded once per embedding settings, a model that is missing or fails to load
+        is not retried until the settings change.
+
+        Returns:
+            llama_cpp.Llama: The embedding model, or None if embedding_model_name is not set or couldn't be loaded.
+        """
+        name = self.binding_config.embedding_model_name.strip()
+        if name=="":
+            self.embedding_model = None
+            self.embedding_model_key = None
+            return None
+        with self.embedding_lock:
+            batch_size = self.binding_config.embedding_batch_size
+            key = (name, batch_size, self.binding_config.n_gpu_layers)
+            if self.embedding_model_key==key:
+                return self.embedding_model
+            self.embedding_model = None
+            self.embedding_model_key = key
+            model_path = self.find_embedding_model_path()
+            if model_path is None:
+                ASCIIColors.warning(f"Embedding model {name} not found. Embeddings will use the chat model")
+                return None
+            try:
+                if llama_cpp is None:
+                    import llama_cpp
+                ASCIIColors.info(f"Loading embedding model {model_path.name}")
+                # Embedding models attend to the whole input, so a sequence must fit in one physical batch
+                self.embedding_model = llama_cpp.Llama(
+                                        model_path=str(model_path),
+                                        embedding=True,
+                                        n_ctx=batch_size,
+                                        n_batch=batch_size,
+                                        n_ubatch=batch_size,
+                                        n_gpu_layers=self.binding_config.n_gpu_layers,
+                                        main_gpu=self.binding_config.main_gpu,
+                                        n_threads=self.binding_config.n_threads,
+                                        verbose=False
+                                    )
+            except Exception as ex:
+                trace_exception(ex)
+                ASCIIColors.warning("Couldn't load the embedding model. Embeddings will use the chat model")
+            return self.embedding_model
+
     def embed(self, text):
         """
-        Computes text embedding
+        Computes text embeddings
+        Uses the dedicated embedding model when embedding_model_name is set, otherwise the chat model (not available in process_pool mode, where the binding only holds the vocabulary).
         Args:
-            text (str): The text to be embedded.
+            text (str or List[str]): The text to be embedded, or a list of texts that are evaluated in batches of up to embedding_batch_size tokens.
         Returns:
-            List[float]
+            np.ndarray: float32 embedding of the text, or one row per text for a list.
         """
-        return self.model.embed(text)
+        embedding_model = self.get_embedding_model()
+        if embedding_model is None:
+            if self.worker_pool is not None:
+                # The binding only holds the vocabulary, the weights live in the workers
+                raise RuntimeError("Embeddings are not computed by the workers in process_pool mode. Set embedding_model_name to use a dedicated embedding model.")
+            return np.asarray(self.model.embed(text), dtype=np.float32)
+        with self.embedding_lock:
+            return np.asarray(embedding_model.embed(text), dtype=np.float32)
     
     def generate(self, 
                  prompt:str,                  
@@ -421,10 +1294,14 @@ class LLAMA_Python_CPP(LLMBinding):
                 top_k (int, optional): Controls the diversity of the generated text by limiting the number of possible next tokens to consider. Defaults to 0 (no limit) if not provided.
                 top_p (float, optional): Controls the diversity of the generated text by truncating the least likely tokens whose cumulative probability exceeds `top_p`. Defaults to 0.0 (no truncation) if not provided.
                 repeat_penalty (float, optional): Adjusts the penalty for repeating tokens in the generated text. Higher values (e.g., 2.0) make the model less likely to repeat tokens. Defaults to 1.0 if not provided.
+                discussion_id (str, optional): Identifier of the discussion, used to save and restore its state snapshot when state_snapshots is enabled. Defaults to the discussion of the lollms client being served; without a discussion no snapshot is used.
 
         Returns:
             str: The generated text based on the prompt
         """
+        if not self.wait_for_model():
+            ASCIIColors.error("No model loaded. Please select a model first")
+            return ""
         default_params = {
             'temperature': float(self.config.temperature),
             'top_k': int(self.config.top_k),
@@ -439,6 +1316,14 @@ class LLAMA_Python_CPP(LLMBinding):
         if gpt_params['seed']!=-1:
             self.seed = self.binding_config.seed
 
+        snapshot_key = None
+        if self.state_store is not None:
+            snapshot_key = self.get_snapshot_key(self.get_discussion_id(gpt_params))
+            self.restore_discussion_state(snapshot_key)
+        if snapshot_key is None:
+            # The context is changed without being saved, it no longer matches any snapshot
+            self.state_owner = None
+
         """
         chunks = self.model(prompt, max_tokens=n_predict,temperature=float(gpt_params["temperature"]),stop=["<0x0A>","assistant\n"],stream=True)
         count = 0
@@ -459,6 +1344,12 @@ class LLAMA_Python_CPP(LLMBinding):
         
           
         """
+        if self.worker_pool is not None:
+            self.state_owner = None
+            return self.generate_on_worker_pool(prompt, n_predict, callback, gpt_params, verbose)
+
+        if self.draft_counter is not None:
+            self.draft_counter.reset()
         
         if self.binding_config.generation_mode=="chat":
 
@@ -515,10 +1406,51 @@ class LLAMA_Python_CPP(LLMBinding):
                         if not callback(word, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
                             break
         
+        self.save_discussion_state(snapshot_key)
+        self.report_prompt_cache_stats(verbose)
+        if self.draft_counter is not None:
+            self.draft_counter.account(self.model.input_ids[:self.model.n_tokens])
+            self.last_draft_stats = self.draft_counter.stats()
+            self.report_draft_stats(verbose)
 
         return output            
 
 
+    def generate_on_worker_pool(self, prompt:str, n_predict:int, callback:Callable[[str], None], gpt_params:dict, verbose:bool=False):
+        """
+        Generates text on the least busy worker of the process pool.
+        Takes the same arguments as generate and honors the same generation modes.
+        """
+        stop = ["<0x0A>","assistant\n", self.config.start_header_id_template,self.config.start_user_header_id_template, self.config.start_ai_header_id_template]
+        if self.binding_config.generation_mode=="chat":
+            mode = "chat"
+            kwargs = {"messages":[{"role": "user", "content": prompt.strip()}]}
+        else:
+            mode = "instruct"
+            kwargs = {"prompt":prompt.strip()}
+        kwargs.update({"max_tokens":n_predict, "temperature":float(gpt_params["temperature"]), "stop":stop})
+        output = ""
+        count = 0
+        draft_stats = {}
+        stream = self.worker_pool.stream(mode, kwargs, draft_stats)
+        try:
+            for word in stream:
+                if count >= n_predict:
+                    break
+                output += word
+                count += 1
+                if callback is not None:
+                    if not callback(word, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
+                        break
+        except Exception as ex:
+            trace_exception(ex)
+        finally:
+            stream.close()
+        if draft_stats:
+            self.last_draft_stats = draft_stats
+            self.report_draft_stats(verbose)
+        return output
+
     def generate_with_images(self, 
             prompt:str,
             images:list=[],
@@ -530,10 +1462,14 @@ class LLAMA_Python_CPP(LLMBinding):
 
         Args:
             prompt (str): The prompt to use for generation
+            images (list, optional): The images, as local file paths, urls or raw bytes.
             n_predict (int, optional): Number of tokens to prodict. Defaults to 128.
             callback (Callable[[str], None], optional): A callback function that is called everytime a new text element is generated. Defaults to None.
             verbose (bool, optional): If true, the code will spit many informations about the generation process. Defaults to False.
         """
+        if not self.wait_for_model():
+            ASCIIColors.error("No model loaded. Please select a model first")
+            return ""
         default_params = {
             'temperature': 0.1,
             'top_k': 50,
@@ -541,10 +1477,12 @@ class LLAMA_Python_CPP(LLMBinding):
             'repeat_penalty': 1.3
         }
         gpt_params = {**default_params, **gpt_params}
+        # The chat completion changes the context without saving a snapshot
+        self.state_owner = None
         output = ""
         try:
             count = 0
-            url_imgs = [f"http://{self.config.host}:{self.config.port}"+discussion_path_to_url(img) for img in images]
+            url_imgs = [image_to_url(img) for img in images]
             for chunk in self.model.create_chat_completion(
                                 messages = [
                                     {
@@ -575,6 +1513,9 @@ class LLAMA_Python_CPP(LLMBinding):
                             break
         except Exception as ex:
             trace_exception(ex)
+        self.report_prompt_cache_stats(verbose)
+        if isinstance(self.chat_handler, LlavaImageEmbedCache) and (verbose or self.config.debug):
+            ASCIIColors.info(f"Image embedding cache: {self.chat_handler.embed_cache_hits} hits, {self.chat_handler.embed_cache_misses} misses")
         return output
 
 if __name__=="__main__":
@@ -0,0 +1,154 @@
+######
+# Project       : lollms
+# File          : python_llama_cpp/llama_worker.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Worker process of the python_llama_cpp process pool.
+# Each worker loads its own llama_cpp.Llama on the same GGUF file (memory mapped,
+# so the weights are shared through the page cache) and streams generated text
+# back to the binding over a multiprocessing connection.
+# It has no lollms dependency, so it also holds the helpers the binding shares
+# with the workers (loaded by python_llama_cpp/__init__.py).
+######
+import collections
+import json
+import os
+import sys
+from multiprocessing.connection import Client
+
+
+def extract_text(chunk, mode):
+    choice = chunk["choices"][0]
+    if mode == "chat":
+        return choice.get("delta", {}).get("content", "") or ""
+    return choice.get("text", "") or ""
+
+
+def longest_token_prefix(a, b):
+    """Returns the length of the common prefix of two token sequences."""
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class LlamaDraftCounter:
+    """
+    Wraps a llama_cpp draft model and counts the proposed and accepted draft tokens.
+    Used by the binding in single mode and by each worker in process_pool mode.
+
+    The tokens actually generated after a draft are only known at the next draft call
+    (or at the end of the request), so each draft is checked against them one call later.
+    """
+    def __init__(self, draft_model):
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self):
+        self.proposed = 0
+        self.accepted = 0
+        self.last_length = 0
+        self.last_draft = None
+
+    def account(self, input_ids):
+        if self.last_draft is not None:
+            generated = input_ids[self.last_length:self.last_length + len(self.last_draft)]
+            self.accepted += longest_token_prefix(generated, self.last_draft)
+            self.last_draft = None
+
+    def __call__(self, input_ids, /, **kwargs):
+        self.account(input_ids)
+        draft = self.draft_model(input_ids, **kwargs)
+        self.proposed += len(draft)
+        self.last_length = len(input_ids)
+        self.last_draft = draft
+        return draft
+
+    def stats(self):
+        return {"proposed": self.proposed, "accepted": self.accepted}
+
+
+def main():
+    address = (sys.argv[1], int(sys.argv[2]))
+    llama_kwargs = json.loads(sys.argv[3])
+    cache_capacity = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    authkey = bytes.fromhex(os.environ["LLAMA_WORKER_AUTHKEY"])
+    conn = Client(address, authkey=authkey)
+
+    try:
+        import llama_cpp
+        draft_counter = None
+        draft_settings = llama_kwargs.pop("draft_prompt_lookup", None)
+        if draft_settings is not None:
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            draft_counter = LlamaDraftCounter(LlamaPromptLookupDecoding(**draft_settings))
+            llama_kwargs["draft_model"] = draft_counter
+        model = llama_cpp.Llama(**llama_kwargs)
+        if cache_capacity > 0:
+            model.set_cache(llama_cpp.LlamaRAMCache(capacity_bytes=cache_capacity))
+    except Exception as ex:
+        conn.send(("failed", None, str(ex)))
+        return
+    conn.send(("ready", None, os.getpid()))
+
+    pending = collections.deque()
+    cancelled = set()
+    running = True
+
+    def handle(message):
+        nonlocal running
+        kind, request_id, _ = message
+        if kind == "cancel":
+            cancelled.add(request_id)
+        elif kind == "shutdown":
+            running = False
+        else:
+            pending.append(message)
+
+    def drain():
+        while conn.poll():
+            handle(conn.recv())
+
+    while running:
+        if not pending:
+            try:
+                handle(conn.recv())
+            except EOFError:
+                break
+            continue
+        _, request_id, payload = pending.popleft()
+        if request_id in cancelled:
+            cancelled.discard(request_id)
+            conn.send(("done", request_id, None))
+            continue
+        mode = payload["mode"]
+        if draft_counter is not None:
+            draft_counter.reset()
+        try:
+            if mode == "chat":
+                stream = model.create_chat_completion(stream=True, **payload["kwargs"])
+            else:
+                stream = model.create_completion(stream=True, **payload["kwargs"])
+            for chunk in stream:
+                text = extract_text(chunk, mode)
+                if text:
+                    conn.send(("chunk", request_id, text))
+                drain()
+                if request_id in cancelled or not running:
+                    break
+            stats = None
+            if draft_counter is not None:
+                draft_counter.account(model.input_ids[:model.n_tokens])
+                stats = draft_counter.stats()
+            conn.send(("done", request_id, stats))
+        except Exception as ex:
+            conn.send(("error", request_id, str(ex)))
+        cancelled.discard(request_id)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Shared fixtures of the bindings tests.
+
+Bindings are loaded from their folder the way lollms loads them (their __init__.py as a module),
+and the tests of a binding are skipped when lollms or the packages the binding needs are missing.
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+BINDINGS_ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_binding(folder: str, *requirements: str):
+    for requirement in requirements:
+        pytest.importorskip(requirement)
+    spec = importlib.util.spec_from_file_location(f"{folder}_under_test", BINDINGS_ROOT / folder / "__init__.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def python_llama_cpp():
+    return load_binding("python_llama_cpp", "lollms", "numpy", "llama_cpp")
+
+
+@pytest.fixture(scope="session")
+def hugging_face():
+    return load_binding("hugging_face", "lollms", "pipmaster", "torch", "transformers")
+
+
+@pytest.fixture(scope="session")
+def char_tokenizer():
+    """ Fast tokenizer with one token per character plus two chat special tokens, built without downloading anything. """
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    vocab = {"<unk>": 0}
+    for character in [chr(code) for code in range(32, 127)] + ["\n"]:
+        vocab[character] = len(vocab)
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Split(tokenizers.Regex(r"[\s\S]"), behavior="isolated")
+    backend.decoder = tokenizers.decoders.Fuse()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>")
+    tokenizer.add_special_tokens({"additional_special_tokens": ["<|im_start|>", "<|im_end|>"]})
+    return tokenizer
+
+
+@pytest.fixture(scope="session")
+def tiny_llama(char_tokenizer):
+    """ Randomly initialized two layer Llama model over the vocabulary of char_tokenizer. """
+    transformers = pytest.importorskip("transformers")
+    torch = pytest.importorskip("torch")
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=len(char_tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=256,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
@@ -0,0 +1,59 @@
+"""
+Tests of the request batching of the hugging_face binding: BatchingScheduler._collect_batch and the per row stop.
+Requests are queued directly, so no scheduler thread runs.
+"""
+
+
+def make_request(hugging_face, temperature: float = 0.7):
+    return hugging_face.BatchedRequest([1, 2, 3], {"temperature": temperature, "max_new_tokens": 16}, 16)
+
+
+def test_same_sampling_requests_share_a_batch(hugging_face):
+    scheduler = hugging_face.BatchingScheduler(None, window_ms=0, max_batch_size=8)
+    requests = [make_request(hugging_face) for _ in range(3)]
+    for request in requests:
+        scheduler.pending.put(request)
+    assert scheduler._collect_batch() == requests
+
+
+def test_batch_size_is_capped(hugging_face):
+    scheduler = hugging_face.BatchingScheduler(None, window_ms=0, max_batch_size=2)
+    requests = [make_request(hugging_face) for _ in range(3)]
+    for request in requests:
+        scheduler.pending.put(request)
+    assert scheduler._collect_batch() == requests[:2]
+    assert scheduler._collect_batch() == requests[2:]
+
+
+def test_other_sampling_is_postponed_and_served_first(hugging_face):
+    scheduler = hugging_face.BatchingScheduler(None, window_ms=0, max_batch_size=8)
+    greedy, other, greedy_again = make_request(hugging_face, 0.1), make_request(hugging_face, 0.9), make_request(hugging_face, 0.1)
+    for request in (greedy, other, greedy_again):
+        scheduler.pending.put(request)
+    assert scheduler._collect_batch() == [greedy, greedy_again]
+    assert scheduler.postponed == [other]
+
+    late = make_request(hugging_face, 0.9)
+    scheduler.pending.put(late)
+    assert scheduler._collect_batch() == [other, late]
+    assert scheduler.postponed == []
+
+
+def test_requests_arriving_within_the_window_join_the_batch(hugging_face):
+    scheduler = hugging_face.BatchingScheduler(None, window_ms=5000, max_batch_size=2)
+    requests = [make_request(hugging_face) for _ in range(2)]
+    for request in requests:
+        scheduler.pending.put(request)
+    # A full batch doesn't wait for the end of the window
+    assert scheduler._collect_batch() == requests
+
+
+def test_rows_stop_on_their_own_request(hugging_face):
+    import torch
+    stopped, running, at_eos = (make_request(hugging_face) for _ in range(3))
+    stopped.stopped = True
+    at_eos.tokens = [5, 2]
+    criteria = hugging_face.BatchStopCriteria([stopped, running, at_eos], eos_token_ids={2})
+    done = criteria(torch.zeros((3, 4), dtype=torch.long), None)
+    assert done.tolist() == [True, False, True]
+    assert stopped.finished and at_eos.finished and not running.finished
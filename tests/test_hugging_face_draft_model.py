@@ -0,0 +1,48 @@
+"""
+Tests of the draft model checks of the hugging_face binding (_get_draft_model), on a tiny random model.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+
+@pytest.fixture
+def binding(hugging_face, tiny_llama, char_tokenizer, tmp_path):
+    binding = object.__new__(hugging_face.HuggingFaceLocal)
+    binding.binding_config = SimpleNamespace(config={"draft_model_name": "draft"})
+    binding.model, binding.tokenizer, binding.processor = tiny_llama, char_tokenizer, None
+    binding.draft_model = None
+    binding.draft_model_key = None
+    binding.warnings = []
+    binding.warning = binding.warnings.append
+    binding.info = binding.error = lambda *args, **kwargs: None
+    binding.get_local_hf_model_path = lambda name: tmp_path / name
+    return binding
+
+
+def save_draft(path, model, tokenizer):
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+
+
+def test_draft_with_the_main_tokenizer_is_loaded(binding, tiny_llama, char_tokenizer, tmp_path):
+    save_draft(tmp_path / "draft", tiny_llama, char_tokenizer)
+    assert binding._get_draft_model() is not None
+    assert binding.warnings == []
+
+
+def test_draft_with_a_permuted_vocabulary_is_refused(binding, tiny_llama, char_tokenizer, tmp_path):
+    # Same size as the main vocabulary, but two tokens swap their ids
+    vocab = {token: token_id for token, token_id in char_tokenizer.get_vocab().items() if token_id < len(char_tokenizer) - 2}
+    vocab["a"], vocab["b"] = vocab["b"], vocab["a"]
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    draft_tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>")
+    draft_tokenizer.add_special_tokens({"additional_special_tokens": ["<|im_start|>", "<|im_end|>"]})
+    assert len(draft_tokenizer) == len(char_tokenizer)
+    save_draft(tmp_path / "draft", tiny_llama, draft_tokenizer)
+
+    assert binding._get_draft_model() is None
+    assert "doesn't use the tokenizer of the main model" in binding.warnings[0]
@@ -0,0 +1,71 @@
+"""
+Tests of LocalModelIndex, the on-disk index of the local models folders of the hugging_face binding.
+"""
+import json
+import os
+
+
+def make_model_dir(path):
+    path.mkdir(parents=True)
+    (path / "config.json").write_text(json.dumps({"model_type": "llama"}), encoding="utf-8")
+    (path / "model.safetensors").write_bytes(b"weights")
+    return path
+
+
+def touch(path, mtime_ns: int):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_entries_survive_a_reload(hugging_face, tmp_path):
+    model_dir = make_model_dir(tmp_path / "models" / "model-a")
+    index = hugging_face.LocalModelIndex(tmp_path / "index" / "local_models_index.json")
+    stamp = index.model_dir_stamp(model_dir)
+    index.set(model_dir, stamp, {"is_model": True, "metadata": {"model_type": "llama"}})
+    index.save()
+
+    reloaded = hugging_face.LocalModelIndex(tmp_path / "index" / "local_models_index.json")
+    assert reloaded.get(model_dir, index.model_dir_stamp(model_dir))["metadata"] == {"model_type": "llama"}
+
+
+def test_rewritten_config_or_weights_invalidate_the_entry(hugging_face, tmp_path):
+    model_dir = make_model_dir(tmp_path / "model-a")
+    index = hugging_face.LocalModelIndex(tmp_path / "local_models_index.json")
+    dir_mtime_ns = model_dir.stat().st_mtime_ns
+    index.set(model_dir, index.model_dir_stamp(model_dir), {"is_model": True, "metadata": None})
+
+    # Rewriting files in place leaves the directory mtime unchanged
+    touch(model_dir / "config.json", 10**18)
+    touch(model_dir, dir_mtime_ns)
+    assert index.get(model_dir, index.model_dir_stamp(model_dir)) is None
+
+    index.set(model_dir, index.model_dir_stamp(model_dir), {"is_model": True, "metadata": None})
+    touch(model_dir / "model.safetensors", 10**18)
+    touch(model_dir, dir_mtime_ns)
+    assert index.get(model_dir, index.model_dir_stamp(model_dir)) is None
+
+
+def test_other_files_do_not_invalidate_the_entry(hugging_face, tmp_path):
+    model_dir = make_model_dir(tmp_path / "model-a")
+    index = hugging_face.LocalModelIndex(tmp_path / "local_models_index.json")
+    dir_mtime_ns = model_dir.stat().st_mtime_ns
+    index.set(model_dir, index.model_dir_stamp(model_dir), {"is_model": True, "metadata": None})
+    (model_dir / "README.md").write_text("notes", encoding="utf-8")
+    touch(model_dir, dir_mtime_ns)
+    assert index.get(model_dir, index.model_dir_stamp(model_dir)) is not None
+
+
+def test_prune_forgets_unseen_directories(hugging_face, tmp_path):
+    index = hugging_face.LocalModelIndex(tmp_path / "local_models_index.json")
+    kept, removed = make_model_dir(tmp_path / "kept"), make_model_dir(tmp_path / "removed")
+    for model_dir in (kept, removed):
+        index.set(model_dir, index.model_dir_stamp(model_dir), {"is_model": True, "metadata": None})
+    index.save()
+    index.prune({str(kept)})
+    assert list(index.entries) == [str(kept)]
+    assert index.dirty
+
+
+def test_index_of_another_version_is_rebuilt(hugging_face, tmp_path):
+    index_file = tmp_path / "local_models_index.json"
+    index_file.write_text(json.dumps({"version": hugging_face.LocalModelIndex.VERSION - 1, "entries": {"x": {}}}), encoding="utf-8")
+    assert hugging_face.LocalModelIndex(index_file).entries == {}
@@ -0,0 +1,61 @@
+"""
+Tests of PrefixKVCacheStore, the cross-turn KV cache reuse of the hugging_face binding.
+Caches are one layer DynamicCache objects holding one key/value position per token.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+def make_cache(hugging_face, length: int):
+    cache = hugging_face.DynamicCache()
+    states = torch.arange(length, dtype=torch.float32).reshape(1, 1, length, 1)
+    cache.update(states, states.clone(), 0)
+    return cache
+
+
+def cache_bytes(length: int) -> int:
+    return 2 * length * 4 # keys and values, float32
+
+
+def test_longest_prefix_is_taken_and_cropped(hugging_face):
+    store = hugging_face.PrefixKVCacheStore(1 << 20)
+    store.put([1, 2, 3], make_cache(hugging_face, 3))
+    store.put([1, 2, 3, 4, 5], make_cache(hugging_face, 5))
+
+    cache, reused = store.take([1, 2, 3, 4, 9, 9])
+    assert reused == 4
+    assert cache.get_seq_length() == 4
+    assert len(store.entries) == 1 # Taken out while in use
+    assert store.stats()["reused_tokens"] == 4
+
+
+def test_one_prompt_token_is_left_to_compute(hugging_face):
+    store = hugging_face.PrefixKVCacheStore(1 << 20)
+    store.put([1, 2, 3], make_cache(hugging_face, 3))
+    cache, reused = store.take([1, 2, 3])
+    assert reused == 2
+    assert cache.get_seq_length() == 2
+
+
+def test_unrelated_prompt_misses(hugging_face):
+    store = hugging_face.PrefixKVCacheStore(1 << 20)
+    store.put([1, 2, 3], make_cache(hugging_face, 3))
+    assert store.take([7, 8, 9]) == (None, 0)
+    assert store.stats()["misses"] == 1
+    assert len(store.entries) == 1
+
+
+def test_least_recently_stored_entries_are_evicted(hugging_face):
+    store = hugging_face.PrefixKVCacheStore(cache_bytes(4) + cache_bytes(4))
+    store.put([1, 1, 1, 1], make_cache(hugging_face, 4))
+    store.put([2, 2, 2, 2], make_cache(hugging_face, 4))
+    store.put([3, 3, 3, 3], make_cache(hugging_face, 4))
+    assert list(store.entries) == [(2, 2, 2, 2), (3, 3, 3, 3)]
+    assert store.size == 2 * cache_bytes(4)
+
+
+def test_cache_larger_than_the_budget_is_not_stored(hugging_face):
+    store = hugging_face.PrefixKVCacheStore(cache_bytes(4))
+    store.put([1] * 8, make_cache(hugging_face, 8))
+    assert not store.entries and store.size == 0
@@ -0,0 +1,49 @@
+"""
+Tests of the samples sharing one prefill (_generate_samples) of the hugging_face binding, on a tiny random model.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+@pytest.fixture
+def binding(hugging_face, tiny_llama, char_tokenizer):
+    # Only the attributes the samples path uses, without the lollms application around the binding
+    binding = object.__new__(hugging_face.HuggingFaceLocal)
+    binding.binding_config = SimpleNamespace(config={"prefix_cache_enabled": True, "prefix_cache_capacity_mb": 64, "kv_policy": "dynamic"})
+    binding.config = SimpleNamespace(debug=False)
+    binding.model, binding.tokenizer, binding.processor = tiny_llama, char_tokenizer, None
+    binding.prefix_cache = None
+    binding.batched_requests = set()
+    binding.generation_thread = None
+    binding._stop_generation = False
+    binding.last_generation_output = None
+    binding.info = binding.warning = binding.error = lambda *args, **kwargs: None
+    return binding
+
+
+def test_samples_leave_the_prefix_cache_entry_in_place(binding, char_tokenizer):
+    prompt = char_tokenizer.encode("<|im_start|>user\nHello there<|im_end|>\n", add_special_tokens=False)
+    turn = binding._take_prefix_cache(prompt)
+    binding._prefill_in_chunks(torch.tensor([prompt]), turn, always=True)
+    binding._store_prefix_cache(turn, torch.tensor([prompt])) # A previous turn of the discussion
+    assert len(binding.prefix_cache.entries) == 1
+
+    follow_up = torch.tensor([prompt + char_tokenizer.encode("<|im_start|>user\nAgain", add_special_tokens=False)])
+    gen_kwargs = {"max_new_tokens": 4, "do_sample": True, "eos_token_id": None, "pad_token_id": 0}
+    binding._generate_samples(follow_up, gen_kwargs, 3, None, None, [], False)
+
+    assert len(binding.last_samples) == 3
+    (key, (cache, _)), = binding.prefix_cache.entries.items()
+    assert list(key) == follow_up[0, :-1].tolist() # The prefilled prompt of the request, for the next turns
+    assert cache.get_seq_length() == follow_up.shape[1] - 1
+    assert binding.prefix_cache.take(follow_up[0].tolist() + [5])[1] == follow_up.shape[1] - 1
+
+
+def test_samples_skip_the_prefix_cache_with_other_kv_policies(binding, char_tokenizer):
+    binding.binding_config.config["kv_policy"] = "sink"
+    prompt = torch.tensor([char_tokenizer.encode("Hello", add_special_tokens=False)])
+    binding._generate_samples(prompt, {"max_new_tokens": 2, "do_sample": True, "pad_token_id": 0}, 2, None, None, [], False)
+    assert binding.prefix_cache is None
@@ -0,0 +1,64 @@
+"""
+Tests of the incompatible settings warnings of the hugging_face binding (_check_settings_compatibility).
+"""
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def check(hugging_face):
+    binding = object.__new__(hugging_face.HuggingFaceLocal)
+    binding.warning = lambda *args, **kwargs: None
+
+    def check(**settings):
+        binding.binding_config = SimpleNamespace(config=settings)
+        return binding._check_settings_compatibility()
+    return check
+
+
+def test_default_settings_are_compatible(check):
+    assert check() == []
+
+
+def test_other_backends_list_the_torch_only_settings(check):
+    problems = check(execution_backend="openvino", kv_policy="sink", prefix_cache_enabled=True, batching_enabled=True)
+    assert problems == ["The openvino backend ignores prefix_cache_enabled, kv_policy=sink (torch backend only)."]
+
+
+def test_batching_uses_a_plain_dynamic_cache(check):
+    assert check(batching_enabled=True, prefix_cache_enabled=True) == [
+        "Batched requests use a plain dynamic cache, without kv_policy, draft model nor prefix cache."
+    ]
+    assert check(batching_enabled=False, draft_model_name="draft") == []
+
+
+def test_adapters_disable_batching(check):
+    assert check(batching_enabled=True, lora_adapters="chat=adapters/chat") == [
+        "Batching is disabled while LoRA adapters are set: a batch runs a single adapter."
+    ]
+
+
+def test_sink_policy_drops_the_draft_model(check):
+    assert check(kv_policy="sink", draft_model_name="draft") == [
+        "The draft model is not used with the sink kv_policy: assisted generation crops the cache, which the sink cache can't do once it evicted tokens."
+    ]
+    assert check(kv_policy="quantized", draft_model_name="draft") == []
+
+
+def test_optimize_decode_uses_its_own_static_cache(check):
+    assert check(optimize_decode=True, draft_model_name="draft") == [
+        "optimize_decode uses its own static cache: the draft model, the prefix cache and the kv_policy are not used."
+    ]
+    assert check(optimize_decode=True) == []
+
+
+def test_prefix_cache_needs_the_dynamic_policy(check):
+    assert check(prefix_cache_enabled=True, kv_policy="quantized") == [
+        "The prefix cache is only used with the dynamic kv_policy, not quantized."
+    ]
+
+
+def test_every_conflict_is_reported(check):
+    assert len(check(batching_enabled=True, lora_adapters="chat", kv_policy="sink", draft_model_name="draft",
+                     optimize_decode=True, prefix_cache_enabled=True)) == 5
@@ -0,0 +1,67 @@
+"""
+Tests of SinkWindowCache, the cache of the sink KV policy of the hugging_face binding.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+
+@pytest.fixture
+def one_layer_llama():
+    # With a single layer, a cached key/value only depends on its token and position
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=256,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture
+def sink_cache(hugging_face):
+    if getattr(hugging_face, "SinkWindowCache", None) is None:
+        pytest.skip("The installed transformers has no cache layers")
+    return lambda model, sink, window: hugging_face.SinkWindowCache(sink, window, model.model.rotary_emb)
+
+
+def feed(model, cache, tokens):
+    with torch.no_grad():
+        for token in tokens:
+            logits = model(input_ids=torch.tensor([[token]]), past_key_values=cache, use_cache=True).logits
+    return logits[0, -1]
+
+
+def test_cache_never_holds_more_than_the_window(one_layer_llama, sink_cache):
+    cache = sink_cache(one_layer_llama, 2, 6)
+    with torch.no_grad():
+        one_layer_llama(input_ids=torch.arange(10).unsqueeze(0), past_key_values=cache, use_cache=True)
+    for token in range(10, 30):
+        feed(one_layer_llama, cache, [token])
+        assert cache.layers[0].keys.shape[-2] <= 6
+    assert cache.get_seq_length() == 30 # Positions keep counting
+
+
+def test_crop_is_refused_once_tokens_were_evicted(one_layer_llama, sink_cache):
+    cache = sink_cache(one_layer_llama, 2, 6)
+    feed(one_layer_llama, cache, range(5))
+    cache.crop(3) # Nothing evicted yet
+    assert cache.get_seq_length() == 3
+    feed(one_layer_llama, cache, range(10))
+    with pytest.raises(RuntimeError):
+        cache.crop(4)
+
+
+def test_kept_tokens_attend_as_consecutive_positions(one_layer_llama, sink_cache):
+    sink, window, tokens = 2, 6, list(range(3, 23))
+    cache = sink_cache(one_layer_llama, sink, window)
+    logits = feed(one_layer_llama, cache, tokens)
+
+    # The last step saw the sinks and the window - sink most recent tokens, right before it
+    kept = tokens[:sink] + tokens[-window + sink - 1:]
+    start = len(tokens) - len(kept)
+    with torch.no_grad():
+        reference = one_layer_llama(
+            input_ids=torch.tensor([kept]), position_ids=torch.arange(start, len(tokens)).unsqueeze(0)
+        ).logits[0, -1]
+    torch.testing.assert_close(logits, reference, atol=1e-4, rtol=1e-4)
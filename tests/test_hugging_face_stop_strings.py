@@ -0,0 +1,62 @@
+"""
+Tests of the stop strings of the hugging_face binding: StopStringFilter on streamed text and
+StopSequencesCriteria on generated token ids, with stop strings spanning chunk and token boundaries.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+def stream(stop_filter, chunks):
+    return [stop_filter.push(chunk) for chunk in chunks]
+
+
+def test_stop_string_spanning_chunks_is_cut(hugging_face):
+    stop_filter = hugging_face.StopStringFilter(["\n### User"])
+    assert stream(stop_filter, ["Answer.\n##", "# Us", "er: next", "more"]) == ["Answer.", "", "", ""]
+    assert stop_filter.stopped
+    assert stop_filter.flush() == ""
+
+
+def test_held_back_text_is_released_when_it_is_not_a_stop_string(hugging_face):
+    stop_filter = hugging_face.StopStringFilter(["\n### User"])
+    assert stream(stop_filter, ["a\n#", "#x"]) == ["a", "\n##x"]
+    assert stream(stop_filter, ["b\n###"]) == ["b"]
+    assert stop_filter.flush() == "\n###" # The generation ended without completing the stop string
+    assert not stop_filter.stopped
+
+
+def test_earliest_stop_string_wins(hugging_face):
+    stop_filter = hugging_face.StopStringFilter(["<end>", "STOP"])
+    assert stream(stop_filter, ["one STOP two <end>"]) == ["one "]
+
+
+def test_no_stop_strings_pass_everything(hugging_face):
+    stop_filter = hugging_face.StopStringFilter([""])
+    assert stream(stop_filter, ["a", "b"]) == ["a", "b"]
+
+
+def ids(tokenizer, text):
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+def test_criteria_match_stop_tokens_spanning_steps(hugging_face, char_tokenizer):
+    criteria = hugging_face.StopSequencesCriteria(char_tokenizer, ["###"], prompt_length=0)
+    assert not criteria.matches(ids(char_tokenizer, "text##"))
+    assert criteria.matches(ids(char_tokenizer, "text###"))
+    assert not hugging_face.StopSequencesCriteria(char_tokenizer, [], prompt_length=0).matches(ids(char_tokenizer, "###"))
+
+
+def test_criteria_match_stop_strings_tokenized_differently(hugging_face, char_tokenizer):
+    # The stop string encodes to one special token, the model spelled it character by character
+    criteria = hugging_face.StopSequencesCriteria(char_tokenizer, ["<|im_end|>"], prompt_length=0)
+    assert criteria.stop_ids == [ids(char_tokenizer, "<|im_end|>")]
+    assert criteria.matches([ord(character) - 31 for character in "ok<|im_end|>"])
+
+
+def test_criteria_stop_rows_individually_and_ignore_the_prompt(hugging_face, char_tokenizer):
+    prompt = ids(char_tokenizer, "Q###")
+    rows = [prompt + ids(char_tokenizer, "ab###"), prompt + ids(char_tokenizer, "abcde")]
+    criteria = hugging_face.StopSequencesCriteria(char_tokenizer, ["###"], prompt_length=len(prompt))
+    done = criteria(torch.tensor(rows), None)
+    assert done.tolist() == [True, False]
@@ -0,0 +1,88 @@
+"""
+Tests of TemplateTokenCache, the incremental tokenization of templated discussions of the hugging_face binding,
+and of the prompt encoding (_encode_text_prompt) that goes through it.
+"""
+import copy
+from types import SimpleNamespace
+
+TURN_1 = "<|im_start|>user\nHello<|im_end|>\n<|im_start|>assistant\n"
+TURN_2 = TURN_1 + "Hi, how can I help?<|im_end|>\n<|im_start|>user\nTell me a joke<|im_end|>\n<|im_start|>assistant\n"
+TURN_3 = TURN_2 + "Why did the chicken cross the road?<|im_end|>\n<|im_start|>user\nWhy?<|im_end|>\n<|im_start|>assistant\n"
+
+
+def full_tokenization(tokenizer, text):
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def reusable_length(tokenizer, text):
+    """ Tokens of an earlier rendering that are kept: up to its last special token. """
+    ids = full_tokenization(tokenizer, text)
+    return max(index + 1 for index, token in enumerate(ids) if token in tokenizer.all_special_ids)
+
+
+def test_follow_up_turn_reuses_the_previous_tokens(hugging_face, char_tokenizer):
+    cache = hugging_face.TemplateTokenCache(capacity=4)
+    assert cache.tokenize(char_tokenizer, TURN_1) == full_tokenization(char_tokenizer, TURN_1)
+    assert cache.tokenize(char_tokenizer, TURN_2) == full_tokenization(char_tokenizer, TURN_2)
+    reused = reusable_length(char_tokenizer, TURN_1)
+    assert cache.stats() == {
+        "entries": 2,
+        "reused_tokens": reused,
+        "tokenized_tokens": len(full_tokenization(char_tokenizer, TURN_1)) + len(full_tokenization(char_tokenizer, TURN_2)) - reused,
+    }
+
+
+def test_longest_cached_prefix_is_used(hugging_face, char_tokenizer):
+    cache = hugging_face.TemplateTokenCache(capacity=4)
+    cache.tokenize(char_tokenizer, TURN_1)
+    cache.tokenize(char_tokenizer, TURN_2)
+    reused = cache.stats()["reused_tokens"]
+    assert cache.tokenize(char_tokenizer, TURN_3) == full_tokenization(char_tokenizer, TURN_3)
+    assert cache.stats()["reused_tokens"] - reused == reusable_length(char_tokenizer, TURN_2)
+
+
+def test_least_recently_used_renderings_are_evicted(hugging_face, char_tokenizer):
+    cache = hugging_face.TemplateTokenCache(capacity=2)
+    for text in (TURN_1, TURN_2, "<|im_start|>user\nOther discussion<|im_end|>\n"):
+        cache.tokenize(char_tokenizer, text)
+    assert list(cache.entries) == [TURN_2, "<|im_start|>user\nOther discussion<|im_end|>\n"]
+
+
+def test_disabled_cache_tokenizes_everything(hugging_face, char_tokenizer):
+    cache = hugging_face.TemplateTokenCache(capacity=0)
+    assert cache.tokenize(char_tokenizer, TURN_1) == full_tokenization(char_tokenizer, TURN_1)
+    assert not cache.entries
+
+
+CHATML = "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+
+
+def encoding_binding(hugging_face, messages):
+    binding = object.__new__(hugging_face.HuggingFaceLocal)
+    binding.binding_config = SimpleNamespace(config={"apply_chat_template": True, "template_token_cache_size": 4})
+    binding.config = SimpleNamespace(debug=False)
+    binding.model = SimpleNamespace(device="cpu")
+    binding.template_token_cache = hugging_face.TemplateTokenCache(4)
+    binding.parse_lollms_discussion = lambda prompt: messages
+    binding.warnings = []
+    binding.warning = binding.warnings.append
+    binding.error = lambda *args, **kwargs: None
+    return binding
+
+
+def test_prompts_are_encoded_through_the_template_token_cache(hugging_face, char_tokenizer):
+    tokenizer = copy.deepcopy(char_tokenizer)
+    tokenizer.chat_template = CHATML
+    messages = [{"role": "user", "content": "Hello"}]
+    binding = encoding_binding(hugging_face, messages)
+    assert binding._encode_text_prompt("ignored", tokenizer, False)[0].tolist() == full_tokenization(tokenizer, TURN_1)
+
+    messages += [{"role": "assistant", "content": "Hi, how can I help?"}, {"role": "user", "content": "Tell me a joke"}]
+    assert binding._encode_text_prompt("ignored", tokenizer, False)[0].tolist() == full_tokenization(tokenizer, TURN_2)
+    assert binding.template_token_cache.stats()["reused_tokens"] == reusable_length(tokenizer, TURN_1)
+
+
+def test_prompts_without_chat_template_are_encoded_raw(hugging_face, char_tokenizer):
+    binding = encoding_binding(hugging_face, [])
+    assert binding._encode_text_prompt("Hello", char_tokenizer, False)[0].tolist() == char_tokenizer.encode("Hello")
+    assert binding.template_token_cache.stats()["entries"] == 0
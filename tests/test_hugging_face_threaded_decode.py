@@ -0,0 +1,45 @@
+"""
+Tests of the generation thread decode path (_generate_threaded) of the hugging_face binding, on a tiny random model.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+@pytest.fixture
+def binding(hugging_face, tiny_llama, char_tokenizer):
+    binding = object.__new__(hugging_face.HuggingFaceLocal)
+    binding.binding_config = SimpleNamespace(config={"kv_policy": "sink", "kv_sink_tokens": 4, "kv_window_tokens": 8, "draft_model_name": "draft"})
+    binding.config = SimpleNamespace(debug=False)
+    binding.execution_backend = "torch"
+    binding.model, binding.tokenizer, binding.processor = tiny_llama, char_tokenizer, None
+    binding.generation_thread = None
+    binding._stop_generation = False
+    binding.last_generation_output = None
+    binding.info = binding.warning = binding.error = lambda *args, **kwargs: None
+    return binding
+
+
+def test_streamed_chunks_make_the_output(binding, char_tokenizer):
+    binding.binding_config.config.update(kv_policy="dynamic", draft_model_name="")
+    binding._get_draft_model = lambda: None
+    chunks = []
+    input_ids = torch.tensor([char_tokenizer.encode("Hello", add_special_tokens=False)])
+    gen_kwargs = {"max_new_tokens": 6, "do_sample": False, "eos_token_id": None, "pad_token_id": 0}
+    output = binding._generate_threaded(input_ids, gen_kwargs, lambda chunk, operation: chunks.append(chunk) is None, False, [], False)
+    assert output == "".join(chunks)
+    assert binding.last_generation_output.shape[1] == input_ids.shape[1] + 6
+    assert binding.generation_thread is None
+
+
+def test_sink_policy_generates_without_the_draft_model(binding, char_tokenizer):
+    def get_draft_model():
+        raise AssertionError("The draft model can't crop the sink cache")
+    binding._get_draft_model = get_draft_model
+    input_ids = torch.tensor([char_tokenizer.encode("Hello", add_special_tokens=False)])
+    gen_kwargs = {"max_new_tokens": 6, "do_sample": False, "eos_token_id": None, "pad_token_id": 0}
+    output = binding._generate_threaded(input_ids, gen_kwargs, None, False, [], False)
+    assert not output.startswith("[Error")
+    assert binding.last_generation_output.shape[1] == input_ids.shape[1] + 6
@@ -0,0 +1,71 @@
+"""
+Tests of the dedicated embedding model of python_llama_cpp, loaded next to the chat model.
+"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeLlamaCpp:
+    """ Stands for the llama_cpp module, counts the models it loads. """
+    def __init__(self, fails: bool = False):
+        self.loads = 0
+        self.fails = fails
+
+    def Llama(self, **kwargs):
+        self.loads += 1
+        if self.fails:
+            raise ValueError("Failed to load model")
+        return SimpleNamespace(kwargs=kwargs)
+
+
+@pytest.fixture
+def binding(python_llama_cpp, tmp_path, monkeypatch):
+    binding = object.__new__(python_llama_cpp.LLAMA_Python_CPP)
+    binding.model = None
+    binding.worker_pool = None
+    binding.embedding_model = None
+    binding.embedding_model_key = None
+    binding.embedding_lock = threading.Lock()
+    binding.binding_config = SimpleNamespace(
+        embedding_model_name="embedder", embedding_batch_size=512, n_gpu_layers=0, main_gpu=0, n_threads=4,
+    )
+    binding.searches = 0
+    model_path = tmp_path / "embedder.gguf"
+
+    def find_embedding_model_path():
+        binding.searches += 1
+        return model_path
+    monkeypatch.setattr(binding, "find_embedding_model_path", find_embedding_model_path)
+    return binding
+
+
+def test_model_is_searched_and_loaded_once_per_settings(binding):
+    llama_cpp = FakeLlamaCpp()
+    model = binding.get_embedding_model(llama_cpp)
+    assert binding.get_embedding_model(llama_cpp) is model
+    assert binding.searches == 1 and llama_cpp.loads == 1
+
+    binding.binding_config.embedding_batch_size = 1024
+    assert binding.get_embedding_model(llama_cpp).kwargs["n_batch"] == 1024
+    assert binding.searches == 2 and llama_cpp.loads == 2
+
+
+def test_failed_load_is_remembered_until_the_settings_change(binding):
+    llama_cpp = FakeLlamaCpp(fails=True)
+    assert binding.get_embedding_model(llama_cpp) is None
+    assert binding.get_embedding_model(llama_cpp) is None
+    assert binding.searches == 1 and llama_cpp.loads == 1
+
+    binding.binding_config.embedding_model_name = "other_embedder"
+    llama_cpp.fails = False
+    assert binding.get_embedding_model(llama_cpp) is not None
+    assert llama_cpp.loads == 2
+
+
+def test_missing_model_is_not_searched_again(binding, monkeypatch):
+    monkeypatch.setattr(binding, "find_embedding_model_path", lambda: setattr(binding, "searches", binding.searches + 1))
+    assert binding.get_embedding_model(FakeLlamaCpp()) is None
+    assert binding.get_embedding_model(FakeLlamaCpp()) is None
+    assert binding.searches == 1
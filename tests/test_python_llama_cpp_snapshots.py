@@ -0,0 +1,125 @@
+"""
+Tests of LlamaStateSnapshotStore, the per-discussion Llama state snapshots of python_llama_cpp.
+"""
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def make_state(n_tokens: int, fill: int, seed: int = 1234):
+    payload = bytes([fill]) * (64 * n_tokens)
+    return SimpleNamespace(
+        input_ids=np.arange(n_tokens, dtype=np.intc),
+        scores=np.full((n_tokens, 3), fill, dtype=np.single),
+        n_tokens=n_tokens,
+        llama_state=payload,
+        llama_state_size=len(payload),
+        seed=seed,
+    )
+
+
+class RecordingModel:
+    """ Copies what load_state receives, the snapshot arrays are views of a mmap closed afterwards. """
+    def __init__(self):
+        self.loaded = None
+
+    def load_state(self, state):
+        self.loaded = SimpleNamespace(
+            input_ids=np.array(state.input_ids),
+            scores=np.array(state.scores),
+            n_tokens=state.n_tokens,
+            llama_state=bytes(state.llama_state),
+            seed=getattr(state, "seed", None),
+        )
+
+
+@pytest.fixture
+def clock(python_llama_cpp, monkeypatch):
+    # Strictly increasing last use times
+    ticks = itertools.count(1)
+    monkeypatch.setattr(python_llama_cpp, "time", SimpleNamespace(time=lambda: next(ticks)))
+
+
+def test_header_round_trip(python_llama_cpp, tmp_path):
+    state = make_state(5, 7, seed=42)
+    python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20).save("discussion_1", state)
+
+    model = RecordingModel()
+    store = python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20) # Reads the index back from disk
+    assert store.restore("discussion_1", model)
+    assert model.loaded.n_tokens == 5
+    assert model.loaded.input_ids.dtype == state.input_ids.dtype
+    np.testing.assert_array_equal(model.loaded.input_ids, state.input_ids)
+    np.testing.assert_array_equal(model.loaded.scores, state.scores)
+    assert model.loaded.llama_state == state.llama_state
+    assert model.loaded.seed == 42
+
+
+def test_unknown_key_is_not_restored(python_llama_cpp, tmp_path):
+    model = RecordingModel()
+    assert not python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20).restore("missing", model)
+    assert model.loaded is None
+
+
+def test_least_recently_used_snapshot_is_evicted(python_llama_cpp, tmp_path, clock):
+    store = python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20)
+    store.save("a", make_state(8, 1))
+    snapshot_size = store.size
+    store.capacity_bytes = 2 * snapshot_size
+    store.save("b", make_state(8, 2))
+    assert store.restore("a", RecordingModel()) # "a" is now more recent than "b"
+    store.save("c", make_state(8, 3))
+
+    assert "a" in store and "c" in store
+    assert "b" not in store
+    assert not (tmp_path / "b.snap").exists()
+    assert store.size <= store.capacity_bytes
+
+
+def test_async_save_is_restorable_before_and_after_the_write(python_llama_cpp, tmp_path):
+    store = python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20)
+    state = make_state(4, 9)
+    store.save_async("discussion_2", state)
+    assert "discussion_2" in store
+    model = RecordingModel()
+    assert store.restore("discussion_2", model)
+    assert model.loaded.llama_state == state.llama_state
+
+    store.flush(timeout=10)
+    assert not store.pending
+    assert (tmp_path / "discussion_2.snap").exists()
+    assert python_llama_cpp.LlamaStateSnapshotStore(tmp_path, 1 << 20).restore("discussion_2", RecordingModel())
+
+
+@pytest.fixture
+def owned_binding(python_llama_cpp):
+    """ Bare binding whose context is owned by the snapshot of discussion "a". """
+    binding = object.__new__(python_llama_cpp.LLAMA_Python_CPP)
+    binding.model = SimpleNamespace(create_chat_completion=lambda **kwargs: iter(()))
+    binding.model_load_future = None
+    binding.config = SimpleNamespace(
+        temperature=0.7, top_k=50, top_p=0.9, repeat_penalty=1.1, repeat_last_n=40,
+        start_header_id_template="!@>", start_user_header_id_template="!@>", start_ai_header_id_template="!@>",
+    )
+    binding.binding_config = SimpleNamespace(seed=-1, n_threads=4, batch_size=512)
+    binding.worker_pool = None
+    binding.prompt_cache = None
+    binding.chat_handler = None
+    binding.state_store = None
+    binding.state_owner = "a"
+    return binding
+
+
+def test_worker_pool_generation_forgets_the_state_owner(owned_binding):
+    owned_binding.worker_pool = SimpleNamespace(shutdown=lambda: None)
+    owned_binding.generate_on_worker_pool = lambda *args, **kwargs: "pooled"
+    assert owned_binding.generate("prompt") == "pooled"
+    assert owned_binding.state_owner is None
+
+
+def test_vision_generation_forgets_the_state_owner(owned_binding):
+    assert owned_binding.generate_with_images("prompt", []) == ""
+    assert owned_binding.state_owner is None
@@ -0,0 +1,77 @@
+"""
+Tests of LlamaTieredCache, the RAM + disk prompt state cache of python_llama_cpp.
+The tiers are small dict based caches following the llama_cpp BaseLlamaCache protocol, the disk tier
+pops the entries it returns like LlamaDiskCache.
+"""
+import pytest
+
+
+class FakeTier:
+    def __init__(self, pops: bool = False):
+        self.states = {}
+        self.pops = pops
+
+    @property
+    def cache_size(self):
+        return sum(len(state) for state in self.states.values())
+
+    def _find_longest_prefix_key(self, key):
+        best_key, best_len = None, 0
+        for cached_key in self.states:
+            length = 0
+            for a, b in zip(cached_key, key):
+                if a != b:
+                    break
+                length += 1
+            if length > best_len:
+                best_key, best_len = cached_key, length
+        return best_key
+
+    def __getitem__(self, key):
+        # LlamaDiskCache removes the entries it returns, LlamaRAMCache keeps them
+        return self.states.pop(tuple(key)) if self.pops else self.states[tuple(key)]
+
+    def __setitem__(self, key, value):
+        self.states[tuple(key)] = value
+
+
+@pytest.fixture
+def tiers():
+    return FakeTier(), FakeTier(pops=True)
+
+
+def test_longest_prefix_wins_across_tiers(python_llama_cpp, tiers):
+    ram, disk = tiers
+    cache = python_llama_cpp.LlamaTieredCache(ram, disk)
+    ram[(1, 2)] = b"ram"
+    disk[(1, 2, 3, 4)] = b"disk"
+    assert cache[(1, 2, 3, 4, 5)] == b"disk"
+    assert cache[(1, 2, 9)] == b"ram"
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_hit_is_promoted_to_ram(python_llama_cpp, tiers):
+    ram, disk = tiers
+    cache = python_llama_cpp.LlamaTieredCache(ram, disk)
+    disk[(1, 2, 3)] = b"state"
+    assert cache[(1, 2, 3, 4)] == b"state"
+    assert ram.states[(1, 2, 3)] == b"state"
+    assert disk.states[(1, 2, 3)] == b"state" # Still there once RAM evicts it
+
+
+def test_writes_go_through_to_disk(python_llama_cpp, tiers):
+    ram, disk = tiers
+    cache = python_llama_cpp.LlamaTieredCache(ram, disk)
+    cache[(5, 6)] = b"state"
+    assert (5, 6) in ram.states and (5, 6) in disk.states
+    assert cache.cache_size == 2 * len(b"state")
+
+
+def test_miss_without_disk_tier(python_llama_cpp, tiers):
+    ram, _ = tiers
+    cache = python_llama_cpp.LlamaTieredCache(ram)
+    assert (1, 2) not in cache
+    with pytest.raises(KeyError):
+        cache[(1, 2)]
+    assert cache.stats() == {"hits": 0, "disk_hits": 0, "misses": 1, "ram_bytes": 0, "disk_bytes": 0}